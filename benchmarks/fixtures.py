@@ -0,0 +1,227 @@
+"""
+Synthetic inputs for the benchmarks, which mimic the files on the remote
+archives closely enough for the readers, reprojectors and decoders:
+
+  * NIC binary charts of 361x361 bytes on the NIC_EASE_NH grid,
+  * SIGRID-3 `.sig` files of the southern hemisphere with runs of codes,
+  * zipped shapefiles of NIC charts with polygons attributed with CT codes,
+  * OSI SAF style NetCDF products with `ice_conc` and `status_flag` on the
+    EASE2 grids.
+"""
+import os
+import struct
+import zipfile
+from datetime import date
+
+import numpy as np
+from netCDF4 import Dataset
+
+# SIGRID codes as they occur in the charts, single concentrations, ranges
+# of concentrations and 92 for fast ice
+SIGRID_CODES = [1, 2, 10, 20, 30, 40, 50, 60, 70, 80, 90, 91, 92, 12, 13,
+                24, 35, 46, 57, 68, 79, 81, 89]
+
+WGS84_PRJ = 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",' \
+            '6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["Degree",' \
+            '0.017453292519943295]]'
+
+
+def _ice_field(shape, rng):
+    # a smooth ice concentration field decreasing towards the rim of the
+    # grid, i.e. away from the pole
+    y, x = np.indices(shape, dtype=float)
+    radius = np.hypot(y / shape[0] - .5, x / shape[1] - .5) * 2
+    conc = 100 * np.clip(1.2 - 1.5 * radius, 0, 1)
+    conc += rng.normal(0, 5, shape)
+    return np.clip(conc, 0, 100)
+
+
+def make_bin_chart(path, seed=0):
+    """
+    Writes a NIC binary chart with concentrations in steps of 5%, land (254)
+    and areas not covered (253).
+    """
+    rng = np.random.RandomState(seed)
+    conc = np.round(_ice_field((361, 361), rng) / 5) * 5
+    data = conc.astype(np.uint8)
+    y, x = np.indices(data.shape)
+    data[np.hypot(y - 180, x - 180) > 178] = 253
+    data[(y > 200) & (y < 260) & (x > 40) & (x < 120)] = 254
+    data.tofile(path)
+    return path
+
+
+def _runs(length, rng, mean_run=20):
+    # splits a line into runs of geometric length, as runs of the same code
+    # in the charts
+    runs = []
+    while length > 0:
+        run = min(length, rng.geometric(1. / mean_run), 99)
+        runs.append(run)
+        length -= run
+    return runs
+
+
+def make_sig_file(path, lines=140, line_length=1440, seed=0):
+    """
+    Writes a SIGRID-3 file of the southern hemisphere with `lines` lines of
+    latitude, each a sequence of runs of ice codes ('CT') and land ('LL').
+    """
+    rng = np.random.RandomState(seed)
+    out = [':SIGRID:S:NIC:B{0:03d}{1:04d}:'.format(lines, line_length),
+           ':=H:synthetic chart for benchmarks:']
+    for line in range(1, lines + 1):
+        rolls = []
+        for run in _runs(line_length, rng):
+            if rng.rand() < .1:
+                rolls.append('R{0:02d}LL00'.format(run))
+            else:
+                code = SIGRID_CODES[rng.randint(len(SIGRID_CODES))]
+                rolls.append('R{0:02d}CT{1:02d}'.format(run, code))
+        data_lines = [''.join(':' + r for r in rolls[i:i + 8])
+                      for i in range(0, len(rolls), 8)]
+        out.append('=K:L{0:03d}:M{1}:X{2}:'.format(line, line_length,
+                                                   len(data_lines)))
+        out.extend(data_lines)
+    out.append(':99:99:99')
+    with open(path, 'w') as fp:
+        fp.write('\r\n'.join(out) + '\r\n')
+    return path
+
+
+def _shp_header(file_length, bbox):
+    return struct.pack('>7i', 9994, 0, 0, 0, 0, 0, file_length) + \
+        struct.pack('<2i4d4d', 1000, 5, *(list(bbox) + [0.] * 4))
+
+
+def make_shapefile(path, seed=0):
+    """
+    Writes a zipped shapefile of the northern hemisphere with rectangular
+    polygons in geographic coordinates, which carry a CT attribute.
+
+    :param path: str
+        Path of the zip file, e.g. '.../arctic150105.zip'.
+    """
+    rng = np.random.RandomState(seed)
+    polygons = []
+    for lat in range(50, 90, 5):
+        for lon in range(-180, 180, 15):
+            code = SIGRID_CODES[rng.randint(len(SIGRID_CODES))]
+            polygons.append(((lon, lat, lon + 15, lat + 5), code))
+
+    records, index = [], []
+    offset = 50
+    for number, (box, _) in enumerate(polygons, 1):
+        xmin, ymin, xmax, ymax = box
+        # outer rings are clockwise
+        points = [(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin),
+                  (xmin, ymin)]
+        content = struct.pack('<i4d2ii', 5, xmin, ymin, xmax, ymax, 1,
+                              len(points), 0)
+        content += ''.join(struct.pack('<2d', *p) for p in points)
+        records.append(struct.pack('>2i', number, len(content) / 2) + content)
+        index.append(struct.pack('>2i', offset, len(content) / 2))
+        offset += 4 + len(content) / 2
+
+    bbox = (-180., 50., 180., 90.)
+    base = os.path.splitext(path)[0]
+    layer = os.path.basename(base)
+    shp = ''.join(records)
+    files = {
+        '.shp': _shp_header(50 + len(shp) / 2, bbox) + shp,
+        '.shx': _shp_header(50 + 4 * len(index), bbox) + ''.join(index),
+        '.prj': WGS84_PRJ,
+    }
+    today = date.today()
+    dbf = struct.pack('<4BIHH20x', 3, today.year - 1900, today.month,
+                      today.day, len(polygons), 32 + 32 + 1, 1 + 3)
+    dbf += struct.pack('<11sc4xBB14x', 'CT', 'N', 3, 0) + '\r'
+    dbf += ''.join(' {0:>3d}'.format(code) for _, code in polygons) + '\x1a'
+    files['.dbf'] = dbf
+
+    with zipfile.ZipFile(path, 'w') as z:
+        for extension, content in files.iteritems():
+            z.writestr(layer + extension, content)
+    return path
+
+
+def make_osisaf_nc(path, shape=(432, 432), seed=0):
+    """
+    Writes an OSI SAF style ice concentration product with the variables
+    `ice_conc` and `status_flag` of shape (1, y, x), e.g. on the EASE2 grids
+    with a file name like 'ice_conc_nh_ease2-250_cdr-v2p0_201501051200.nc'.
+    """
+    rng = np.random.RandomState(seed)
+    conc = _ice_field(shape, rng)
+    flags = np.zeros(shape, dtype=np.int8)
+    y, x = np.indices(shape)
+    flags[(y > shape[0] * .55) & (y < shape[0] * .7) &
+          (x > shape[1] * .1) & (x < shape[1] * .3)] = 1
+    flags[rng.rand(*shape) < .01] = 8
+    conc[flags == 1] = -999
+
+    dataset = Dataset(path, 'w')
+    dataset.createDimension('time', 1)
+    dataset.createDimension('yc', shape[0])
+    dataset.createDimension('xc', shape[1])
+    ice_conc = dataset.createVariable('ice_conc', 'f4', ('time', 'yc', 'xc'),
+                                      zlib=True)
+    ice_conc[0] = conc
+    status_flag = dataset.createVariable('status_flag', 'i1',
+                                         ('time', 'yc', 'xc'), zlib=True)
+    status_flag[0] = flags
+    dataset.close()
+    return path
+
+
+def _mirror_path(directory, remote_file):
+    # the place of a remote file in a mirror as laid out by `wget --mirror`
+    path = os.path.join(directory, *remote_file.split('/'))
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    return path
+
+
+def make_all(directory, steps=4, shapefiles=True):
+    """
+    Writes `steps` weekly pairs of charts and products per kind of chart into
+    a local mirror of the remote archives, see
+    `trollvalidation.data_collectors.mirror`, with the remote paths of the
+    `*_DOWNL` configurations.
+
+    :param shapefiles: bool
+        Whether to write shapefiles, which replace the binary charts of the
+        same week in the time series.
+
+    :return: dict
+        Mapping of the kind of chart ('bin', 'sig', 'shp') to lists of
+        tuples of the form (ref_time, chart path, product path).
+    """
+    pairs = {'bin': [], 'sig': [], 'shp': []}
+    for step in range(steps):
+        day = date.fromordinal(date(2015, 1, 5).toordinal() + 7 * step)
+        ref_time = day.strftime('%Y-%m-%d')
+        products = {}
+        for hemis in ['nh', 'sh']:
+            products[hemis] = make_osisaf_nc(_mirror_path(
+                directory, 'thredds.met.no/thredds/dodsC/metusers/'
+                'sicci_shared/osisaf/v2.0draftC/{0}/{1}/ice_conc_{2}_ease2-'
+                '250_cdr-v2p0_{3}1200.nc'.format(
+                    day.year, day.strftime('%m'), hemis,
+                    day.strftime('%Y%m%d'))), seed=step)
+        pairs['bin'].append((ref_time, make_bin_chart(_mirror_path(
+            directory, 'sidads.colorado.edu/pub/DATASETS/NOAA/G02172/weekly/'
+            'nic_weekly_{0}_tot.v0.bin'.format(day.strftime('%Y_%m_%d'))),
+            seed=step), products['nh']))
+        # the SIGRID files are named by year and week
+        pairs['sig'].append((ref_time, make_sig_file(_mirror_path(
+            directory, 'wdc.aari.ru/datasets/d0001/south/nic/{0}/'
+            'nic_{1}.sig'.format(day.year, day.strftime('%Y%W'))),
+            seed=step), products['sh']))
+        if shapefiles:
+            pairs['shp'].append((ref_time, make_shapefile(_mirror_path(
+                directory, 'www.natice.noaa.gov/pub/weekly/arctic/{0}/'
+                'shapefiles/hemispheric/arctic{1}.zip'.format(
+                    day.year, day.strftime('%y%m%d'))), seed=step),
+                products['nh']))
+    return pairs
@@ -0,0 +1,465 @@
+"""
+Benchmarks of the hot paths of the ice concentration validation on
+synthetic inputs, see `fixtures.py`. The inputs are written into a local
+mirror of the remote archives, so no network access is needed.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/abc1234.json
+
+The timings are saved as `benchmarks/results/<commit>.json`, so that runs
+of different commits can be compared with `--compare`.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from distutils.spawn import find_executable
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+PACKAGE_DIR = os.path.join(REPO_DIR, 'trollvalidation')
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+# seconds a fresh interpreter may take to import a module
+IMPORT_BUDGETS = {
+    'trollvalidation': 0.1,
+    'trollvalidation.data_preparation': 0.1,
+    'trollvalidation.executors': 0.1,
+    'trollvalidation.generate_plots': 0.1,
+    'trollvalidation.task_runner': 0.1,
+    'trollvalidation.validation_utils': 0.1,
+    'trollvalidation.validations.configuration': 0.05,
+    'trollvalidation.validations.ice_conc_450_validation': 0.1,
+}
+# shapefiles are reprojected and rasterized with the GDAL tools
+HAVE_GDAL = bool(find_executable('ogr2ogr') and
+                 find_executable('gdal_rasterize'))
+
+# the validation modules import some modules relative to the package dir
+sys.path[:0] = [BENCHMARKS_DIR, REPO_DIR, PACKAGE_DIR]
+# area definitions are read from etc/areas.cfg relative to the package
+os.chdir(PACKAGE_DIR)
+
+import fixtures  # noqa
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class Bench(object):
+    """
+    Times callables and collects the timings of a run.
+
+    :param repeat: int
+        Number of timed calls per benchmark.
+    """
+    def __init__(self, repeat=5):
+        super(Bench, self).__init__()
+        self.repeat = repeat
+        self.results = {}
+
+    def __call__(self, name, func, setup=None, repeat=None):
+        """
+        :param func: callable
+            Called with the arguments returned by `setup`, which is not
+            timed, e.g., to copy arrays that `func` modifies in place.
+        """
+        times = []
+        for _ in range(repeat or self.repeat):
+            args = setup() if setup else ()
+            start = time.time()
+            func(*args)
+            times.append(time.time() - start)
+        self.record(name, times)
+
+    def record(self, name, times):
+        """
+        Adds timings, which were measured elsewhere, e.g., in a subprocess.
+        """
+        self.results[name] = {'min': min(times),
+                              'median': float(np.median(times)),
+                              'repeat': len(times)}
+        print('{0:<45} min {1:9.4f}s  median {2:9.4f}s'.format(
+            name, min(times), np.median(times)))
+
+    def save(self, directory=RESULTS_DIR):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        commit = _commit()
+        path = os.path.join(directory, '{0}.json'.format(commit))
+        with open(path, 'w') as fp:
+            json.dump({'commit': commit,
+                       'date': datetime.now().isoformat(),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'machine': platform.node(),
+                       'results': self.results}, fp, indent=1, sort_keys=True)
+        return path
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as fp:
+        baseline = json.load(fp)
+    print('\nCompared to {0} ({1}):'.format(baseline['commit'],
+                                            baseline['date']))
+    for name in sorted(results):
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['min']
+        after = results[name]['min']
+        print('{0:<45} {1:9.4f}s -> {2:9.4f}s  x{3:.2f}'.format(
+            name, before, after, before / after if after else float('inf')))
+
+
+def configure(work_dir):
+    """
+    Points the configuration to the temporary working directory and turns
+    off everything that is kept between runs.
+    """
+    from trollvalidation.validations import configuration as cfg
+    cfg.INPUT_DIR = os.path.join(work_dir, 'input')
+    cfg.OUTPUT_DIR = os.path.join(work_dir, 'output')
+    cfg.TMP_DIR = os.path.join(work_dir, 'tmp')
+    for directory in (cfg.INPUT_DIR, cfg.OUTPUT_DIR, cfg.TMP_DIR):
+        os.makedirs(directory)
+    cfg.ARCHIVE_INDEX = None
+    cfg.TIMINGS_FILE = None
+    cfg.RESULTS_DIR = None
+    cfg.PROFILE_DIR = None
+    cfg.MAP_ARENA_DIR = None
+    cfg.MAP_STORE = os.path.join(cfg.OUTPUT_DIR, 'maps.h5')
+    cfg.STAGE_CACHE_DIR = None
+    cfg.COMPACT_GRIDS = False
+    # all inputs are read from a local mirror of the remote archives
+    cfg.MIRROR_DIR = os.path.join(work_dir, 'mirror')
+    cfg.MIRROR_URL = None
+    return cfg
+
+
+def import_time(module):
+    # in a fresh interpreter, which sees the same modules as this one
+    code = 'import time; t = time.time(); import {0}; ' \
+           'print(time.time() - t)'.format(module)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path[:3]))
+    return float(subprocess.check_output([sys.executable, '-c', code],
+                                         env=env))
+
+
+def bench_imports(bench):
+    """
+    Times the imports, which every worker and tool pays for, and checks them
+    against their budgets.
+    """
+    over_budget = []
+    for module, budget in sorted(IMPORT_BUDGETS.items()):
+        name = 'import {0}'.format(module)
+        bench.record(name, [import_time(module)
+                            for _ in range(bench.repeat)])
+        bench.results[name]['budget'] = budget
+        if bench.results[name]['min'] > budget:
+            over_budget.append(name)
+    for name in over_budget:
+        print('{0} is over its budget of {1}s'.format(
+            name, bench.results[name]['budget']))
+    return not over_budget
+
+
+def bench_decoders(bench, pairs):
+    from trollvalidation import data_preparation as prep
+    from trollvalidation.data_decoders.sig_reader import SIGFileReader
+    from trollvalidation.data_decoders.sigrid_decoder import DecodeSIGRIDCodes
+
+    _, sig_file, sh_product = pairs['sig'][0]
+    reader = SIGFileReader()
+    bench('sig_reader._read_sig_file', reader._read_sig_file, lambda: (
+        sig_file,), repeat=3)
+
+    orig_data = prep.handle_osi_ice_conc_nc_file(sh_product)
+    codes = np.ma.array(np.random.RandomState(0).choice(
+        fixtures.SIGRID_CODES, orig_data.shape).astype(float),
+        mask=np.ma.getmaskarray(orig_data))
+    decoder = DecodeSIGRIDCodes()
+    bench('sigrid_decoder.sigrid_decoding', decoder.sigrid_decoding,
+          lambda: (codes.copy(), orig_data))
+    bench('data_preparation.handle_osi_ice_conc_nc_file',
+          prep.handle_osi_ice_conc_nc_file, lambda: (sh_product,))
+
+
+def bench_listing(bench, files=100000):
+    """
+    Times extracting the dates of a listing of daily products, e.g. of the
+    thredds server, and pairing it with weekly charts.
+    """
+    from trollvalidation.data_collectors import colocation
+    from trollvalidation.data_collectors import tseries_generator as ts
+
+    days = np.datetime64('1979-01-01') + np.arange(files)
+    listing = ['ice_conc_nh_ease2-250_cdr-v2p0_{0}1200.nc'.format(
+        str(d).replace('-', '')) for d in days]
+    bench('tseries_generator.extract_timestamps ({0} files)'.format(files),
+          ts.extract_timestamps, lambda: (listing, r'\d{12}', '%Y%m%d%H%M'))
+    charts = days[::7] + 1
+    bench('colocation.colocate ({0} products)'.format(files),
+          colocation.colocate, lambda: (charts, days, 3, 'nearest'))
+
+
+def bench_reprojectors(bench, pairs):
+    import trollvalidation.validation_utils as util
+    from trollvalidation.data_decoders.bin_reader import BINFileReader
+    from trollvalidation.data_decoders.sig_reader import SIGFileReader
+
+    _, bin_file, nh_product = pairs['bin'][0]
+    bin_reader = BINFileReader()
+    bin_reader._read_bin_file(bin_file)
+
+    def clear_cache():
+        util._RESAMPLE_INFO.clear()
+        return bin_file, nh_product
+
+    bench('bin_reader._reproject (cold)', bin_reader._reproject, clear_cache,
+          repeat=3)
+    bench('bin_reader._reproject (warm)', bin_reader._reproject,
+          lambda: (bin_file, nh_product))
+
+    _, sig_file, sh_product = pairs['sig'][0]
+    sig_reader = SIGFileReader()
+    sig_reader._read_sig_file(sig_file)
+    bench('sig_reader._reproject', sig_reader._reproject,
+          lambda: (sig_file, sh_product), repeat=3)
+
+    if not HAVE_GDAL:
+        print('{0:<45} skipped, needs ogr2ogr and gdal_rasterize'.format(
+            'data_preparation.handle_shapefile'))
+        return
+    from trollvalidation import data_preparation as prep
+    _, shp_zip, nh_product = pairs['shp'][0]
+    orig_data = prep.handle_osi_ice_conc_nc_file(nh_product)
+
+    def unpack():
+        shp_file, _ = util.uncompress(shp_zip, tempfile.mkdtemp())
+        return shp_file, nh_product, orig_data, []
+
+    bench('data_preparation.handle_shapefile', prep.handle_shapefile, unpack,
+          repeat=3)
+
+
+def bench_metrics(bench, pairs):
+    from trollvalidation import area_masks
+    from trollvalidation import data_preparation as prep
+    from trollvalidation import validation_utils as util
+    from trollvalidation import validation_functions as val_func
+
+    _, bin_file, nh_product = pairs['bin'][0]
+    orig_data = prep.handle_osi_ice_conc_nc_file(nh_product)
+    eval_data = prep.handle_binfile(bin_file, nh_product, orig_data)
+
+    # the maps as the steps pass them to the metrics, i.e., only the valid
+    # cells
+    cells = area_masks.valid_cells(util.get_area_id(nh_product), orig_data)
+    bench('area_masks.compress', area_masks.compress,
+          lambda: (eval_data, orig_data, cells))
+    vectors = area_masks.compress(eval_data, orig_data, cells)
+
+    for name, func in inspect.getmembers(val_func, inspect.isfunction):
+        if func.__module__ != val_func.__name__:
+            continue
+        args = (eval_data, orig_data)
+        if 'threshold' in inspect.getargspec(func).args:
+            args += (10.,)
+        bench('validation_functions.{0}'.format(name), func,
+              lambda args=args: args)
+        if name == 'rmsdiff':
+            # normalized by the number of cells of the grid
+            continue
+        bench('validation_functions.{0} (valid cells)'.format(name), func,
+              lambda args=args: vectors + args[2:])
+
+
+def bench_compact(bench, pairs):
+    """
+    Compares the decoding and the metrics of a step on full maps and on
+    compact grids and reports the memory of the decoded charts.
+    """
+    from trollvalidation import area_masks
+    from trollvalidation import compact_grid
+    from trollvalidation import data_preparation as prep
+    from trollvalidation import validation_utils as util
+    from trollvalidation.validations import ice_conc_450_validation as val
+
+    for kind in ['bin', 'sig']:
+        _, chart_file, product = pairs[kind][0]
+        ext = os.path.splitext(chart_file)[1]
+        orig_data = prep.handle_osi_ice_conc_nc_file(product)
+        codes = prep.reproject_chart(prep.read_chart(chart_file), chart_file,
+                                     product, [])
+        cells = area_masks.valid_cells(util.get_area_id(product), orig_data)
+
+        def metrics(eval_data):
+            if isinstance(eval_data, compact_grid.CompactGrid):
+                vectors = eval_data.take(orig_data)
+            else:
+                vectors = area_masks.compress(eval_data, orig_data, cells)
+            return [func(*vectors) for func in val.METRICS.values()]
+
+        name = 'data_preparation.decode_chart ({0})'.format(kind)
+        bench(name, prep.decode_chart, lambda: (codes.copy(), orig_data, ext))
+        dense = prep.decode_chart(codes.copy(), orig_data, ext)
+        bench.results[name]['bytes'] = compact_grid.nbytes(dense)
+        bench('compute_metrics ({0})'.format(kind), metrics,
+              lambda: (dense,))
+
+        name = 'data_preparation.decode_compact_chart ({0})'.format(kind)
+        bench(name, prep.decode_compact_chart,
+              lambda: (codes.copy(), orig_data, ext, cells))
+        compact = prep.decode_compact_chart(codes.copy(), orig_data, ext,
+                                            cells)
+        bench.results[name]['bytes'] = compact_grid.nbytes(compact)
+        bench('compute_metrics ({0}, compact)'.format(kind), metrics,
+              lambda: (compact,))
+        print('{0:<45} {1:.2f}MB -> {2:.2f}MB'.format(
+            'decoded {0} chart'.format(kind),
+            compact_grid.nbytes(dense) / 2. ** 20,
+            compact_grid.nbytes(compact) / 2. ** 20))
+        assert compact_grid.nbytes(compact) < compact_grid.nbytes(dense), \
+            'the compact {0} chart is not smaller'.format(kind)
+        assert metrics(compact) == metrics(dense), \
+            'the metrics of the compact {0} chart differ'.format(kind)
+
+
+def _task_runner(hemis, steps, processes=1):
+    from trollvalidation import executors
+    from trollvalidation.validations import configuration as cfg
+    from trollvalidation.validations import ice_conc_450_validation as val
+
+    def run():
+        # start from empty inputs, the steps remove their temporary files
+        for directory in (cfg.INPUT_DIR, cfg.OUTPUT_DIR):
+            shutil.rmtree(directory)
+            os.makedirs(directory)
+        with executors.get_executor('local',
+                                    processes=processes) as executor:
+            results = val.ice_conc_val_task(
+                description_str='benchmark_{0}_run'.format(hemis),
+                executor=executor)
+        if len(results) != steps or not all(results):
+            raise RuntimeError('{0} of {1} steps failed'.format(
+                steps - len(filter(None, results)), steps))
+
+    return run
+
+
+def _hemispheres(pairs):
+    for hemis, kinds in (('NH', ['bin', 'shp']), ('SH', ['sig'])):
+        yield hemis, len(set(p[0] for k in kinds for p in pairs[k]))
+
+
+def bench_task(bench, pairs, processes=1):
+    """
+    Times complete offline runs of `ice_conc_val_task` per hemisphere against
+    the local mirror, i.e., listing and copying the inputs, decoding,
+    reprojecting, computing the metrics, appending the maps to the map
+    store and writing the CSV file.
+    """
+    for hemis, steps in _hemispheres(pairs):
+        bench('ice_conc_450_validation.ice_conc_val_task '
+              '({0}, {1} steps)'.format(hemis, steps),
+              _task_runner(hemis, steps, processes), repeat=1)
+
+
+def bench_compact_task(bench, pairs, processes=1):
+    """
+    Times complete runs of `ice_conc_val_task` with COMPACT_GRIDS.
+    """
+    from trollvalidation.validations import configuration as cfg
+    cfg.COMPACT_GRIDS = True
+    try:
+        for hemis, steps in _hemispheres(pairs):
+            bench('ice_conc_450_validation.ice_conc_val_task '
+                  '({0}, {1} steps, compact)'.format(hemis, steps),
+                  _task_runner(hemis, steps, processes), repeat=1)
+    finally:
+        cfg.COMPACT_GRIDS = False
+
+
+def bench_cached_task(bench, pairs, work_dir, processes=1):
+    """
+    Times reruns of `ice_conc_val_task`, whose maps are in the stage cache,
+    e.g. after changing a metric.
+    """
+    from trollvalidation.validations import configuration as cfg
+    cfg.STAGE_CACHE_DIR = os.path.join(work_dir, 'stage_cache')
+    try:
+        for hemis, steps in _hemispheres(pairs):
+            run = _task_runner(hemis, steps, processes)
+            # fill the cache
+            run()
+            bench('ice_conc_450_validation.ice_conc_val_task '
+                  '({0}, {1} steps, cached)'.format(hemis, steps), run,
+                  repeat=1)
+    finally:
+        cfg.STAGE_CACHE_DIR = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed calls per benchmark')
+    parser.add_argument('--steps', type=int, default=4,
+                        help='weekly file pairs per kind of chart')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='results of an earlier run to compare with')
+    parser.add_argument('--no-save', action='store_true',
+                        help='do not save the results')
+    parser.add_argument('--serve', action='store_true',
+                        help='read the mirror through its HTTP server')
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.INFO)
+
+    work_dir = tempfile.mkdtemp(prefix='trollvalidation_bench_')
+    server = None
+    try:
+        cfg = configure(work_dir)
+        pairs = fixtures.make_all(cfg.MIRROR_DIR, args.steps,
+                                  shapefiles=HAVE_GDAL)
+        if args.serve:
+            from trollvalidation.data_collectors import mirror
+            server = mirror.serve(cfg.MIRROR_DIR)
+            cfg.MIRROR_URL = server.url
+        bench = Bench(args.repeat)
+        bench_imports(bench)
+        bench_listing(bench)
+        bench_decoders(bench, pairs)
+        bench_reprojectors(bench, pairs)
+        bench_metrics(bench, pairs)
+        bench_compact(bench, pairs)
+        bench_task(bench, pairs)
+        bench_compact_task(bench, pairs)
+        bench_cached_task(bench, pairs, work_dir)
+    finally:
+        if server:
+            server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not args.no_save:
+        print('Saved results to {0}'.format(bench.save()))
+    if args.compare:
+        compare(bench.results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
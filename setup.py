@@ -10,6 +10,10 @@ setup(name='trollvalidation',
       author_email='rhp@dmi.dk',
       packages=find_packages(exclude=['docs']),
       install_requires=requirements,
+      entry_points={
+        'console_scripts': [
+            'trollvalidation = trollvalidation.cli:main',]
+      },
       package_data={
         '': [
             'etc/areas.cfg',]
@@ -0,0 +1,103 @@
+"""
+Valid cells of the grids of the products.
+
+Land and lakes, bits 1 and 2 of the status flags of the OSI SAF products, are
+masked in every product. They are taken from the flags of each product, as
+products on the same grid may differ in them, e.g. other products or
+versions of a product. The flat indices of the cells, which are not land or
+lake, are kept per grid and process and derived again when a product with
+other flags is read, see `update`.
+
+The metrics of a step only need the cells, which are valid in the chart and
+in the product. `compress` reduces the maps to 1-D vectors of these cells.
+It takes the valid cells of the grid first, e.g. about half of the cells of
+the EASE2 grids, so that land is skipped before the masks of the maps are
+combined.
+"""
+import logging
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+# land and lake
+STATIC_FLAGS = 1 | 2
+
+# valid cells by area id and shape
+_VALID_CELLS = {}
+
+
+def static_mask(status_flag):
+    """
+    :param status_flag: np.array
+        The status flags of a product.
+
+    :return: np.array
+        The mask of land and lakes of the product, True where masked.
+    """
+    return np.asarray(status_flag & STATIC_FLAGS != 0)
+
+
+def update(area_id, mask):
+    """
+    Derives the valid cells of a grid from the static mask of a product,
+    unless the known cells are those of the mask.
+
+    :param area_id: str
+        Id of the grid of the product, see `validation_utils.get_area_id`.
+        Nothing is kept without an id.
+    :param mask: np.array
+        The static mask of the product, see `static_mask`.
+    """
+    if area_id is None:
+        return
+    key = (area_id, mask.shape)
+    cells = _VALID_CELLS.get(key)
+    if cells is not None and len(cells) == mask.size - np.count_nonzero(mask) \
+            and not mask.ravel()[cells].any():
+        return
+    if cells is not None:
+        LOG.info('The static mask of {0} changed'.format(area_id))
+    _VALID_CELLS[key] = np.flatnonzero(~mask)
+
+
+def valid_cells(area_id, data):
+    """
+    :param data: np.ma.array
+        A product on the grid.
+
+    :return: np.array | None
+        The flat indices of the cells of the grid, which are not land or
+        lake, or None if they are not known or `data` has valid cells out
+        of them, e.g. if it is a product with other flags.
+    """
+    cells = _VALID_CELLS.get((area_id, np.shape(data)))
+    if cells is None:
+        return None
+    valid = ~np.ma.getmaskarray(data).ravel()
+    if np.count_nonzero(valid[cells]) != np.count_nonzero(valid):
+        return None
+    return cells
+
+
+def compress(eval_data, orig_data, cells=None):
+    """
+    Reduces the maps of a step to the cells, which are valid in both.
+
+    :param cells: np.array
+        Flat indices of the cells, which may be valid, see `valid_cells`.
+        All cells are considered without.
+
+    :return: tuple
+        The 1-D masked arrays (eval_data, orig_data) of the valid cells in
+        the order of the grid. Maps without valid cells are returned as they
+        are, so that the metrics are masked as before.
+    """
+    if cells is not None:
+        eval_data = eval_data.ravel()[cells]
+        orig_data = orig_data.ravel()[cells]
+    valid = ~(np.ma.getmaskarray(eval_data) | np.ma.getmaskarray(orig_data))
+    if not valid.any():
+        return eval_data, orig_data
+    return (np.ma.array(np.ma.getdata(eval_data)[valid]),
+            np.ma.array(np.ma.getdata(orig_data)[valid]))
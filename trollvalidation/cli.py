@@ -0,0 +1,359 @@
+"""
+The `trollvalidation` command, which plans and runs (parts of) a validation.
+
+    trollvalidation plan --hemisphere nh --start 2010-01-01 --end 2010-12-31
+    trollvalidation run --validation ice_conc --charts bin sig \\
+        --metrics ice_bias water_bias --workers 8
+    trollvalidation plots --append
+
+`plan` prints which steps would run, how many files and bytes would be
+downloaded and how long the run is expected to take with the step timings of
+earlier runs (`TIMINGS_FILE`). `run` prints the same plan and runs exactly the
+selected steps. With an archive index, pairs which are validated already are
+skipped unless `--all` is given, and the results of all selected dates are
+written. Pairs validated with a subset of the metrics stay pending for a run
+with all metrics.
+
+The settings are chosen as for the validation scripts, see
+`validations/configuration.py`. The metric subset is passed on to the
+workers as `TROLLVALIDATION_METRICS`, so remote workers of a distributed
+executor have to be started with the same setting.
+"""
+import argparse
+import heapq
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LOG = logging.getLogger(__name__)
+
+# validation modules and their default settings modules
+VALIDATIONS = OrderedDict([
+    ('ice_conc_450', ('ice_conc_450_validation',
+                      'ice_conc_450_configuration')),
+    ('ice_conc', ('ice_conc_validation', 'ice_conc_configuration')),
+])
+# kinds of ice charts and the extension of their files
+CHARTS = OrderedDict([('bin', '.bin'), ('sig', '.sig'), ('shp', '.zip')])
+# rough sizes in bytes of the remote files per extension, used when neither
+# the mirror nor earlier downloads tell the sizes
+DEFAULT_FILE_SIZES = {
+    '.bin': 130e3,
+    '.sig': 400e3,
+    '.zip': 1.5e6,
+    '.gz': 1.2e6,
+    '.nc': 4e6,
+}
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'not a date of the form YYYY-MM-DD: {0!r}'.format(value))
+
+
+def _extension(remote_file):
+    return os.path.splitext(remote_file)[1]
+
+
+def _human_size(num_bytes):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if num_bytes < 1000.:
+            return '{0:.1f} {1}'.format(num_bytes, unit)
+        num_bytes /= 1000.
+    return '{0:.1f} TB'.format(num_bytes)
+
+
+def select_pairs(tasks, start=None, end=None, charts=None):
+    """
+    :param tasks: OrderedDict
+        Mapping of 'nh'/'sh' to the file pairs of the hemisphere.
+    :param start: str
+        First reference date, 'YYYY-MM-DD', of the selected pairs.
+    :param end: str
+        Last reference date, 'YYYY-MM-DD', of the selected pairs.
+    :param charts: list
+        Extensions of the selected ice charts, e.g. ['.bin', '.zip'].
+
+    :return: OrderedDict
+        The selected file pairs per hemisphere.
+    """
+    def selected(file_pair):
+        ref_time, eval_file = file_pair[0], file_pair[1]
+        return ((not start or ref_time >= start) and
+                (not end or ref_time <= end) and
+                (not charts or _extension(eval_file) in charts))
+
+    return OrderedDict((hemis, filter(selected, file_pairs))
+                       for hemis, file_pairs in tasks.iteritems())
+
+
+def downloads(tasks):
+    """
+    :return: list
+        The remote files of the file pairs, which are not in `INPUT_DIR`
+        yet. Products on THREDDS servers are read remotely unless they are
+        mirrored.
+    """
+    from trollvalidation.data_collectors import mirror
+    from trollvalidation.validations import configuration as cfg
+
+    remote_files = OrderedDict()
+    for file_pairs in tasks.itervalues():
+        for _, eval_file, orig_file in file_pairs:
+            remote_files[eval_file] = True
+            if 'thredds' not in orig_file or mirror.enabled():
+                remote_files[orig_file] = True
+    return [f for f in remote_files if not os.path.isfile(
+        os.path.join(cfg.INPUT_DIR, os.path.basename(f)))]
+
+
+def download_size(remote_files):
+    """
+    :return: int
+        Expected number of bytes of the remote files. Mirrored files are
+        measured, the other ones are estimated from the files of the same
+        kind in `INPUT_DIR` or `DEFAULT_FILE_SIZES`.
+    """
+    from trollvalidation.data_collectors import mirror
+    from trollvalidation.validations import configuration as cfg
+
+    local_sizes = {}
+    if os.path.isdir(cfg.INPUT_DIR):
+        for name in os.listdir(cfg.INPUT_DIR):
+            path = os.path.join(cfg.INPUT_DIR, name)
+            if os.path.isfile(path):
+                local_sizes.setdefault(_extension(name), []).append(
+                    os.path.getsize(path))
+
+    total = 0
+    for remote_file in remote_files:
+        source = mirror.resolve(remote_file)
+        kind = _extension(remote_file)
+        if os.path.isfile(source):
+            total += os.path.getsize(source)
+        elif kind in local_sizes:
+            total += sum(local_sizes[kind]) / len(local_sizes[kind])
+        else:
+            total += DEFAULT_FILE_SIZES.get(kind, 1e6)
+    return int(total)
+
+
+def expected_time(file_pairs, workers, model):
+    """
+    :param model: CostModel
+        Step timings of earlier runs.
+
+    :return: float
+        Expected wall time in seconds of the steps on `workers` workers,
+        which take the most expensive remaining step whenever they are idle.
+    """
+    loads = [0.] * max(workers, 1)
+    for file_pair in model.schedule(file_pairs):
+        heapq.heappush(loads, heapq.heappop(loads) +
+                       model.estimate(file_pair))
+    return max(loads)
+
+
+def plan(tasks, workers):
+    """
+    :return: dict
+        The number of steps per hemisphere and chart, the files and bytes
+        to download and the expected time of the run.
+    """
+    from trollvalidation.task_runner import CostModel
+    from trollvalidation.validations import configuration as cfg
+
+    steps = OrderedDict()
+    for hemis, file_pairs in tasks.iteritems():
+        steps[hemis] = OrderedDict(
+            (chart, sum(1 for p in file_pairs if _extension(p[1]) == ext))
+            for chart, ext in CHARTS.iteritems())
+    remote_files = downloads(tasks)
+    model = CostModel(getattr(cfg, 'TIMINGS_FILE', None))
+    return {
+        'steps': steps,
+        'dates': dict((hemis, (min(p[0] for p in file_pairs),
+                               max(p[0] for p in file_pairs)))
+                      for hemis, file_pairs in tasks.iteritems()
+                      if file_pairs),
+        'downloads': len(remote_files),
+        'bytes': download_size(remote_files),
+        'seconds': expected_time([p for file_pairs in tasks.itervalues()
+                                  for p in file_pairs], workers, model),
+        'workers': workers,
+    }
+
+
+def print_plan(validation, run_plan):
+    print('Validation {0} with {1} worker(s)'.format(validation,
+                                                      run_plan['workers']))
+    for hemis, charts in run_plan['steps'].iteritems():
+        first, last = run_plan['dates'].get(hemis, ('-', '-'))
+        print('  {0}: {1} steps from {2} to {3} ({4})'.format(
+            hemis.upper(), sum(charts.values()), first, last,
+            ', '.join('{0}: {1}'.format(c, n) for c, n in charts.iteritems()
+                      if n) or 'nothing to do'))
+    print('Files to download: {0} ({1})'.format(
+        run_plan['downloads'], _human_size(run_plan['bytes'])))
+    print('Expected time: {0}'.format(
+        timedelta(seconds=int(run_plan['seconds']))))
+
+
+def _workers(args):
+    from trollvalidation.validations import configuration as cfg
+    executor_cfg = getattr(cfg, 'EXECUTOR', {})
+    return (args.workers or executor_cfg.get('processes') or
+            executor_cfg.get('local_workers') or multiprocessing.cpu_count())
+
+
+def _configure(args):
+    """
+    Chooses the settings before they are read the first time and prepares
+    the process to import the validation modules.
+    """
+    validation_module, settings = VALIDATIONS[args.validation]
+    if args.config:
+        settings = os.path.abspath(args.config) \
+            if os.path.isfile(args.config) else args.config
+        os.environ['TROLLVALIDATION_CONFIG'] = settings
+    elif 'TROLLVALIDATION_CONFIG' not in os.environ:
+        os.environ['TROLLVALIDATION_CONFIG'] = settings
+    if getattr(args, 'metrics', None):
+        os.environ['TROLLVALIDATION_METRICS'] = json.dumps(args.metrics)
+    if getattr(args, 'directory', None):
+        args.directory = os.path.abspath(args.directory)
+
+    # the validations import some modules relative to the package
+    if PACKAGE_DIR not in sys.path:
+        sys.path.append(PACKAGE_DIR)
+    return importlib.import_module('trollvalidation.validations.' +
+                                   validation_module)
+
+
+def _tasks(args, validation):
+    from trollvalidation.data_collectors import tseries_generator as ts
+
+    unknown = set(args.metrics or []) - set(validation.METRICS)
+    if unknown:
+        raise SystemExit('Unknown metrics {0}, choose from {1}'.format(
+            ', '.join(sorted(unknown)), ', '.join(validation.METRICS)))
+    nh_pairs, sh_pairs = ts.generate_time_series(pending_only=False)
+    tasks = OrderedDict((hemis, file_pairs) for hemis, file_pairs in
+                        [('nh', nh_pairs), ('sh', sh_pairs)]
+                        if hemis in args.hemisphere)
+    tasks = select_pairs(tasks, args.start, args.end,
+                         [CHARTS[c] for c in args.charts or []])
+    # the results of all selected dates are reported, also of those
+    # validated in earlier runs
+    report = dict((hemis, [el[0] for el in file_pairs])
+                  for hemis, file_pairs in tasks.iteritems())
+    if not args.all:
+        tasks = ts.pending_pairs(tasks)
+    return tasks, report
+
+
+def plan_command(args):
+    validation = _configure(args)
+    tasks, _ = _tasks(args, validation)
+    print_plan(args.validation, plan(tasks, _workers(args)))
+
+
+def run_command(args):
+    validation = _configure(args)
+    tasks, report = _tasks(args, validation)
+    workers = _workers(args)
+    print_plan(args.validation, plan(tasks, workers))
+    if not any(tasks.values()):
+        return
+    validation.run_validation(tasks, args.resume, args.stream, args.workers,
+                              report)
+
+
+def plots_command(args):
+    _configure(args)
+    from trollvalidation import generate_plots
+    from trollvalidation.validations import configuration as cfg
+    generate_plots.generate_plots(args.directory or cfg.OUTPUT_DIR,
+                                  args.workers, args.append)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='trollvalidation', description=__doc__.split('\n\n')[0])
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--validation', choices=VALIDATIONS.keys(),
+                        default='ice_conc_450',
+                        help='the validation to run (default: %(default)s)')
+    common.add_argument('--config', metavar='SETTINGS',
+                        help='name of a settings module in '
+                             'trollvalidation.validations or path of a '
+                             'settings file (default: the settings of the '
+                             'validation)')
+    common.add_argument('--workers', type=int,
+                        help='number of worker processes (default: as '
+                             'configured by EXECUTOR or one per CPU)')
+
+    select = argparse.ArgumentParser(add_help=False, parents=[common])
+    select.add_argument('--hemisphere', nargs='+', choices=['nh', 'sh'],
+                        default=['nh', 'sh'])
+    select.add_argument('--start', type=_date, metavar='YYYY-MM-DD',
+                        help='first reference date')
+    select.add_argument('--end', type=_date, metavar='YYYY-MM-DD',
+                        help='last reference date')
+    select.add_argument('--charts', nargs='+', choices=CHARTS.keys(),
+                        help='kinds of ice charts (default: all)')
+    select.add_argument('--metrics', nargs='+', metavar='METRIC',
+                        help='metrics to compute, e.g. ice_bias water_bias '
+                             '(default: all)')
+    select.add_argument('--all', action='store_true',
+                        help='include pairs, which the archive index lists '
+                             'as validated already')
+
+    commands = parser.add_subparsers()
+    plan_parser = commands.add_parser(
+        'plan', parents=[select], help='estimate the downloads and time of a '
+                                       'run without running it')
+    plan_parser.set_defaults(func=plan_command)
+
+    run_parser = commands.add_parser(
+        'run', parents=[select], help='run the selected validation steps')
+    run_parser.add_argument('--resume', action='store_true',
+                            help='continue an interrupted run')
+    run_parser.add_argument('--stream', action='store_true',
+                            help='write the results while the steps finish')
+    run_parser.set_defaults(func=run_command)
+
+    plots_parser = commands.add_parser(
+        'plots', parents=[common], help='plot the results of the validation')
+    plots_parser.add_argument('--directory',
+                              help='directory of the result CSV files '
+                                   '(default: OUTPUT_DIR)')
+    plots_parser.add_argument('--append', action='store_true',
+                              help='only plot reports and years, which '
+                                   'changed since the last call')
+    plots_parser.set_defaults(func=plots_command)
+    return parser
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    # before the validation modules configure logging
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(process)d: %(levelname)s: %(asctime)s: '
+                               '%(name)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
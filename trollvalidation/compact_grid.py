@@ -0,0 +1,192 @@
+"""
+Compact representation of the maps of a validation step.
+
+Most cells of a hemispheric grid are land, outside of the chart or masked
+in the product. A `CompactGrid` keeps only the valid cells of a map: which
+cells are valid and their values. The valid cells are stored as flat indices
+into the grid if few cells are valid and as bitmask of the grid otherwise,
+whichever is smaller. Values on half-percent steps in [0, 127.5], e.g. the
+concentrations of charts and SIGRID codes, are stored as uint8. The other
+values, e.g. the product's concentrations in the interval cells of a chart or
+codes which are not decoded, are kept exactly in their own type with their
+positions, or all values are if most of them are not on these steps. So the
+metrics on a compact grid equal those on the full map.
+
+With COMPACT_GRIDS in the configuration the charts are decoded on the cells,
+which are valid in the reprojected chart and in the product, only. The
+decoded chart is passed on as `CompactGrid` to the metrics, which run on the
+vectors of its cells, kept in the stage cache as such and only expanded to a
+full map, when it is written to the map store or dumped. A map, whose
+compact form would be larger than the map itself, is kept as it is, see
+`shrink`.
+"""
+import numpy as np
+
+# steps of the concentrations stored as uint8
+CONC_STEP = 0.5
+
+
+class CompactGrid(object):
+    """
+    :param shape: tuple
+        Shape of the grid.
+    :param index: np.array
+        Sorted flat indices of the valid cells.
+    :param values: np.array
+        Values of the valid cells.
+    :param dtype: np.dtype
+        Type of the values of the map. Defaults to the type of `values`.
+    """
+    def __init__(self, shape, index, values, dtype=None):
+        super(CompactGrid, self).__init__()
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype or values.dtype)
+        size = int(np.prod(self.shape))
+        index = np.asarray(index)
+        if 4 * len(index) > (size + 7) // 8:
+            mask = np.zeros(size, dtype=bool)
+            mask[index] = True
+            self._bits = np.packbits(mask)
+            self._index = None
+        else:
+            # the grids have less than 2**31 cells
+            self._bits = None
+            self._index = index.astype(np.int32)
+        self.values, self.scale, self._others = _pack(values)
+
+    @classmethod
+    def from_masked(cls, data, cells=None):
+        """
+        :param data: np.array | np.ma.array
+            A map.
+        :param cells: np.array
+            Flat indices of the cells, which may be valid, e.g. the cells
+            of the grid, which are not land, see `area_masks.valid_cells`.
+            All cells are considered without.
+        """
+        flat = data.ravel()
+        if cells is None:
+            index = np.flatnonzero(~np.ma.getmaskarray(flat))
+        else:
+            index = cells[~np.ma.getmaskarray(flat[cells])]
+        return cls(data.shape, index, np.ma.getdata(flat)[index], data.dtype)
+
+    @property
+    def index(self):
+        """
+        The sorted flat indices of the valid cells.
+        """
+        if self._index is not None:
+            return self._index
+        size = int(np.prod(self.shape))
+        return np.flatnonzero(np.unpackbits(self._bits)[:size])
+
+    @property
+    def nbytes(self):
+        index = self._index if self._index is not None else self._bits
+        return index.nbytes + self.values.nbytes + \
+            sum(a.nbytes for a in self._others)
+
+    def data(self):
+        """
+        :return: np.array
+            A copy of the values of the valid cells in the type of the map.
+        """
+        if self.scale == 1:
+            data = self.values.astype(self.dtype)
+        else:
+            data = (self.values * self.scale).astype(self.dtype)
+        if self._others:
+            positions, others = self._others
+            data[positions] = others
+        return data
+
+    def take(self, data):
+        """
+        :param data: np.array | np.ma.array
+            A map of the same grid, e.g. of the product.
+
+        :return: tuple
+            The 1-D masked arrays (values, values of `data`) of the cells,
+            which are valid in both, as the metrics need them.
+        """
+        flat = data.ravel()[self.index]
+        valid = ~np.ma.getmaskarray(flat)
+        if not valid.any():
+            return (np.ma.masked_all((0,), self.dtype),
+                    np.ma.masked_all((0,), data.dtype))
+        return (np.ma.array(self.data()[valid]),
+                np.ma.array(np.ma.getdata(flat)[valid]))
+
+    def to_masked(self):
+        """
+        :return: np.ma.array
+            The full map, masked outside of the valid cells.
+        """
+        index = self.index
+        data = np.zeros(int(np.prod(self.shape)), dtype=self.dtype)
+        data[index] = self.data()
+        mask = np.ones(data.shape, dtype=bool)
+        mask[index] = False
+        return np.ma.array(data.reshape(self.shape),
+                           mask=mask.reshape(self.shape))
+
+    def __repr__(self):
+        return '<CompactGrid {0} of {1} cells, {2} bytes>'.format(
+            len(self.index), 'x'.join(str(n) for n in self.shape),
+            self.nbytes)
+
+
+def _pack(values):
+    """
+    :return: tuple
+        The values as uint8, their scale and a tuple (positions, values) of
+        the values, which are not on the steps, or an empty tuple. If that
+        takes more memory than the values, they are returned as they are.
+    """
+    values = np.asarray(values)
+    if values.dtype == np.uint8 or not len(values):
+        return values.astype(np.uint8), 1, ()
+    if values.dtype.kind in 'iu':
+        if values.min() >= 0 and values.max() <= 255:
+            return values.astype(np.uint8), 1, ()
+        return values, 1, ()
+    steps = np.round(values / CONC_STEP)
+    with np.errstate(invalid='ignore'):
+        # NaN is never on a step
+        on_steps = (steps >= 0) & (steps <= 255) & \
+            (steps * CONC_STEP == values)
+    positions = np.flatnonzero(~on_steps).astype(np.int32)
+    if not len(positions):
+        return steps.astype(np.uint8), CONC_STEP, ()
+    itemsize = values.dtype.itemsize
+    if len(positions) * (positions.itemsize + itemsize) >= \
+            len(values) * (itemsize - 1):
+        return values, 1, ()
+    packed = np.where(on_steps, steps, 0).astype(np.uint8)
+    return packed, CONC_STEP, (positions, values[positions])
+
+
+def shrink(grid):
+    """
+    :param grid: CompactGrid
+
+    :return: CompactGrid | np.ma.array
+        The grid or its full map if that takes less memory.
+    """
+    size = int(np.prod(grid.shape))
+    if grid.nbytes < size * (grid.dtype.itemsize + 1):
+        return grid
+    return grid.to_masked()
+
+
+def nbytes(data):
+    """
+    :return: int
+        Bytes of a map, of its data and mask if it is a masked array.
+    """
+    if isinstance(data, CompactGrid):
+        return data.nbytes
+    mask = np.ma.getmask(data)
+    return np.ma.getdata(data).nbytes + \
+        (mask.nbytes if mask is not np.ma.nomask else 0)
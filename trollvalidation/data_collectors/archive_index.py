@@ -0,0 +1,310 @@
+"""
+Persistent catalogue of the remote archives a validation is run on.
+
+The index is a small SQLite database, which maps reference dates to chart
+and product files per hemisphere, remembers where the files were stored
+locally and keeps track of the processing state of each validation pair.
+Pairing of charts and products is an indexed join on the database and
+reruns only have to process pairs, which are not validated yet or whose
+inputs or code version changed.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DOWNLOADED = 'downloaded'
+DECODED = 'decoded'
+VALIDATED = 'validated'
+# validated with a subset of the metrics, still pending for a full run
+PARTIAL = 'partial'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    kind TEXT NOT NULL,
+    hemisphere TEXT NOT NULL,
+    ref_date TEXT NOT NULL,
+    url TEXT NOT NULL,
+    local_path TEXT,
+    checksum TEXT,
+    PRIMARY KEY (kind, hemisphere, ref_date)
+);
+CREATE INDEX IF NOT EXISTS files_url ON files (url);
+
+CREATE TABLE IF NOT EXISTS pairs (
+    hemisphere TEXT NOT NULL,
+    ref_date TEXT NOT NULL,
+    chart_url TEXT NOT NULL,
+    product_url TEXT NOT NULL,
+    status TEXT NOT NULL,
+    code_version TEXT,
+    metrics TEXT,
+    updated TEXT,
+    PRIMARY KEY (hemisphere, ref_date)
+);
+CREATE INDEX IF NOT EXISTS pairs_chart_url ON pairs (chart_url);
+CREATE INDEX IF NOT EXISTS pairs_product_url ON pairs (product_url);
+"""
+
+
+def file_checksum(path, block_size=2 ** 20):
+    """
+    Computes the MD5 checksum of a local file.
+
+    :param path: str
+        Path to a local file.
+
+    :return: str
+        The hex digest of the file's content.
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def _to_json(row):
+    # masked values, e.g. a bias over an empty set, are stored as null
+    return json.dumps([None if v is np.ma.masked else v for v in row])
+
+
+def _from_json(text):
+    return [np.ma.masked if v is None else v for v in json.loads(text)]
+
+
+class ArchiveIndex(object):
+    """
+    SQLite backed catalogue of charts, products and validation pairs.
+
+    :param path: str
+        Path to the SQLite database. It is created if it does not exist.
+    :param code_version: str
+        Version of the validation code. Pairs validated with another
+        version are considered pending again.
+    """
+    def __init__(self, path, code_version=None):
+        super(ArchiveIndex, self).__init__()
+        self.path = path
+        self.code_version = code_version
+        # workers update the index concurrently, so wait for locks
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def register_timeseries(self, kind, timeseries):
+        """
+        Stores a time series as generated by the `tseries_generator`.
+
+        :param kind: str
+            Either 'chart' for evaluation files or 'product' for original
+            files.
+        :param timeseries: dict
+            Mapping of hemisphere to an ordered mapping of reference date
+            strings to remote file URLs.
+        """
+        rows = [(url, kind, hemis, ref_date)
+                for hemis, tser in timeseries.iteritems()
+                for ref_date, url in tser.iteritems()]
+        with self.connection as con:
+            # forget local copies of files which changed on the remote side
+            con.executemany('UPDATE files SET url = ?, local_path = NULL, '
+                            'checksum = NULL WHERE kind = ? AND '
+                            'hemisphere = ? AND ref_date = ? AND url != ?',
+                            [r + (r[0],) for r in rows])
+            con.executemany('INSERT OR IGNORE INTO files (url, kind, '
+                            'hemisphere, ref_date) VALUES (?, ?, ?, ?)', rows)
+
+    def pair(self):
+        """
+        Joins charts and products on hemisphere and reference date and
+        registers new or changed pairs as pending.
+
+        :return: OrderedDict
+            Mapping of hemisphere to a list of tuples of the form
+            (ref_date, chart_url, product_url) sorted by reference date.
+        """
+        joined = self.connection.execute(
+            "SELECT c.hemisphere, c.ref_date, c.url, p.url FROM files c "
+            "JOIN files p ON p.kind = 'product' AND "
+            "p.hemisphere = c.hemisphere AND p.ref_date = c.ref_date "
+            "WHERE c.kind = 'chart' ORDER BY c.hemisphere, c.ref_date"
+        ).fetchall()
+
+        validation_pairs = OrderedDict()
+        for hemis, ref_date, chart_url, product_url in joined:
+            validation_pairs.setdefault(hemis, []).append(
+                (ref_date, chart_url, product_url))
+        self.register_pairs(validation_pairs)
+        return validation_pairs
+
+    def register_pairs(self, validation_pairs):
+        """
+        Registers new or changed pairs as pending, e.g. the pairs of
+        charts and products co-located within a window of days.
+
+        :param validation_pairs: dict
+            Mapping of hemisphere to a list of tuples of the form
+            (ref_date, chart_url, product_url).
+        """
+        joined = [(h, d, c, p) for h, file_pairs in validation_pairs.iteritems()
+                  for d, c, p in file_pairs]
+
+        known = dict(((h, d), (c, p)) for h, d, c, p in self.connection.execute(
+            'SELECT hemisphere, ref_date, chart_url, product_url FROM pairs'))
+
+        changed = [(c, p, PENDING, h, d) for h, d, c, p in joined
+                   if (h, d) in known and known[(h, d)] != (c, p)]
+        new = [(h, d, c, p, PENDING) for h, d, c, p in joined
+               if (h, d) not in known]
+        with self.connection as con:
+            con.executemany('UPDATE pairs SET chart_url = ?, product_url = ?, '
+                            'status = ?, metrics = NULL WHERE hemisphere = ? '
+                            'AND ref_date = ?', changed)
+            con.executemany('INSERT INTO pairs (hemisphere, ref_date, '
+                            'chart_url, product_url, status) '
+                            'VALUES (?, ?, ?, ?, ?)', new)
+        LOG.info('Archive index: {0} pairs, {1} new, {2} changed'.format(
+            len(joined), len(new), len(changed)))
+
+    def pending(self, hemisphere):
+        """
+        :return: set
+            The reference dates of all pairs of a hemisphere, which are not
+            validated with the current code version.
+        """
+        rows = self.connection.execute(
+            'SELECT ref_date FROM pairs WHERE hemisphere = ? AND '
+            '(status != ? OR code_version IS NOT ?)',
+            (hemisphere, VALIDATED, self.code_version))
+        return set(r[0] for r in rows)
+
+    def record_file(self, url, local_path):
+        """
+        Remembers the local copy of a remote file and its checksum. If the
+        checksum differs from the one seen before, all pairs using the file
+        are set back to pending.
+        """
+        checksum = file_checksum(local_path)
+        with self.connection as con:
+            previous = con.execute('SELECT checksum FROM files WHERE url = ?',
+                                   (url,)).fetchall()
+            con.execute('UPDATE files SET local_path = ?, checksum = ? '
+                        'WHERE url = ?', (local_path, checksum, url))
+            if any(p[0] and p[0] != checksum for p in previous):
+                LOG.info('Input {0} changed, revalidating'.format(url))
+                con.execute('UPDATE pairs SET status = ? WHERE '
+                            'chart_url = ? OR product_url = ?',
+                            (PENDING, url, url))
+        return checksum
+
+    def checksums(self, urls):
+        """
+        :return: dict
+            The checksums of the local copies of remote files by URL, as
+            recorded by `record_file`, for the files which were fetched.
+        """
+        urls = list(urls)
+        rows = self.connection.execute(
+            'SELECT url, checksum FROM files WHERE url IN ({0})'.format(
+                ', '.join('?' * len(urls))), urls)
+        return dict((url, checksum) for url, checksum in rows if checksum)
+
+    def mark(self, chart_url, status):
+        """
+        Sets the processing status of the pair(s) using the given chart.
+        """
+        with self.connection as con:
+            con.execute('UPDATE pairs SET status = ?, updated = ? WHERE '
+                        'chart_url = ?', (status, datetime.now().isoformat(),
+                                          chart_url))
+
+    def record_results(self, hemisphere, file_pairs, results, complete=True):
+        """
+        Stores the result rows of a validation task. Steps which returned
+        no result are marked as failed.
+
+        :param file_pairs: list
+            Tuples of the form (ref_date, chart_url, product_url).
+        :param results: list
+            The result row of each step in the same order as `file_pairs`.
+        :param complete: bool
+            False if the rows hold a subset of the metrics only. The pairs
+            are marked as partial then and stay pending.
+        """
+        now = datetime.now().isoformat()
+        status = VALIDATED if complete else PARTIAL
+        rows = []
+        for (ref_date, _, _), result in zip(file_pairs, results):
+            if result:
+                rows.append((status, self.code_version, _to_json(result),
+                             now, hemisphere, ref_date))
+            else:
+                rows.append((FAILED, self.code_version, None, now,
+                             hemisphere, ref_date))
+        with self.connection as con:
+            con.executemany('UPDATE pairs SET status = ?, code_version = ?, '
+                            'metrics = ?, updated = ? WHERE hemisphere = ? '
+                            'AND ref_date = ?', rows)
+
+    def results(self, hemisphere, ref_dates=None):
+        """
+        :param ref_dates: list
+            Reference dates to return the rows of, e.g. the dates of a run.
+            All dates without.
+
+        :return: list
+            The stored result rows of the validated pairs of a hemisphere
+            sorted by reference date, including those of partial runs.
+        """
+        rows = self.connection.execute(
+            'SELECT ref_date, metrics FROM pairs WHERE hemisphere = ? AND '
+            'status IN (?, ?) ORDER BY ref_date',
+            (hemisphere, VALIDATED, PARTIAL))
+        if ref_dates is not None:
+            ref_dates = set(ref_dates)
+            rows = (r for r in rows if r[0] in ref_dates)
+        return [_from_json(r[1]) for r in rows]
+
+
+class IndexSink(object):
+    """
+    Stores result rows of a hemisphere in the archive index one by one,
+    e.g. while a task streams its results.
+    """
+    def __init__(self, index, hemisphere, complete=True):
+        super(IndexSink, self).__init__()
+        self.index = index
+        self.hemisphere = hemisphere
+        self.complete = complete
+
+    def append(self, row):
+        self.index.record_results(self.hemisphere, [(row[0], None, None)],
+                                  [row], self.complete)
+
+
+def open_index(cfg):
+    """
+    Opens the archive index configured by `ARCHIVE_INDEX` and
+    `CODE_VERSION` in a validation configuration.
+
+    :return: ArchiveIndex | None
+        None if the configuration does not use an archive index.
+    """
+    path = getattr(cfg, 'ARCHIVE_INDEX', None)
+    if not path:
+        return None
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    return ArchiveIndex(path, getattr(cfg, 'CODE_VERSION', None))
@@ -0,0 +1,153 @@
+"""
+Temporal co-location of charts and products.
+
+Charts and products are paired by their dates within a tolerance window
+instead of by equal date strings, so that a chart dated a day before or
+after a product is still validated. The dates are sorted `datetime64`
+arrays and the products within the window of every chart are found with
+`searchsorted`, i.e., in O((n + m) log m) for n charts and m products, which
+scales to archives of hundreds of thousands of daily products.
+
+A chart is paired either with the nearest product in its window or with all
+products in its window, e.g. a weekly chart with the daily products of its
+week. Every match has a weight, which decreases with the distance of the
+dates and sums up to one over the products of a chart.
+"""
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+MODES = ['nearest', 'all']
+
+
+def to_datetime64(dates):
+    """
+    :param dates: list
+        Dates as strings of the form '%Y-%m-%d'.
+
+    :return: numpy.ndarray
+        The dates as array of dtype 'datetime64[D]'.
+    """
+    return np.array(list(dates), dtype='datetime64[D]')
+
+
+def colocate(chart_dates, product_dates, window=0, mode='nearest'):
+    """
+    Matches charts and products, whose dates differ by at most `window`
+    days.
+
+    :param chart_dates: numpy.ndarray
+        Dates of the charts, see `to_datetime64`.
+    :param product_dates: numpy.ndarray
+        Dates of the products, in any order.
+    :param window: int
+        Maximal difference of the dates in days. 0 pairs equal dates only.
+    :param mode: str
+        'nearest' to match every chart with the nearest product, the
+        earlier one of two equally near products, or 'all' to match every
+        chart with all products in its window.
+
+    :return: tuple
+        Arrays (chart_idx, product_idx, offset, weight) of the matches in
+        the order of the charts and, per chart, of the product dates: the
+        indices into the given dates, the date of the product minus the
+        date of the chart in days and the weight of the product for the
+        chart.
+
+    :raises: ValueError
+        If the mode is unknown.
+    """
+    if mode not in MODES:
+        raise ValueError('Unknown co-location mode {0}, choose from '
+                         '{1}'.format(mode, ', '.join(MODES)))
+    chart_days = np.asarray(chart_dates, 'datetime64[D]').astype(np.int64)
+    product_days = np.asarray(product_dates, 'datetime64[D]').astype(np.int64)
+    if not len(chart_days) or not len(product_days):
+        empty = np.array([], dtype=np.intp)
+        return empty, empty, empty.astype(np.int64), np.array([])
+    order = np.argsort(product_days, kind='mergesort')
+    product_days = product_days[order]
+
+    lo = np.searchsorted(product_days, chart_days - window, side='left')
+    hi = np.searchsorted(product_days, chart_days + window, side='right')
+    if mode == 'nearest':
+        # the products right before and right after the chart date
+        right = np.searchsorted(product_days, chart_days, side='left')
+        left = np.maximum(right - 1, lo)
+        right = np.minimum(right, hi - 1)
+        last = len(product_days) - 1
+        pick_right = np.abs(product_days[np.minimum(right, last)] -
+                            chart_days) < \
+            np.abs(product_days[np.minimum(left, last)] - chart_days)
+        sorted_idx = np.where(pick_right, right, left)
+        chart_idx = np.flatnonzero(hi > lo)
+        sorted_idx = sorted_idx[chart_idx]
+    else:
+        counts = hi - lo
+        chart_idx = np.repeat(np.arange(len(chart_days)), counts)
+        # lo of the chart plus the position within its window
+        starts = np.cumsum(counts) - counts
+        sorted_idx = np.repeat(lo, counts) + \
+            np.arange(counts.sum()) - np.repeat(starts, counts)
+
+    product_idx = order[sorted_idx]
+    offset = product_days[sorted_idx] - chart_days[chart_idx]
+    # triangular weights, normalized per chart
+    weight = (window + 1. - np.abs(offset)) / (window + 1.)
+    totals = np.bincount(chart_idx, weights=weight,
+                         minlength=len(chart_days))
+    weight /= totals[chart_idx]
+    return chart_idx, product_idx, offset, weight
+
+
+def pair_timeseries(chart_ts, product_ts, window=0, mode='nearest'):
+    """
+    Pairs the charts and products of time series as generated by the
+    `tseries_generator`.
+
+    :param chart_ts: dict
+        Mapping of hemisphere to an ordered mapping of reference date
+        strings to chart URLs.
+    :param product_ts: dict
+        The same for the products.
+    :param window: int
+        See `colocate`.
+    :param mode: str
+        See `colocate`. With 'all' every pair is validated at the date of
+        its product, a product within the windows of two charts is paired
+        with the nearer one only, so that the reference dates of the pairs
+        stay unique.
+
+    :return: OrderedDict
+        Mapping of hemisphere to a list of tuples of the form
+        (ref_date, chart_url, product_url) sorted by reference date.
+    """
+    validation_pairs = OrderedDict()
+    for hemis, charts in chart_ts.iteritems():
+        products = product_ts.get(hemis, {})
+        chart_dates, chart_urls = charts.keys(), charts.values()
+        product_dates, product_urls = products.keys(), products.values()
+        chart_idx, product_idx, offset, _ = colocate(
+            to_datetime64(chart_dates), to_datetime64(product_dates), window,
+            mode)
+
+        if mode == 'all':
+            # the nearest chart of every product, the earlier one on ties
+            keep = np.lexsort((-offset, np.abs(offset), product_idx))
+            first = np.ones(len(keep), dtype=bool)
+            first[1:] = product_idx[keep][1:] != product_idx[keep][:-1]
+            keep = keep[first]
+            chart_idx, product_idx = chart_idx[keep], product_idx[keep]
+            ref_dates = [product_dates[i] for i in product_idx]
+        else:
+            ref_dates = [chart_dates[i] for i in chart_idx]
+
+        pairs = sorted(zip(ref_dates, [chart_urls[i] for i in chart_idx],
+                           [product_urls[i] for i in product_idx]))
+        LOG.debug('{0}: {1} of {2} charts paired with {3} products'.format(
+            hemis, len(set(chart_idx)), len(chart_dates), len(pairs)))
+        validation_pairs[hemis] = pairs
+    return validation_pairs
@@ -4,35 +4,49 @@ import logging
 import os
 import re
 import shlex
+import shutil
 import sys
 import urllib2
 from subprocess import Popen, PIPE
 from urllib2 import urlopen
 
+from trollvalidation.data_collectors import mirror
 from trollvalidation.validations import configuration as cfg
 
 LOG = logging.getLogger('nic_downloader')
 
 
-def get(remote_file, local_path=cfg.INPUT_DIR, report_hook=None):
+def get(remote_file, local_path=None, report_hook=None):
+    local_path = local_path or cfg.INPUT_DIR
     fname = os.path.basename(remote_file)
     target = os.path.join(local_path, fname)
 
     if not os.path.isfile(target):
-        LOG.info('Download {0} to {1}'.format(remote_file, target))
+        # in mirror mode the file is copied from the local mirror or
+        # downloaded from the mirror server
+        source = mirror.resolve(remote_file)
+        LOG.info('Download {0} to {1}'.format(source, target))
         try:
+            if getattr(cfg, 'MIRROR_DIR', None) and \
+                    not getattr(cfg, 'MIRROR_URL', None):
+                if not os.path.isfile(source):
+                    LOG.error('Could not find {0} in the mirror {1}'.format(
+                        remote_file, cfg.MIRROR_DIR))
+                    return target
+                shutil.copyfile(source, target)
+                return target
             # Replaced urlretrieve as it did not close connections properly,
             # so there remained to many open preventing the rest of the
             # validation step to pass
             # urllib.urlretrieve(remote_file, filename=target,
             #                    reporthook=report_hook)
 
-            remote_file_content = urllib2.urlopen(remote_file)
+            remote_file_content = urllib2.urlopen(source)
             with open(target, 'wb') as output:
                 output.write(remote_file_content.read())
         except IOError, e:
             LOG.exception(e)
-            LOG.error('Could not download file {0}'.format(remote_file))
+            LOG.error('Could not download file {0}'.format(source))
 
     return target
 
@@ -95,6 +109,7 @@ def scrape_all(http_cfg):
 
 def glob_all(host, remote_dir, user=None, pwd=None, port=None,
              protocol='ftp://'):
+    cfg.check_tools('lftp')
     if protocol == 'sftp://':
         cmd = 'lftp -e "glob -f echo {0}; bye" -p {1} -u {2},{3} {4}{5}'
         cmd = cmd.format(remote_dir, port, user, pwd, host)
@@ -111,6 +126,10 @@ def glob_all(host, remote_dir, user=None, pwd=None, port=None,
     return remote_file_list
 
 def generate_all(protocol, host, remote_dir_f_pattern, date_range):
+    if isinstance(date_range, tuple):
+        # first and last date of a daily range as given in the configuration
+        import pandas as pd
+        date_range = pd.date_range(*date_range, freq='D')
 
     def gen_str(remote_pattern, d, h):
         date_str = datetime.datetime.strftime(d, '%Y%m%d')
@@ -136,6 +155,13 @@ def glob_file(cfg):
     if 'port' not in cfg.keys():
         cfg['port'] = None
 
+    if mirror.enabled():
+        # list the mirror every time, it is fast and the listing of a live
+        # run in the glob file may name files, which are not mirrored
+        remote_files = mirror.glob_mirror(cfg)
+        return ['{0}{1}/{2}'.format(cfg['protocol'], cfg['host'], f)
+                for f in remote_files]
+
     if not os.path.isfile(cfg['glob_file']):
         if not cfg['scrape']:
             if not 'generate' in cfg.keys():
@@ -156,6 +182,8 @@ def glob_file(cfg):
         remote_files = ['{0}{1}/{2}'.format(cfg['protocol'], cfg[
             'host'], f) for f in remote_files]
 
+        if not os.path.isdir(os.path.dirname(cfg['glob_file'])):
+            os.makedirs(os.path.dirname(cfg['glob_file']))
         with open(cfg['glob_file'], 'w') as fp:
             json.dump(remote_files, fp)
     else:
@@ -0,0 +1,217 @@
+"""
+Local mirror of the remote archives.
+
+In mirror mode the remote files of all `*_DOWNL` configurations are listed
+and fetched from a local directory tree instead of the FTP, HTTP and THREDDS
+servers. The tree is laid out as the remote servers, i.e., a remote file
+`ftp://sidads.colorado.edu/pub/DATASETS/...` is expected at
+`MIRROR_DIR/sidads.colorado.edu/pub/DATASETS/...`, which is how
+`wget --mirror` stores files.
+
+The time series keep the remote URLs, so that archive indexes, checkpoints
+and results of mirrored and live runs are interchangeable. Only `glob_file`
+and `get` of the downloader resolve them against the mirror.
+
+Workers without access to the mirror directory, e.g. on other machines,
+read it through a small HTTP server, which is started with:
+
+    python -m trollvalidation.data_collectors.mirror MIRROR_DIR [PORT [HOST]]
+
+and configured as `MIRROR_URL`, e.g. 'http://host:8000'. The server only
+listens on 127.0.0.1 unless another HOST, e.g. 0.0.0.0, is given.
+"""
+import BaseHTTPServer
+import json
+import logging
+import os
+import posixpath
+import sys
+import threading
+import urllib
+import urllib2
+import urlparse
+from glob import glob
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+from trollvalidation.validations import configuration as cfg
+
+LOG = logging.getLogger(__name__)
+
+# path under which the server answers glob requests
+GLOB_PATH = '/_glob'
+# address the server listens on by default, this machine only
+DEFAULT_HOST = '127.0.0.1'
+
+
+def enabled():
+    return bool(getattr(cfg, 'MIRROR_DIR', None) or
+                getattr(cfg, 'MIRROR_URL', None))
+
+
+def _split(remote_file):
+    parts = urlparse.urlsplit(remote_file)
+    return parts.netloc, parts.path.lstrip('/')
+
+
+def resolve(remote_file):
+    """
+    :param remote_file: str
+        URL of a file on a remote server.
+
+    :return: str
+        The URL of the file on the mirror server if `MIRROR_URL` is set,
+        the path of the file in `MIRROR_DIR` if it is set, or the remote URL
+        otherwise.
+    """
+    if not enabled():
+        return remote_file
+    host, path = _split(remote_file)
+    if getattr(cfg, 'MIRROR_URL', None):
+        return '{0}/{1}/{2}'.format(cfg.MIRROR_URL.rstrip('/'), host,
+                                    urllib.quote(path))
+    return os.path.join(cfg.MIRROR_DIR, host, path)
+
+
+def glob_patterns(http_cfg):
+    """
+    :param http_cfg: dict
+        A `*_DOWNL` configuration.
+
+    :return: list
+        Glob patterns of the remote files of the configuration relative to
+        the host. Listings which are scraped from HTML pages or generated
+        from a date range become globs over their file patterns.
+    """
+    if http_cfg.get('scrape'):
+        return [p.format('*', '*')
+                for p in http_cfg['remote_file_pattern'].values()]
+    if 'generate' in http_cfg:
+        return [http_cfg['remote_dir_f_pattern'].format('*', '*', '?', '*')]
+    return [http_cfg['remote_dir_f_pattern']]
+
+
+def local_glob(root, host, pattern):
+    """
+    :return: list
+        The sorted paths of the files matching `pattern` in the mirror of
+        `host`, relative to the host as `glob_all` returns them.
+    """
+    base = os.path.join(root, host)
+    return sorted(os.path.relpath(p, base).replace(os.sep, '/')
+                  for p in glob(os.path.join(base, pattern))
+                  if os.path.isfile(p))
+
+
+def glob_mirror(http_cfg):
+    """
+    Lists the remote files of a `*_DOWNL` configuration in the mirror.
+
+    :return: list
+        Paths of the files relative to the host.
+    """
+    remote_files = []
+    for pattern in glob_patterns(http_cfg):
+        if getattr(cfg, 'MIRROR_URL', None):
+            query = urllib.urlencode({'host': http_cfg['host'],
+                                      'pattern': pattern})
+            url = '{0}{1}?{2}'.format(cfg.MIRROR_URL.rstrip('/'), GLOB_PATH,
+                                      query)
+            remote_files += json.load(urllib2.urlopen(url))
+        else:
+            remote_files += local_glob(cfg.MIRROR_DIR, http_cfg['host'],
+                                       pattern)
+    LOG.info('Found {0} files of {1} in the mirror'.format(
+        len(remote_files), http_cfg['host']))
+    return remote_files
+
+
+class MirrorRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the files of the mirror directory `root` of the server and
+    answers glob requests of the form `/_glob?host=...&pattern=...` with a
+    JSON list of the matching files.
+    """
+    def translate_path(self, path):
+        path = posixpath.normpath(urllib.unquote(
+            urlparse.urlsplit(path).path))
+        words = [w for w in path.split('/')
+                 if w and w not in (os.curdir, os.pardir)]
+        return os.path.join(self.server.root, *words)
+
+    def _inside_root(self, path):
+        root = self.server.root
+        path = os.path.normpath(os.path.join(root, path))
+        return path.startswith(root.rstrip(os.sep) + os.sep)
+
+    def do_GET(self):
+        parts = urlparse.urlsplit(self.path)
+        if parts.path != GLOB_PATH:
+            return SimpleHTTPRequestHandler.do_GET(self)
+        query = urlparse.parse_qs(parts.query)
+        host = query.get('host', [''])[0]
+        pattern = query.get('pattern', [''])[0]
+        # absolute paths and parent directories must not leave the root
+        if not host or not pattern or not self._inside_root(host) or \
+                not self._inside_root(os.path.join(host, pattern)):
+            self.send_error(400, 'Invalid glob')
+            return
+        body = json.dumps(local_glob(self.server.root, host, pattern))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOG.debug(format % args)
+
+
+class MirrorServer(BaseHTTPServer.HTTPServer):
+    """
+    HTTP server of a mirror directory, see `serve`.
+    """
+    allow_reuse_address = True
+
+    def __init__(self, root, address=(DEFAULT_HOST, 0)):
+        BaseHTTPServer.HTTPServer.__init__(self, address,
+                                           MirrorRequestHandler)
+        self.root = os.path.abspath(root)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{0}:{1}'.format(
+            'localhost' if host in ('', '0.0.0.0') else host, port)
+
+
+def serve(root, port=0, host=DEFAULT_HOST):
+    """
+    Serves a mirror directory in a background thread of this process, e.g.
+    for offline runs and benchmarks.
+
+    :param port: int
+        Port of the server. By default a free port is chosen.
+    :param host: str
+        Address to listen on, '' or '0.0.0.0' for all interfaces.
+
+    :return: MirrorServer
+        The running server. Its URL is `server.url` and `server.shutdown()`
+        stops it.
+    """
+    server = MirrorServer(root, (host, port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    server = MirrorServer(sys.argv[1], (
+        sys.argv[3] if len(sys.argv) > 3 else DEFAULT_HOST,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 8000))
+    LOG.info('Serving {0} at {1}'.format(server.root, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -5,7 +5,10 @@ import os
 import re
 from collections import OrderedDict
 
+import numpy as np
 from data_collectors import downloader
+from data_collectors import archive_index
+from data_collectors import colocation
 from dateutil import parser
 
 from trollvalidation.validations import configuration as cfg
@@ -29,6 +32,139 @@ def extract_timestamp(from_string, with_r_pattern, with_date_pattern):
     return timestamp
 
 
+# widths of the fields of date formats, which are parsed vectorized
+_FIELD_WIDTHS = {'Y': 4, 'y': 2, 'm': 2, 'd': 2, 'H': 2, 'M': 2, 'S': 2,
+                 'W': 2}
+
+
+def _field_offsets(date_pattern):
+    # the positions of the fields in dates of the format and the width of
+    # the dates, None if the dates are not of fixed width, e.g. with %b
+    offsets, pos, i = {}, 0, 0
+    while i < len(date_pattern):
+        if date_pattern[i] == '%':
+            field = date_pattern[i + 1:i + 2]
+            if field not in _FIELD_WIDTHS:
+                return None, None
+            offsets[field] = (pos, pos + _FIELD_WIDTHS[field])
+            pos += _FIELD_WIDTHS[field]
+            i += 2
+        else:
+            pos += 1
+            i += 1
+    return offsets, pos
+
+
+def parse_dates(time_strs, date_pattern):
+    """
+    Converts date strings of a `strptime` format to dates in one go. Dates
+    of a week format, e.g. '%Y%W', are the Mondays of the weeks.
+
+    :param time_strs: list
+        Date strings, e.g. ['201501', '201502'] for the format '%Y%W'.
+    :param date_pattern: str
+        The `strptime` format of the strings.
+
+    :return: numpy.ndarray
+        The dates as array of dtype 'datetime64[D]'.
+
+    :raises: ValueError
+        If a string does not match the format.
+    """
+    time_strs = np.array(time_strs, dtype='S')
+    offsets, width = _field_offsets(date_pattern)
+    if not len(time_strs):
+        return np.array([], dtype='datetime64[D]')
+    if offsets is None or time_strs.dtype.itemsize != width or \
+            not (np.char.str_len(time_strs) == width).all():
+        # formats of variable width are parsed one by one
+        return np.array([extract_timestamp(t, '.*', date_pattern)
+                         for t in time_strs], dtype='datetime64[D]')
+
+    digits = time_strs.view(np.uint8).reshape(len(time_strs), width)
+    digits = digits.astype(np.int64) - ord('0')
+
+    def field(name):
+        start, end = offsets[name]
+        if ((digits[:, start:end] < 0) | (digits[:, start:end] > 9)).any():
+            raise ValueError('Dates do not match the format {0}'.format(
+                date_pattern))
+        return digits[:, start:end].dot(10 ** np.arange(end - start)[::-1])
+
+    if 'Y' in offsets:
+        years = field('Y')
+    elif 'y' in offsets:
+        # as strptime, 69-99 are 1969-1999 and 00-68 are 2000-2068
+        years = field('y')
+        years = np.where(years < 69, 2000 + years, 1900 + years)
+    else:
+        years = np.full(len(time_strs), 1900, dtype=np.int64)
+    jan_1 = (years - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+
+    if 'W' in offsets:
+        # the Monday of the week, as strptime with '%W-%w' and day 1
+        weeks = field('W')
+        weekday = (jan_1.astype(np.int64) + 3) % 7
+        return np.where(weeks == 0, jan_1 - weekday,
+                        jan_1 + (7 - weekday) % 7 + 7 * (weeks - 1))
+
+    months = jan_1.astype('datetime64[M]')
+    if 'm' in offsets:
+        months = months + (field('m') - 1)
+    dates = months.astype('datetime64[D]')
+    if 'd' in offsets:
+        dates = dates + (field('d') - 1)
+    # month 13 or day 31 of a 30 day month move to the following month
+    if (dates.astype('datetime64[M]') != months).any() or \
+            (months.astype('datetime64[Y]') !=
+             jan_1.astype('datetime64[Y]')).any():
+        raise ValueError('Dates do not match the format {0}'.format(
+            date_pattern))
+    return dates
+
+
+def extract_timestamps(files, with_r_pattern, with_date_pattern):
+    """
+    Extracts the dates of a whole listing of files at once with one regular
+    expression over the joined listing and `parse_dates`.
+
+    :param files: list
+        Names or URLs of files.
+    :param with_r_pattern: str
+        Regular expression of the date in the names, its first match is the
+        date of a file.
+    :param with_date_pattern: str
+        The `strptime` format of the matches.
+
+    :return: tuple
+        Arrays (dates, files) sorted by date, the dates of dtype
+        'datetime64[D]'. Files of the same date keep their order.
+
+    :raises: ValueError
+        If the name of a file does not contain a date.
+    """
+    files = list(files)
+    regexp = re.compile(r'^.*?({0})'.format(with_r_pattern), re.MULTILINE)
+    time_strs = regexp.findall('\n'.join(files))
+    if regexp.groups > 1:
+        time_strs = [t[0] for t in time_strs]
+    if len(time_strs) != len(files):
+        missing = [f for f in files if not regexp.search(f)]
+        raise ValueError('No date in {0}'.format(
+            missing[0] if missing else 'multi-line file names'))
+
+    dates = parse_dates(time_strs, with_date_pattern)
+    order = np.argsort(dates, kind='mergesort')
+    return dates[order], np.array(files, dtype=object)[order]
+
+
+def _timeseries(files, date_pattern):
+    # ordered mapping of the common date strings to the files, the last of
+    # several files of a date wins
+    dates, files = extract_timestamps(files, *date_pattern)
+    return OrderedDict(zip(dates.astype(str), files))
+
+
 def generate_osi450_product_timeseries(files):
 
     timeseries = OrderedDict()
@@ -36,11 +172,8 @@ def generate_osi450_product_timeseries(files):
 
     for h_str in hemispheres:
         prods = filter(lambda f: (h_str in f), files)
-
-        regexp_date, date_pattern = cfg.METNO_DOWNL['remote_date_pattern']
-        dates = [extract_timestamp(f, regexp_date, date_pattern) for f in prods]
-
-        timeseries[h_str] = OrderedDict(zip(dates, prods))
+        timeseries[h_str] = _timeseries(
+            prods, cfg.METNO_DOWNL['remote_date_pattern'])
     return timeseries
 
 
@@ -49,11 +182,8 @@ def generate_nic_bin_timeseries(files):
     hemispheres = ['nh']
 
     for h_str in hemispheres:
-
-        regexp_date, date_pattern = cfg.NIC_BIN_DOWNL['remote_date_pattern']
-        dates = [extract_timestamp(f, regexp_date, date_pattern) for f in files]
-
-        timeseries[h_str] = OrderedDict(zip(dates, files))
+        timeseries[h_str] = _timeseries(
+            files, cfg.NIC_BIN_DOWNL['remote_date_pattern'])
 
     return timeseries
 
@@ -63,11 +193,8 @@ def generate_nic_sig_timeseries(files):
     hemispheres = ['sh']
 
     for h_str in hemispheres:
-
-        regexp_date, date_pattern = cfg.NIC_SIG_DOWNL['remote_date_pattern']
-        dates = [extract_timestamp(f, regexp_date, date_pattern) for f in files]
-
-        timeseries[h_str] = OrderedDict(zip(dates, files))
+        timeseries[h_str] = _timeseries(
+            files, cfg.NIC_SIG_DOWNL['remote_date_pattern'])
 
     return timeseries
 
@@ -77,11 +204,8 @@ def generate_nic_shp_timeseries(files):
     hemispheres = [('nh', 'arctic'), ('sh', 'antarc')]
     for h_str, h_name in hemispheres:
         prods = filter(lambda f: (h_name in os.path.basename(f)), files)
-
-        regexp_date, date_pattern = cfg.NIC_SHP_DOWNL['remote_date_pattern']
-        dates = [extract_timestamp(f, regexp_date, date_pattern) for f in prods]
-
-        timeseries[h_str] = OrderedDict(zip(dates, prods))
+        timeseries[h_str] = _timeseries(
+            prods, cfg.NIC_SHP_DOWNL['remote_date_pattern'])
 
     return timeseries
 
@@ -96,21 +220,27 @@ def generate_nic_timeseries(shp_files, bin_files, sig_files):
     return nic_files
 
 
-def pair_files(nic_ts, prd_ts):
-    validation_pairs = OrderedDict()
-    for hemis, tser in nic_ts.iteritems():
-
-        validation_pairs[hemis] = []
-        for timestamp, file in tser.iteritems():
-            try:
-                product_file = prd_ts[hemis][timestamp]
-                validation_pairs[hemis].append((timestamp, file, product_file))
-            except KeyError:
-                # Do not consider pairs for which we do not have a product
-                pass
-
-    with open('/tmp/pairs.txt', 'w') as fp:
-        json.dump(validation_pairs, fp)
+def pair_files(nic_ts, prd_ts, index=None, window=None, mode=None):
+    """
+    Pairs charts and products, whose dates differ by at most `window` days,
+    see `colocation.pair_timeseries`. The window and the mode default to
+    COLOCATION_WINDOW and COLOCATION_MODE of the configuration.
+    """
+    if window is None:
+        window = getattr(cfg, 'COLOCATION_WINDOW', None) or 0
+    if mode is None:
+        mode = getattr(cfg, 'COLOCATION_MODE', None) or 'nearest'
+    validation_pairs = colocation.pair_timeseries(nic_ts, prd_ts, window,
+                                                  mode)
+
+    if index:
+        # keep track of the files and of the processing state of the pairs
+        index.register_timeseries('chart', nic_ts)
+        index.register_timeseries('product', prd_ts)
+        index.register_pairs(validation_pairs)
+    else:
+        with open('/tmp/pairs.txt', 'w') as fp:
+            json.dump(validation_pairs, fp)
 
     return validation_pairs
 
@@ -125,7 +255,40 @@ def year_of_interest(el):
     return parser.parse(el[0]).year in cfg.YEARS_OF_INTEREST
 
 
-def generate_time_series(description_str=''):
+def pending_pairs(validation_pairs, index=None):
+    """
+    :param validation_pairs: dict
+        Mapping of 'nh'/'sh' to the file pairs of the hemisphere.
+    :param index: ArchiveIndex
+        The archive index, the configured one is opened without.
+
+    :return: OrderedDict
+        The pairs, which are not validated yet, of every hemisphere. All
+        pairs if there is no archive index.
+    """
+    opened = index is None
+    if opened:
+        index = archive_index.open_index(cfg)
+    if not index:
+        return validation_pairs
+    filtered = OrderedDict()
+    for hemis, file_pairs in validation_pairs.iteritems():
+        pending = index.pending(hemis)
+        filtered[hemis] = [el for el in file_pairs if el[0] in pending]
+    if opened:
+        index.close()
+    return filtered
+
+
+def generate_time_series(description_str='', pending_only=True):
+    """
+    :param description_str: str
+        Short description of a task, only the pairs of its hemisphere are
+        returned if it contains '_NH_' or '_SH_'.
+    :param pending_only: bool
+        With an archive index only the pairs, which are not validated yet,
+        are returned. Set it to False to revalidate all pairs.
+    """
 
     # glob for all remote files
     prd_files = downloader.glob_file(cfg.METNO_THREDDS_DOWNL)
@@ -142,11 +305,20 @@ def generate_time_series(description_str=''):
     nic_ts = generate_nic_timeseries(shp_ts, bin_ts, sig_ts)
 
     # generate time series mapping, i.e. tuples of ref_time, url_eval, url_data
-    validation_pairs = pair_files(nic_ts, prd_ts)
+    index = archive_index.open_index(cfg)
+    validation_pairs = pair_files(nic_ts, prd_ts, index)
 
     # filter file pairs so that only
-    validation_pairs['nh'] = filter(year_of_interest, validation_pairs['nh'])
-    validation_pairs['sh'] = filter(year_of_interest, validation_pairs['sh'])
+    validation_pairs['nh'] = filter(year_of_interest,
+                                    validation_pairs.get('nh', []))
+    validation_pairs['sh'] = filter(year_of_interest,
+                                    validation_pairs.get('sh', []))
+
+    if index and pending_only:
+        # reruns only process pairs, which are not validated yet
+        validation_pairs = pending_pairs(validation_pairs, index)
+    if index:
+        index.close()
 
     if '_NH_' in description_str:
         return validation_pairs['nh']
@@ -1,6 +1,6 @@
 import numpy as np
-import pyresample as pr
 import trollvalidation.validation_utils as util
+from trollvalidation import profiling
 
 
 class BINFileReader(object):
@@ -57,13 +57,12 @@ class BINFileReader(object):
         source_area_def = util.get_area_def(input_file)
 
         data = np.ma.array(self.data, mask=(self.data > 100))
-        data_con_nn = pr.image.ImageContainerNearest(data, source_area_def,
-                                                     radius_of_influence=50000)
-
-        result = data_con_nn.resample(target_area_def)
-
-        return result.image_data
+        # all charts share one grid, so the neighbour info is reused
+        return util.resample_nearest(data, source_area_def, target_area_def,
+                                     radius_of_influence=50000)
 
     def read_data(self, input_file, product_file):
-        self.data = self._read_bin_file(input_file)
-        return self._reproject(input_file, product_file)
+        with profiling.span('read'):
+            self.data = self._read_bin_file(input_file)
+        with profiling.span('reproject'):
+            return self._reproject(input_file, product_file)
@@ -1,6 +1,9 @@
 import numpy as np
-import pyresample as pr
 import trollvalidation.validation_utils as util
+from trollvalidation import profiling
+from trollvalidation.lazy import lazy_import
+
+pr = lazy_import('pyresample')
 
 
 class SIGFileReader(object):
@@ -146,5 +149,7 @@ class SIGFileReader(object):
         return reprojected_data
 
     def read_data(self, input_file, product_file):
-        _ = self._read_sig_file(input_file)
-        return self._reproject(input_file, product_file)
+        with profiling.span('read'):
+            _ = self._read_sig_file(input_file)
+        with profiling.span('reproject'):
+            return self._reproject(input_file, product_file)
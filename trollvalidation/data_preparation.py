@@ -1,14 +1,24 @@
 import logging
 import os
+import threading
 
 import numpy as np
-from netCDF4 import Dataset
 
 import validation_utils
+from trollvalidation import area_masks
+from trollvalidation import profiling
+from trollvalidation.compact_grid import CompactGrid, shrink
+from trollvalidation.lazy import lazy_import
+from trollvalidation.validations import configuration as cfg
 from data_decoders.bin_reader import BINFileReader
 from data_decoders.sig_reader import SIGFileReader
 from data_decoders.sigrid_decoder import DecodeSIGRIDCodes
 
+netCDF4 = lazy_import('netCDF4')
+# the netCDF and HDF5 libraries are not thread safe, so the steps of the
+# thread backend read the files one at a time
+NETCDF_LOCK = threading.Lock()
+
 
 LOG = logging.getLogger(__name__)
 # logging.basicConfig(level=logging.DEBUG,
@@ -16,15 +26,22 @@ LOG = logging.getLogger(__name__)
 #                     datefmt='%Y-%m-%d %H:%M:%S')
 
 
-def handle_shapefile(shp_file, orig_file, orig_data, temp_files):
+def rasterize_shapefile(shp_file, orig_file, temp_files):
     """
-    This function reprojects, rasterizes, and decodes NIC ice charts
-    in shapefile format.
-
-    :param shp_file:
-    :param orig_file:
-    :return:
+    This function reprojects and rasterizes NIC ice charts in shapefile
+    format onto the grid of the product.
+
+    :param shp_file: str
+        Path to the unpacked shapefile.
+    :param orig_file: str
+        Path or URL of the product, which identifies the target grid.
+    :param temp_files: TmpFiles
+        Collects the intermediate files.
+
+    :return: np.ma.array
+        The SIGRID codes of the chart on the grid of the product.
     """
+    cfg.check_tools('ogr2ogr', 'gdal_rasterize')
 
     # reproject shapefile:
     target_area_def = validation_utils.get_area_def(orig_file)
@@ -69,23 +86,120 @@ def handle_shapefile(shp_file, orig_file, orig_data, temp_files):
     temp_files.append(netcdf_file)
 
     # read NetCDF file
-    dataset = Dataset(netcdf_file)
+    with NETCDF_LOCK:
+        dataset = netCDF4.Dataset(netcdf_file)
+        band = dataset.variables['Band1'][:]
+        dataset.close()
     # on my computer the image needs to be flipped upside down...
     # TODO: check if this is also necessary on other computers
-    eval_data = np.flipud(dataset.variables['Band1'][:]) #.astype(np.uint8))
+    return np.flipud(band) #.astype(np.uint8))
+
+
+def handle_shapefile(shp_file, orig_file, orig_data, temp_files):
+    """
+    This function reprojects, rasterizes, and decodes NIC ice charts
+    in shapefile format.
+
+    :param shp_file:
+    :param orig_file:
+    :return:
+    """
+    with profiling.span('reproject'):
+        eval_data = rasterize_shapefile(shp_file, orig_file, temp_files)
     # finally convert the sigrid ice codes to ice concentrations in %
     decoder = DecodeSIGRIDCodes()
-    eval_data = decoder.sigrid_decoding(eval_data, orig_data)
+    with profiling.span('decode'):
+        eval_data = decoder.sigrid_decoding(eval_data, orig_data)
 
     return eval_data
 
 
+def read_chart(chart_file, kind=None):
+    """
+    Reads an ice chart on its own grid, the first part of the handlers
+    below, which the stages of a validation step run one by one.
+
+    :param kind: str
+        Extension of the chart as published, i.e., '.bin', '.sig' or '.zip'.
+        Defaults to the extension of `chart_file`.
+
+    :return: BINFileReader | SIGFileReader | str
+        A reader holding the chart or, for shapefiles, which are read by
+        ogr2ogr when they are reprojected, the path of the shapefile.
+    """
+    kind = kind or os.path.splitext(chart_file)[1]
+    if kind == '.bin':
+        reader = BINFileReader()
+        reader._read_bin_file(chart_file)
+        return reader
+    elif kind == '.sig':
+        reader = SIGFileReader()
+        reader._read_sig_file(chart_file)
+        return reader
+    elif kind in ('.zip', '.shp'):
+        return chart_file
+    msg = 'I do not know how to open {0}'.format(chart_file)
+    raise NotImplementedError(msg)
+
+
+def reproject_chart(chart, chart_file, orig_file, temp_files):
+    """
+    :param chart: BINFileReader | SIGFileReader | str
+        The chart as returned by `read_chart`.
+
+    :return: np.ma.array
+        The codes of the chart on the grid of the product.
+    """
+    if isinstance(chart, basestring):
+        return rasterize_shapefile(chart, orig_file, temp_files)
+    return chart._reproject(chart_file, orig_file)
+
+
+def decode_chart(chart_codes, orig_data, kind):
+    """
+    :param kind: str
+        Extension of the chart as published, see `read_chart`.
+
+    :return: np.ma.array
+        The ice concentrations in % of the chart.
+    """
+    decoder = DecodeSIGRIDCodes()
+    if kind == '.bin':
+        return decoder.decode_values(chart_codes, orig_data)
+    return decoder.sigrid_decoding(chart_codes, orig_data)
+
+
+def decode_compact_chart(chart_codes, orig_data, kind, cells=None):
+    """
+    Decodes a chart on the cells, which are valid in the chart and in the
+    product, only. The decoding is cell by cell, so these cells are decoded
+    as by `decode_chart`.
+
+    :param cells: np.array
+        Flat indices of the cells, which may be valid, see
+        `area_masks.valid_cells`.
+
+    :return: CompactGrid | np.ma.array
+        The ice concentrations in % of the chart, as full map if that is
+        smaller, see `compact_grid.shrink`.
+    """
+    codes = CompactGrid.from_masked(chart_codes, cells)
+    index = codes.index
+    orig_values = orig_data.ravel()[index]
+    valid = ~np.ma.getmaskarray(orig_values)
+    eval_values = decode_chart(codes.data()[valid],
+                               np.ma.getdata(orig_values)[valid], kind)
+    return shrink(CompactGrid(chart_codes.shape, index[valid],
+                              np.ma.getdata(eval_values)))
+
+
 def handle_binfile(bin_file, orig_file, orig_data):
     bin_reader = BINFileReader()
     eval_file_data = bin_reader.read_data(bin_file, orig_file)
 
     decoder = DecodeSIGRIDCodes()
-    eval_data = decoder.decode_values(eval_file_data, orig_data)
+    with profiling.span('decode'):
+        eval_data = decoder.decode_values(eval_file_data, orig_data)
     return eval_data
 
 
@@ -94,7 +208,8 @@ def handle_sigfile(sig_file, orig_file, orig_data):
     eval_file_data = sig_reader.read_data(sig_file, orig_file)
 
     decoder = DecodeSIGRIDCodes()
-    eval_data = decoder.sigrid_decoding(eval_file_data, orig_data)
+    with profiling.span('decode'):
+        eval_data = decoder.sigrid_decoding(eval_file_data, orig_data)
     return eval_data
 
 
@@ -113,10 +228,20 @@ def handle_osi_ice_conc_nc_file(input_file):
         The 'matrix' of ice concentration values. It is expected for
         this validation that the values are in the range of [0..100]
     """
-    dataset = Dataset(input_file)
-    ice_conc = dataset.variables['ice_conc'][0].data[:]
-    status_flag = dataset.variables['status_flag'][0][:]
-    mask_flags = np.logical_or.reduce((status_flag & 1 == 1, status_flag & 2 == 2, status_flag & 8 == 8))
+    with profiling.span('read'), NETCDF_LOCK:
+        dataset = netCDF4.Dataset(input_file)
+        ice_conc = dataset.variables['ice_conc'][0].data[:]
+        status_flag = dataset.variables['status_flag'][0][:]
+        dataset.close()
+    try:
+        area_id = validation_utils.get_area_id(input_file)
+    except ValueError:
+        area_id = None
+    # land and lakes (1, 2), whose valid cells are kept per grid, and land
+    # spill over (8), which changes from product to product
+    static_mask = area_masks.static_mask(np.ma.getdata(status_flag))
+    area_masks.update(area_id, static_mask)
+    mask_flags = static_mask | (status_flag & 8 == 8)
     mask_conc = np.logical_or(ice_conc < 0, ice_conc > 100)
     ice_conc = np.ma.array(ice_conc, mask=(mask_flags | mask_conc))
     return ice_conc
@@ -0,0 +1,389 @@
+"""
+Executors running the validation steps of a task.
+
+All executors share the same small interface: `imap_unordered(func,
+iterable)` yields the results of `func` applied to every item as soon as
+they are available, `close()` waits for the workers to finish and
+`terminate()` stops them right away. Executors are context managers, which
+close on success and terminate on errors.
+
+  * `LocalPoolExecutor`, a pool of processes on this machine.
+  * `ThreadPoolExecutor`, a pool of threads, e.g., for steps which are
+    bound by downloads rather than by CPU.
+  * `DistributedExecutor`, a coordinator serving a task and a result queue
+    over a socket, to which worker processes on any number of machines
+    connect. Start a worker with:
+
+        python -m trollvalidation.executors HOST:PORT AUTHKEY
+
+    The validation steps have to be idempotent, as a step of a worker that
+    got lost is dispatched again after `task_timeout`. The functions of the
+    steps are sent by their qualified names, so the workers need the same
+    version of `trollvalidation` as the coordinator.
+"""
+import cPickle as pickle
+import importlib
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import Queue
+import sys
+import time
+import types
+import uuid
+from cStringIO import StringIO
+from multiprocessing.managers import BaseManager
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+import trollvalidation.validation_utils as util
+from trollvalidation.validations import configuration as cfg
+
+LOG = logging.getLogger(__name__)
+
+
+def warm_worker():
+    """
+    Initializer of the workers. It fills the caches every step uses, i.e.,
+    the parsed area definitions and the neighbour info for the resamplings
+    listed in `WARM_RESAMPLING` of the configuration.
+    """
+    try:
+        util.load_area_defs()
+        for source_id, target_id in getattr(cfg, 'WARM_RESAMPLING', []):
+            source_def = util.get_area_def_by_id(source_id)
+            target_def = util.get_area_def_by_id(target_id)
+            util.resample_nearest(np.zeros(source_def.shape), source_def,
+                                  target_def, radius_of_influence=50000)
+    except Exception, e:
+        # a failing initializer would make a pool respawn workers forever
+        LOG.exception(e)
+
+
+class Executor(object):
+
+    def imap_unordered(self, func, iterable):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def terminate(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.terminate()
+        else:
+            self.close()
+
+
+class LocalPoolExecutor(Executor):
+    """
+    Long-lived pool of worker processes, which can be shared by all tasks
+    of a run.
+
+    :param processes: int
+        Number of worker processes. Defaults to the number of CPUs.
+    :param initializer: callable
+        Called once in every worker process when it starts.
+    """
+    def __init__(self, processes=None, initializer=warm_worker):
+        super(LocalPoolExecutor, self).__init__()
+        self.pool = self._make_pool(processes or mp.cpu_count(), initializer)
+
+    def _make_pool(self, processes, initializer):
+        return mp.Pool(processes=processes, initializer=initializer)
+
+    def imap_unordered(self, func, iterable):
+        # one step per message, so that idle workers pick up the next step
+        return self.pool.imap_unordered(func, iterable, chunksize=1)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class ThreadPoolExecutor(LocalPoolExecutor):
+    """
+    Pool of worker threads in this process, see `LocalPoolExecutor`.
+    """
+    def _make_pool(self, processes, initializer):
+        return ThreadPool(processes=processes, initializer=initializer)
+
+
+# The queues live in the server process of the coordinator. Messages are
+# pickled by the coordinator and the workers, so that the server never has
+# to import the validation code.
+_TASKS = Queue.Queue()
+_RESULTS = Queue.Queue()
+
+LOCAL_HOSTS = ['127.0.0.1', 'localhost']
+
+
+def _get_tasks():
+    return _TASKS
+
+
+def _get_results():
+    return _RESULTS
+
+
+class _QueueManager(BaseManager):
+    pass
+
+
+_QueueManager.register('get_tasks', callable=_get_tasks)
+_QueueManager.register('get_results', callable=_get_results)
+
+
+def _main_module_name():
+    # the importable name of the coordinator's script, e.g.
+    # trollvalidation.validations.ice_conc_450_validation for
+    # python trollvalidation/validations/ice_conc_450_validation.py
+    main = sys.modules['__main__']
+    path = getattr(main, '__file__', None)
+    if not path:
+        return None
+    parts = [os.path.splitext(os.path.basename(path))[0]]
+    if getattr(main, '__package__', None):
+        return '{0}.{1}'.format(main.__package__, parts[0])
+    directory = os.path.dirname(os.path.abspath(path))
+    while os.path.isfile(os.path.join(directory, '__init__.py')):
+        parts.insert(0, os.path.basename(directory))
+        directory = os.path.dirname(directory)
+    return '.'.join(parts)
+
+
+def _dumps(obj):
+    """
+    Pickles a message. Functions of the coordinator's script are pickled by
+    the qualified name of the script's module instead of as members of
+    `__main__`, which is another module in the workers.
+    """
+    main_name = []
+
+    def persistent_id(obj):
+        if not isinstance(obj, types.FunctionType) or \
+                obj.__module__ != '__main__':
+            return None
+        if not main_name:
+            main_name.append(_main_module_name())
+        if not main_name[0]:
+            raise pickle.PicklingError('Cannot send {0} of an interactive '
+                                       'session to workers'.format(obj))
+        return '{0}:{1}'.format(main_name[0], obj.__name__)
+
+    buf = StringIO()
+    pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    return buf.getvalue()
+
+
+def _loads(payload):
+    def persistent_load(pid):
+        module_name, name = pid.split(':')
+        return getattr(importlib.import_module(module_name), name)
+
+    unpickler = pickle.Unpickler(StringIO(payload))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+def run_worker(address, authkey, initializer=warm_worker):
+    """
+    Connects to a coordinator and runs the steps it dispatches until the
+    coordinator closes or goes away.
+
+    :param address: tuple
+        Host and port of the coordinator.
+    :param authkey: str
+        The shared secret of the coordinator.
+    """
+    manager = _QueueManager(address=address, authkey=authkey)
+    manager.connect()
+    tasks, results = manager.get_tasks(), manager.get_results()
+    initializer()
+
+    LOG.info('Worker {0} connected to {1}'.format(os.getpid(), address))
+    while True:
+        try:
+            message = tasks.get()
+        except (EOFError, IOError):
+            break
+        if message is None:
+            break
+        task_id, payload = message
+        # tell the coordinator that the step is running, its timeout starts
+        results.put((task_id, None))
+        try:
+            func, item = _loads(payload)
+            answer = (True, func(item))
+        except Exception, e:
+            LOG.exception(e)
+            answer = (False, e)
+        results.put((task_id, _dumps(answer)))
+
+
+class DistributedExecutor(Executor):
+    """
+    Coordinator, which dispatches steps to worker processes on any number
+    of machines through a task queue and gathers their results through a
+    result queue. The file pairs are sharded dynamically, every idle worker
+    pulls the next step. Every result carries the metric row of a step
+    together with its timings and stage profile, which the task runner
+    accumulates into the cost model, the worker utilization and the run
+    profile, so there is no state left in the workers to gather.
+
+    :param address: tuple
+        Host and port to serve the queues on. Port 0 picks a free port.
+        Defaults to this machine only.
+    :param authkey: str
+        Shared secret of the coordinator and its workers. It is required
+        when serving on other hosts than this machine, a random one is used
+        for local workers only.
+    :param local_workers: int
+        Number of worker processes to start on this machine, e.g., as a
+        stand-in for a cluster when testing.
+    :param task_timeout: float
+        Seconds after which a step, which a worker started but did not
+        finish, is dispatched again. All unfinished steps are dispatched
+        again, if no worker sent anything for as long. None waits forever.
+
+    :raises: ValueError
+        If no authkey is given for workers on other machines.
+    """
+    def __init__(self, address=('127.0.0.1', 0), authkey=None,
+                 local_workers=0, task_timeout=None):
+        super(DistributedExecutor, self).__init__()
+        if not authkey:
+            if address[0] not in LOCAL_HOSTS:
+                raise ValueError('An authkey is required to serve workers '
+                                 'on {0}'.format(address[0] or 'all hosts'))
+            authkey = uuid.uuid4().hex
+        self.authkey = authkey
+        self.task_timeout = task_timeout
+        self._ids = itertools.count()
+
+        self.manager = _QueueManager(address=tuple(address),
+                                     authkey=self.authkey)
+        self.manager.start()
+        self.address = self.manager.address
+        self.tasks = self.manager.get_tasks()
+        self.results = self.manager.get_results()
+        LOG.info('Coordinator serving on {0}'.format(self.address))
+
+        self.workers = []
+        for _ in range(local_workers):
+            worker = mp.Process(target=run_worker,
+                                args=(self.address, self.authkey))
+            worker.start()
+            self.workers.append(worker)
+
+    def _requeue_expired(self, pending, started, last_message):
+        # steps of workers, which got lost, are dispatched again, steps
+        # still waiting in the queue are not, unless no worker sent anything
+        # for the timeout, e.g. as the worker of a step got lost before it
+        # reported the start of the step
+        now = time.time()
+        if now - last_message >= self.task_timeout:
+            expired = list(pending)
+        else:
+            expired = [task_id for task_id, start in started.iteritems()
+                       if now - start >= self.task_timeout]
+        if expired:
+            LOG.warning('No results of {0} steps after {1}s, dispatching '
+                        'them again'.format(len(expired), self.task_timeout))
+        for task_id in expired:
+            started.pop(task_id, None)
+            self.tasks.put((task_id, pending[task_id]))
+        return len(expired) == len(pending)
+
+    def imap_unordered(self, func, iterable):
+        pending = {}
+        for item in iterable:
+            task_id = next(self._ids)
+            pending[task_id] = _dumps((func, item))
+            self.tasks.put((task_id, pending[task_id]))
+
+        # the times at which the workers started the steps and at which the
+        # last message of any worker arrived
+        started = {}
+        last_message = time.time()
+        while pending:
+            timeout = None
+            if self.task_timeout is not None:
+                if self._requeue_expired(pending, started, last_message):
+                    last_message = time.time()
+                timeout = max(0., min(started.values() + [last_message]) +
+                              self.task_timeout - time.time())
+            try:
+                task_id, payload = self.results.get(timeout=timeout)
+            except Queue.Empty:
+                continue
+            last_message = time.time()
+            if task_id not in pending:
+                # a step that was dispatched twice
+                continue
+            if payload is None:
+                started[task_id] = time.time()
+                continue
+            del pending[task_id]
+            started.pop(task_id, None)
+            success, value = _loads(payload)
+            if not success:
+                raise value
+            yield value
+
+    def _shutdown(self):
+        self.manager.shutdown()
+        # processes forked later would try to reach the manager through
+        # its proxies for a while
+        self.tasks = self.results = None
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self._shutdown()
+
+    def terminate(self):
+        for worker in self.workers:
+            worker.terminate()
+            worker.join()
+        self._shutdown()
+
+
+def get_executor(backend='local', **kwargs):
+    """
+    Creates an executor as configured by `EXECUTOR` in a validation
+    configuration, e.g. `get_executor(**cfg.EXECUTOR)`.
+
+    :param backend: str
+        One of 'local', 'thread' or 'distributed'.
+    :param kwargs:
+        The parameters of the executor class.
+    """
+    backends = {
+        'local': LocalPoolExecutor,
+        'thread': ThreadPoolExecutor,
+        'distributed': DistributedExecutor,
+    }
+    return backends[backend](**kwargs)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    host, port = sys.argv[1].rsplit(':', 1)
+    run_worker((host, int(port)), sys.argv[2])
@@ -3,15 +3,24 @@
 
 
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from datetime import datetime
 import glob
+import hashlib
+import json
+import multiprocessing as mp
 import os
 import logging
+import sys
+from trollvalidation import results_store
+from trollvalidation.lazy import lazy_import
 import validations.configuration as cfg
 
+pd = lazy_import('pandas')
+# the Agg backend renders without a display, it is selected before any
+# other part of matplotlib is imported
+matplotlib = lazy_import('matplotlib', submodules=[
+    'matplotlib.dates', 'matplotlib.font_manager', 'matplotlib.figure',
+    'matplotlib.backends.backend_agg'], on_import=lambda m: m.use('Agg'))
+
 
 LOG = logging.getLogger(__name__)
 # logging.basicConfig(level=logging.DEBUG,
@@ -20,60 +29,197 @@ LOG = logging.getLogger(__name__)
 
 image_format = 'png'
 
+# The plots of a report: suffix of the image file, kind of plot, columns,
+# styles (line plots) or colors (bar plots), title, y-axis label, legend and
+# y-axis limits (line plots) or bar width in days (bar plots)
+PLOTS = [
+    ('match', 'bar', ['within_20pct', 'within_10pct'], ['0.1', '0.7'],
+     'Sea Ice Concentration', 'Fraction of grid points (%)',
+     ['Match +/-20%', 'Match +/-10%'], 1),
+    ('bias', 'line', ['water_bias', 'ice_bias', 'total_bias'],
+     ['bo-', 'rs--', 'k^:'], 'Bias of sea ice concentration',
+     '% concentration', ['Water', 'Ice', 'Total'], (-20, 15)),
+    ('stddev', 'line', ['water_stddev', 'ice_stddev', 'total_stddev'],
+     ['bo-', 'rs--', 'k^:'], 'Standard deviation of sea ice concentration',
+     'Std. dev (% concentration)', ['Water', 'Ice', 'Total'], (0, 30)),
+]
+MANIFEST = 'plots_manifest.json'
+
+# How long series are thinned out before drawing: None draws every point,
+# 'auto' aggregates to the finest of the FREQUENCIES with at most MAX_POINTS
+# bins and draws their mean with a min/max envelope, 'lttb' keeps MAX_POINTS
+# points of every line with Largest-Triangle-Three-Buckets (bar plots are
+# aggregated). Series with at most MAX_POINTS points are drawn as they are.
+DECIMATION = 'auto'
+MAX_POINTS = 500
+# pandas frequencies to aggregate to and their length in days
+FREQUENCIES = [('W', 7.), ('M', 30.44), ('Q', 91.31), ('A', 365.25)]
+
+
+def _new_axes():
+    # a figure of its own instead of pyplot's global one, so that plots can
+    # be drawn concurrently and nothing has to be cleared between them
+    fig = matplotlib.figure.Figure()
+    matplotlib.backends.backend_agg.FigureCanvasAgg(fig)
+    return fig.add_subplot(111)
+
+
+def choose_frequency(dates, max_points=MAX_POINTS):
+    """Returns the finest frequency of FREQUENCIES, at which the dates fall
+    into at most 'max_points' bins, or None if there are not more than
+    'max_points' dates.
+    """
+    if len(dates) <= max_points:
+        return None
+    span = (dates[-1] - dates[0]).days
+    for freq, days in FREQUENCIES:
+        if span / days <= max_points:
+            return freq
+    return FREQUENCIES[-1][0]
+
 
-def line_plot(dates, values, styles, title, ylabel, legend, ylim, format, path):
-    """Returns matplotlib line plot as StringIO object.
+def aggregate(dates, values, freq):
+    """Aggregates datasets to bins of a pandas frequency.
 
     Arguments:
     dates  -- List of dates
-    values -- List of datasets. Each dataset is a list
+    values -- List of datasets, missing values are NaN
+    freq   -- pandas frequency, e.g. 'W' or 'M'
+
+    Returns: bin_dates, means, minima, maxima
+    bin_dates -- Start of every bin as datetimes
+    means, minima, maxima -- Lists with an array for each dataset
+    """
+    frame = pd.DataFrame(np.column_stack(values),
+                         index=pd.DatetimeIndex(dates))
+    bins = frame.resample(freq, label='left', closed='left')
+    mean, low, high = bins.mean(), bins.min(), bins.max()
+    columns = range(len(values))
+    return (mean.index.to_pydatetime(), [mean[c].values for c in columns],
+            [low[c].values for c in columns], [high[c].values for c in columns])
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling of a line.
+
+    Arguments:
+    x, y      -- Arrays of the points of the line, missing y are NaN
+    threshold -- Number of points to keep
+
+    Returns: indices of the kept points
+    """
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= threshold or threshold < 3:
+        return valid
+    x, y = np.asarray(x, dtype=float)[valid], np.asarray(y)[valid]
+    n = len(x)
+    # the first and last point are kept, the points in between are split
+    # into threshold - 2 buckets, each of which keeps one point
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = np.empty(threshold, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + np.argmax(area)
+        keep[i + 1] = a
+    return valid[keep]
+
+
+def line_plot(dates, values, styles, title, ylabel, legend, ylim, format, path,
+              decimation=None, max_points=MAX_POINTS):
+    """Saves a matplotlib line plot and returns its figure.
+
+    Arguments:
+    dates  -- List of dates
+    values -- List of datasets. Each dataset is a list or array, missing
+              values are NaN
     styles -- List of style codes. One element for each dataset
     title  -- Plot title
     ylabel -- Plot y-axis label
     legend -- List of plot legend. One element for each dataset
     ylim   -- Y-axis limits as typle: (y_min, y_max)
     format -- Image format
+    decimation -- None, 'auto' or 'lttb', see DECIMATION
+    max_points -- Number of points per line when decimating
     """
-    dates_mpl = matplotlib.dates.date2num(dates)
+    ax = _new_axes()
+    freq = choose_frequency(dates, max_points) if decimation else None
 
     plots = []
-    i = 0
-    for item in values:
-        plots.append(plt.plot(dates_mpl, item, styles[i]))
-        i += 1
+    if freq and decimation == 'lttb':
+        dates_mpl = matplotlib.dates.date2num(dates)
+        for item, style in zip(values, styles):
+            keep = lttb(dates_mpl, np.asarray(item, dtype=float), max_points)
+            plots.append(ax.plot(dates_mpl[keep], np.asarray(item)[keep],
+                                 style, markersize=3))
+    elif freq:
+        bin_dates, means, lows, highs = aggregate(dates, values, freq)
+        dates_mpl = matplotlib.dates.date2num(bin_dates)
+        for mean, low, high, style in zip(means, lows, highs, styles):
+            line = ax.plot(dates_mpl, mean, style, markersize=3)
+            ax.fill_between(dates_mpl, low, high, where=~np.isnan(mean),
+                            color=line[0].get_color(), alpha=0.2, linewidth=0)
+            plots.append(line)
+    else:
+        dates_mpl = matplotlib.dates.date2num(dates)
+        for item, style in zip(values, styles):
+            plots.append(ax.plot(dates_mpl, item, style))
 
-    _set_line_plot(dates)
+    _set_line_plot(ax, dates)
 
-    return _get_plot(plots, dates, title, ylabel, legend, ylim, format, path)
+    return _get_plot(ax, plots, dates, title, ylabel, legend, ylim, format,
+                     path)
 
 
 def bar_side_plot(dates, values, colors, title, ylabel, legend, width, format,
-                  path):
-    """Returns matplotlib bar side plot as StringIO object.
+                  path, decimation=None, max_points=MAX_POINTS):
+    """Saves a matplotlib bar side plot and returns its figure.
 
     Arguments:
     dates  -- List of dates
-    values -- List of datasets. Each dataset is a list
+    values -- List of datasets. Each dataset is a list or array, missing
+              values are NaN
     colors -- List of color codes. One element for each dataset
     title  -- Plot title
     ylabel -- Plot y-axis label
     legend -- List of plot legend. One element for each dataset
     width  -- Width of bars in number of days
     format -- Image format
+    decimation -- None or any other value to draw the mean of aggregated
+                  bins with their min/max range, see DECIMATION
+    max_points -- Maximum number of bars per dataset when aggregating
     """
-
-    dates_mpl = matplotlib.dates.date2num(dates)
+    ax = _new_axes()
+    freq = choose_frequency(dates, max_points) if decimation else None
 
     plots = []
-    i = 0
-    for item in values:
-        plots.append(plt.bar(dates_mpl + i*width, item, width,
-                             color=colors[i], edgecolor=colors[i]))
-        i += 1
-
-    _set_bar_plot(dates, width)
-    return _get_plot(plots, dates, title, ylabel, legend, (0, 200), format,
-                     path)
+    if freq:
+        bin_dates, means, lows, highs = aggregate(dates, values, freq)
+        dates_mpl = matplotlib.dates.date2num(bin_dates)
+        width = dict(FREQUENCIES)[freq] / (len(values) + 1)
+        for i, (mean, low, high, color) in enumerate(
+                zip(means, lows, highs, colors)):
+            plots.append(ax.bar(dates_mpl + i*width, mean, width, color=color,
+                                edgecolor=color, align='edge'))
+            ax.vlines(dates_mpl + (i + 0.5)*width, low, high, color='k',
+                      linewidth=0.5)
+    else:
+        dates_mpl = matplotlib.dates.date2num(dates)
+        for i, (item, color) in enumerate(zip(values, colors)):
+            plots.append(ax.bar(dates_mpl + i*width, item, width,
+                                color=color, edgecolor=color))
+
+    _set_bar_plot(ax, dates, width)
+    return _get_plot(ax, plots, dates, title, ylabel, legend, (0, 200),
+                     format, path)
 
 
 def get_reduced_dates(dates, max_count=30):
@@ -90,59 +236,56 @@ def get_reduced_dates(dates, max_count=30):
     """
 
     dates_mpl = matplotlib.dates.date2num(dates)
-    disp_dates = []
 
     if len(dates) > max_count:
-        dt = float(dates_mpl[-1] - dates_mpl[0])/(max_count - 1)
-        dates_mpl_reduced = [dates_mpl[0] + dt*i for i in range(max_count)]
+        dates_mpl_reduced = np.linspace(dates_mpl[0], dates_mpl[-1],
+                                        max_count)
     else:
-        dates_mpl_reduced = dates_mpl
+        dates_mpl_reduced = np.asarray(dates_mpl)
 
-    for num_date in dates_mpl_reduced:
-        date = matplotlib.dates.num2date(num_date)
-        disp_dates.append(date.strftime('%Y-%m-%d'))
+    disp_dates = [matplotlib.dates.num2date(num_date).strftime('%Y-%m-%d')
+                  for num_date in dates_mpl_reduced]
 
-    return np.array(dates_mpl_reduced), disp_dates
+    return dates_mpl_reduced, disp_dates
 
 
-def _set_line_plot(dates):
+def _set_line_plot(ax, dates):
     # Set line plot specific properties
 
     # Reduce number of dates if needed and get display dates
     dates_mpl, disp_dates = get_reduced_dates(dates)
 
-    plt.xticks(dates_mpl, disp_dates, rotation=45, fontsize=8)
-    plt.xlim((dates_mpl[0], dates_mpl[-1]))
-    plt.gca().yaxis.grid(True)
+    ax.set_xticks(dates_mpl)
+    ax.set_xticklabels(disp_dates, rotation=45, fontsize=8)
+    ax.set_xlim((dates_mpl[0], dates_mpl[-1]))
+    ax.yaxis.grid(True)
 
 
-def _set_bar_plot(dates, width):
+def _set_bar_plot(ax, dates, width):
     # Set bar plot specific properties
 
     # Reduce number of dates if needed and get display dates
     dates_mpl, disp_dates = get_reduced_dates(dates)
 
-    plt.yticks(np.arange(0, 101, 10))
-    plt.xticks(dates_mpl + width/2.0, disp_dates, rotation=45, fontsize=8)
-    plt.xlim(dates_mpl[0] - width, dates_mpl[-1] + 2*width)
+    ax.set_yticks(np.arange(0, 101, 10))
+    ax.set_xticks(dates_mpl + width/2.0)
+    ax.set_xticklabels(disp_dates, rotation=45, fontsize=8)
+    ax.set_xlim(dates_mpl[0] - width, dates_mpl[-1] + 2*width)
 
 
-def _get_plot(plots, dates, title, ylabel, legend, ylim, format, path):
+def _get_plot(ax, plots, dates, title, ylabel, legend, ylim, format, path):
     # Set general plot properties
-    plt.ylim(ylim)
-    plt.ylabel(ylabel)
+    ax.set_ylim(ylim)
+    ax.set_ylabel(ylabel)
 
-    plt.title(title)
+    ax.set_title(title)
 
-    plot_list = []
-    for item in plots:
-        plot_list.append(item[0])
+    plot_list = [item[0] for item in plots]
 
     prop = matplotlib.font_manager.FontProperties(size=8)
-    plt.legend(plot_list, legend, prop=prop)
-    plt.savefig(path, format=format)
-    plt.clf()
-    return plt
+    ax.legend(plot_list, legend, prop=prop)
+    ax.figure.savefig(path, format=format)
+    return ax.figure
 
 
 def generate_plot_names(reportname, plot_suffix):
@@ -154,81 +297,165 @@ def generate_plot_names(reportname, plot_suffix):
     return new_filename
 
 
-def generate_plots(directory):
-    reports = glob.glob(os.path.join(directory, "*.csv"))
+class PlotManifest(object):
+    """Remembers a digest of the inputs and rendering parameters of every
+    set of plots, so that only plots whose inputs changed are rendered
+    again.
+
+    Arguments:
+    path -- Path of the JSON manifest
+    """
+    def __init__(self, path):
+        super(PlotManifest, self).__init__()
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path) as fp:
+                self.entries = json.load(fp)
+
+    def is_current(self, key, digest, plots):
+        return self.entries.get(key) == digest and \
+            all(os.path.isfile(p) for p in plots)
+
+    def update(self, key, digest):
+        self.entries[key] = digest
+
+    def save(self):
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w') as fp:
+            json.dump(self.entries, fp, indent=1, sort_keys=True)
+        os.rename(tmp_file, self.path)
+
+
+def _digest(*parts):
+    md5 = hashlib.md5()
+    md5.update(json.dumps([PLOTS, image_format, DECIMATION, MAX_POINTS]))
+    for part in parts:
+        md5.update(part)
+    return md5.hexdigest()
+
+
+def _manifest_key(report, year):
+    return '{0}:{1}'.format(os.path.basename(report), year or 'all')
+
+
+def _plot_suffix(name, year=None):
+    return name if year is None else '{0}_{1}'.format(year, name)
+
+
+def plot_jobs(report, append=False):
+    """Lists the sets of plots of a report with the digest of their inputs.
+
+    Arguments:
+    report -- Path of a CSV report
+    append -- Plot every year of the report separately, so that a daily
+              run only renders the plots of the current year again
+
+    Returns: list of tuples (report, year, digest), year is None for plots
+    of the whole report
+    """
+    if not append:
+        with open(report, 'rb') as fp:
+            return [(report, None, _digest(fp.read()))]
+    df = load_report(report)
+    jobs = []
+    for year, part in df.groupby(df['reference_time'].dt.year):
+        rows = pd.util.hash_pandas_object(part, index=False).values
+        jobs.append((report, int(year), _digest(rows.tostring())))
+    return jobs
+
+
+def generate_plots(directory, processes=None, append=False):
+    """Renders the plots of all reports in a directory, whose reports or
+    rendering parameters changed since the last time, in parallel worker
+    processes.
+
+    Arguments:
+    directory -- Directory of the CSV reports
+    processes -- Number of worker processes, defaults to the number of CPUs
+    append    -- Render plots per year of the reports, see `plot_jobs`
+    """
+    reports = [r for r in glob.glob(os.path.join(directory, "*.csv"))
+               if not r.endswith('_checkpoint.csv')]
     print("Found {0}".format(reports))
+    manifest = PlotManifest(os.path.join(directory, MANIFEST))
+    jobs = []
     for report in reports:
-        # if os.path.basename(report).startswith('OSI401_'):
-        print('Generating... {0}'.format(report))
-        try:
-            generate_plots_per_report(report)
-        except Exception, e:
-            LOG.exception(e)
-
-
-def generate_plots_per_report(report):
-    # read CSV file
-    data = np.genfromtxt(report, delimiter=',', dtype="U75", skip_header=1)
-
-    fmt = '%Y-%m-%d'
-    # to_float = lambda s: float(s or np.nan)
-    # to_date = lambda s: datetime.strptime(s, fmt)
-    # converters = {
-    #     0: to_date, 1: to_date, 2: to_date,
-    #     3: to_float, 4: to_float, 5: to_float, 6: to_float, 7: to_float,
-    #     8: to_float, 9: to_float, 10: to_float
-    # }
-    # data = np.genfromtxt(report, delimiter=',', dtype="U75", skip_header=1,
-    #           missing_values='--', converters=converters)
-    #
-    #
-    # data = np.genfromtxt(report, delimiter=',', dtype=None,
-    #                      skip_header=1, missing_values='--',
-    #                      filling_values=-999.0, converters=converters)
-    # data
-
-    # data = data[data.argsort()]  # Sort by the 1st column
-
-    # df = pd.read_csv(report, index_col=0, parse_dates=True, na_values='--')
-
+        for job in plot_jobs(report, append):
+            _, year, digest = job
+            plots = [generate_plot_names(report, _plot_suffix(p[0], year))
+                     for p in PLOTS]
+            if not manifest.is_current(_manifest_key(report, year), digest,
+                                       plots):
+                jobs.append(job)
+    print("{0} sets of plots to render".format(len(jobs)))
+    if not jobs:
+        return
+    pool = mp.Pool(min(processes or mp.cpu_count(), len(jobs)))
+    try:
+        for report, year, digest, success in pool.imap_unordered(
+                _generate_plots_star, jobs):
+            print('Generated... {0} {1}'.format(report, year or ''))
+            if success:
+                manifest.update(_manifest_key(report, year), digest)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        manifest.save()
+
+
+def _generate_plots_star(job):
+    # runs in a worker, a failing report must not stop the others
+    report, year, digest = job
+    try:
+        generate_plots_per_report(report, year)
+    except Exception, e:
+        LOG.exception(e)
+        return report, year, digest, False
+    return report, year, digest, True
+
+
+def load_report(report):
+    """Reads a CSV report into a DataFrame sorted by reference time with
+    datetime and float columns, in which missing values ('--') are NaN.
+    """
+    df = results_store.read_csv_report(report)
     # Sort the validation results after reference time, just to be sure in
     # case the CSV file is unsorted
+    return df.sort_values('reference_time')
+
 
-    data = data[data[:, 0].argsort()]  # Sort by the 1st column
+def generate_plots_per_report(report, year=None):
+    """Renders the plots listed in `PLOTS` of a report.
 
+    Arguments:
+    report -- Path of a CSV report
+    year   -- Only plot the results of this year
+    """
     # header from CSV file
     # 'reference_time', 'run_time', 'total_bias', 'ice_bias', 'water_bias',
     # 'total_stddev', 'ice_stddev', 'water_stddev', 'within_10pct',
     # 'within_20pct'
-    dates = [datetime.strptime(d, fmt) for d in data[:, 1]]
-
-    total_bias = [-999 if v == '--' else float(v) for v in data[:, -8]]
-    ice_bias = [-999 if v == '--' else float(v) for v in data[:, -7]]
-    water_bias = [-999 if v == '--' else float(v) for v in data[:, -6]]
-
-    total_stddev = [-999 if v == '--' else float(v) for v in data[:, -5]]
-    ice_stddev = [-999 if v == '--' else float(v) for v in data[:, -4]]
-    water_stddev = [-999 if v == '--' else float(v) for v in data[:, -3]]
-
-    witin_10pct = [-999 if v == '--' else float(v) for v in data[:, -2]]
-    witin_20pct = [-999 if v == '--' else float(v) for v in data[:, -1]]
-
-    plot_name = generate_plot_names(report, 'match')
-    bar_side_plot(dates, [witin_20pct, witin_10pct], ['0.1', '0.7'],
-                  'Sea Ice Concentration', 'Fraction of grid points (%)',
-                  ['Match +/-20%', 'Match +/-10%'], 1, image_format, plot_name)
-
-    plot_name = generate_plot_names(report, 'bias')
-    line_plot(dates, [water_bias, ice_bias, total_bias],
-              ['bo-', 'rs--', 'k^:'], 'Bias of sea ice concentration',
-              '% concentration', ['Water', 'Ice', 'Total'], (-20, 15),
-              image_format, plot_name)
-    plot_name = generate_plot_names(report, 'stddev')
-    line_plot(dates, [water_stddev, ice_stddev, total_stddev],
-              ['bo-', 'rs--', 'k^:'],
-              'Standard deviation of sea ice concentration',
-              'Std. dev (% concentration)', ['Water', 'Ice', 'Total'], (0, 30),
-              image_format, plot_name)
+    df = load_report(report)
+    if year is not None:
+        df = df[df['reference_time'].dt.year == year]
+    dates = df['reference_time'].dt.to_pydatetime()
+
+    for name, kind, columns, styles, title, ylabel, legend, option in PLOTS:
+        plot_name = generate_plot_names(report, _plot_suffix(name, year))
+        values = [df[c].values for c in columns]
+        if kind == 'bar':
+            bar_side_plot(dates, values, styles, title, ylabel, legend,
+                          option, image_format, plot_name, DECIMATION)
+        else:
+            line_plot(dates, values, styles, title, ylabel, legend, option,
+                      image_format, plot_name, DECIMATION)
+
 
 if __name__ == '__main__':
-    generate_plots(cfg.OUTPUT_DIR)
+    # operational daily runs only extend the plots of the current year with
+    # python generate_plots.py --append
+    generate_plots(cfg.OUTPUT_DIR, append='--append' in sys.argv)
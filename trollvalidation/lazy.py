@@ -0,0 +1,73 @@
+"""
+Lazy imports of heavy dependencies.
+
+Modules bind their heavy dependencies at module level as usual, e.g.
+
+    pd = lazy_import('pandas')
+
+but the dependency is only imported when one of its attributes is used the
+first time. Worker processes and tools, which never touch a dependency,
+never pay for importing it.
+"""
+import importlib
+import sys
+import threading
+import types
+
+_lock = threading.RLock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module, which imports the module on first attribute
+    access and then forwards all attribute accesses to it.
+    """
+    def __init__(self, name, submodules=(), on_import=None):
+        super(LazyModule, self).__init__(name)
+        self._lazy_submodules = submodules
+        self._lazy_on_import = on_import
+        self._lazy_module = None
+
+    def _load(self):
+        if self._lazy_module is None:
+            with _lock:
+                if self._lazy_module is None:
+                    module = importlib.import_module(self.__name__)
+                    if self._lazy_on_import:
+                        self._lazy_on_import(module)
+                    for submodule in self._lazy_submodules:
+                        importlib.import_module(submodule)
+                    self._lazy_module = module
+        return self._lazy_module
+
+    def __getattr__(self, name):
+        if name.startswith('_lazy_'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'imported' if self._lazy_module else 'not imported'
+        return '<lazy module {0!r}, {1}>'.format(self.__name__, state)
+
+
+def lazy_import(name, submodules=(), on_import=None):
+    """
+    :param name: str
+        Name of the module, e.g. 'pandas' or 'PIL.Image'.
+    :param submodules: list
+        Full names of submodules, which are imported together with the
+        module, e.g. ['matplotlib.dates'].
+    :param on_import: callable
+        Called with the module right after it is imported, e.g., to select
+        a matplotlib backend before importing the submodules.
+
+    :return: module | LazyModule
+        The module if it is imported already, otherwise a stand-in.
+    """
+    if name in sys.modules and not submodules and not on_import:
+        return sys.modules[name]
+    return LazyModule(name, submodules, on_import)
+
@@ -0,0 +1,196 @@
+"""
+Shared memory transport of the maps of a validation.
+
+A map arena is a set of memory mapped files, into which the worker
+processes write the decoded evaluation and original maps of every step.
+The parent process, or any other process, reads them right from the page
+cache instead of receiving pickled arrays or unpickling per date files.
+Each reference date has a fixed slot in the arena. Besides the maps, the
+arena accumulates per-cell sums of the differences between original and
+evaluation data over all steps. Writers take a lock on the accumulators, so
+that a date written again, e.g. by a re-run step, replaces its contribution
+instead of adding it twice.
+
+Put the arena on a tmpfs, e.g. `/dev/shm`, to keep it in memory. The files
+are sparse, only slots which are written take up space.
+"""
+import fcntl
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+DATE_FORMAT = '%Y-%m-%d'
+EVAL, ORIG = 0, 1
+
+
+class MapArena(object):
+    """
+    :param path: str
+        Directory of the arena. It is created if it does not exist.
+    :param shape: tuple
+        Shape (y, x) of the maps.
+    :param start: str
+        Reference date of the first slot, e.g. '1972-01-01'.
+    :param days: int
+        Number of daily slots.
+    """
+    def __init__(self, path, shape, start, days):
+        super(MapArena, self).__init__()
+        self.path = path
+        self.shape = tuple(shape)
+        self.start = datetime.strptime(start, DATE_FORMAT)
+        self.days = days
+
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # created by another worker in the meantime
+                pass
+        meta = {'shape': list(self.shape), 'start': start, 'days': days}
+        meta_file = os.path.join(path, 'meta.json')
+        if os.path.isfile(meta_file):
+            with open(meta_file) as fp:
+                if json.load(fp) != meta:
+                    raise ValueError('Arena {0} has a different layout than '
+                                     '{1}'.format(path, meta))
+        else:
+            tmp_file = '{0}.{1}'.format(meta_file, os.getpid())
+            with open(tmp_file, 'w') as fp:
+                json.dump(meta, fp)
+            os.rename(tmp_file, meta_file)
+
+        maps_shape = (days, 2) + self.shape
+        self.maps = self._memmap('maps.f4', np.float32, maps_shape)
+        self.masks = self._memmap('masks.u1', np.bool_, maps_shape)
+        self.filled = self._memmap('filled.u1', np.bool_, (days,))
+        # sum of differences, sum of squared differences and count per cell
+        self.accum = self._memmap('accum.f8', np.float64, (3,) + self.shape)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Opens an existing arena, e.g., in the parent process.
+        """
+        with open(os.path.join(path, 'meta.json')) as fp:
+            meta = json.load(fp)
+        return cls(path, meta['shape'], meta['start'], meta['days'])
+
+    def _memmap(self, name, dtype, shape):
+        fname = os.path.join(self.path, name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        # growing the file to its size is idempotent, so concurrent
+        # writers can all do it
+        with open(fname, 'ab') as fp:
+            if os.fstat(fp.fileno()).st_size < size:
+                fp.truncate(size)
+        return np.memmap(fname, dtype=dtype, mode='r+', shape=shape)
+
+    def slot(self, ref_time):
+        slot = (datetime.strptime(ref_time, DATE_FORMAT) - self.start).days
+        if not 0 <= slot < self.days:
+            raise IndexError('{0} is outside of the arena {1}'.format(
+                ref_time, self.path))
+        return slot
+
+    def _contribution(self, slot):
+        # differences of the stored maps of a slot, so that a contribution
+        # added once is subtracted exactly when the slot is written again
+        maps = self.maps[slot].astype(np.float64)
+        valid = ~(self.masks[slot, EVAL] | self.masks[slot, ORIG])
+        diff = np.where(valid, maps[ORIG] - maps[EVAL], 0.)
+        return diff, diff ** 2, valid
+
+    def write(self, ref_time, eval_data, orig_data):
+        """
+        Stores the maps of a step and adds their differences to the per-cell
+        accumulators. Writing a date again, e.g. when a step is re-run,
+        replaces its maps and their contribution to the accumulators.
+        """
+        slot = self.slot(ref_time)
+        # several workers add to the same accumulators
+        with open(os.path.join(self.path, 'accum.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.filled[slot]:
+                for accum, old in zip(self.accum, self._contribution(slot)):
+                    accum -= old
+            for kind, data in ((EVAL, eval_data), (ORIG, orig_data)):
+                self.maps[slot, kind] = np.ma.getdata(data)
+                self.masks[slot, kind] = np.ma.getmaskarray(data)
+            self.filled[slot] = True
+            for accum, new in zip(self.accum, self._contribution(slot)):
+                accum += new
+            self.accum.flush()
+
+    def read(self, ref_time):
+        """
+        :return: tuple
+            The evaluation and original maps of a reference date as masked
+            arrays backed by the arena, i.e. without copying them.
+        """
+        slot = self.slot(ref_time)
+        return tuple(np.ma.array(self.maps[slot, kind],
+                                 mask=self.masks[slot, kind], copy=False)
+                     for kind in (EVAL, ORIG))
+
+    def dates(self):
+        """
+        :return: list
+            The sorted reference dates of all written slots.
+        """
+        return [(self.start + timedelta(days=int(s))).strftime(DATE_FORMAT)
+                for s in np.flatnonzero(self.filled)]
+
+    def statistics(self):
+        """
+        :return: tuple
+            Per-cell bias and standard deviation of the differences of
+            original and evaluation data and the number of steps per cell.
+        """
+        sums, squares, count = self.accum
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bias = sums / count
+            stddev = np.sqrt(np.maximum(squares / count - bias ** 2, 0.))
+        mask = count == 0
+        return (np.ma.array(bias, mask=mask), np.ma.array(stddev, mask=mask),
+                count)
+
+    def to_hdf5(self, group, hemisphere):
+        """
+        Writes the maps and the per-cell statistics into an HDF5 group in
+        the layout of `collect_pickled_data`, one map at a time.
+        """
+        dates = self.dates()
+        if not dates:
+            return
+        shape = self.shape + (len(dates),)
+        for kind, name in ((ORIG, 'satellite'), (EVAL, 'reference')):
+            ds = group.create_dataset('data/{0}/{1}'.format(hemisphere, name),
+                                      shape, dtype='f', compression='gzip',
+                                      fillvalue=np.nan)
+            for idx, ref_time in enumerate(dates):
+                ds[:, :, idx] = self.read(ref_time)[kind].filled(np.nan)
+            ds.attrs['dates'] = np.array(dates)
+
+        bias, stddev, count = self.statistics()
+        for name, data in (('bias', bias), ('stddev', stddev)):
+            group.create_dataset('statistics/{0}/{1}'.format(hemisphere, name),
+                                 data=data.filled(np.nan), dtype='f',
+                                 compression='gzip')
+        group.create_dataset('statistics/{0}/count'.format(hemisphere),
+                             data=count, dtype='i4', compression='gzip')
+
+
+_ARENAS = {}
+
+
+def get_arena(path, shape, start, days):
+    """
+    :return: MapArena
+        The arena at `path`, opened once per process.
+    """
+    if path not in _ARENAS:
+        _ARENAS[path] = MapArena(path, shape, start, days)
+    return _ARENAS[path]
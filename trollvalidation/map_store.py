@@ -0,0 +1,229 @@
+"""
+Chunked HDF5 store of the maps of a validation.
+
+The worker processes append the evaluation and original maps of every step
+right into one HDF5 file, instead of dumping them into per date files, which
+have to be collected afterwards. Per hemisphere the maps are kept in
+datasets of shape (time, y, x), which grow along the time axis, are chunked
+and compressed per time step and are accompanied by a `dates` coordinate.
+Steps finish in any order, so the dates are not sorted. Use `index()` or
+`iter_maps()` to access the maps by date.
+
+Writes of several processes are serialized by a lock file next to the store
+and each write only holds one map in memory.
+
+Maps dumped into per date pickle files by earlier runs are collected out of
+core by `collect_dumps`.
+"""
+import cPickle as pickle
+import fcntl
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import re
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from trollvalidation.lazy import lazy_import
+
+h5py = lazy_import('h5py')
+
+LOG = logging.getLogger(__name__)
+
+KINDS = ['satellite', 'reference']
+
+
+class MapStore(object):
+    """
+    :param path: str
+        Path of the HDF5 file. It is created on the first write.
+    :param time_chunk: int
+        Number of time steps per chunk.
+    """
+    def __init__(self, path, time_chunk=1):
+        super(MapStore, self).__init__()
+        self.path = path
+        self.time_chunk = time_chunk
+
+    @contextmanager
+    def _locked(self, mode):
+        if mode != 'r' and not os.path.isdir(os.path.dirname(self.path)):
+            try:
+                os.makedirs(os.path.dirname(self.path))
+            except OSError:
+                # created by another worker in the meantime
+                pass
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            hdf5 = h5py.File(self.path, mode)
+            try:
+                yield hdf5
+            finally:
+                hdf5.close()
+
+    def _create(self, group, shape):
+        for kind in KINDS:
+            group.create_dataset(kind, (0,) + shape, dtype='f4',
+                                 maxshape=(None,) + shape,
+                                 chunks=(self.time_chunk,) + shape,
+                                 compression='gzip', shuffle=True,
+                                 fillvalue=np.nan)
+        group.create_dataset('dates', (0,), dtype='S10', maxshape=(None,),
+                             chunks=(1024,))
+
+    def append(self, hemisphere, ref_time, eval_data, orig_data):
+        """
+        Appends the maps of a step. The maps of a date, which is already in
+        the store, e.g., of a step that ran again, are overwritten.
+
+        :param hemisphere: str
+            'NH' or 'SH'.
+        :param ref_time: str
+            Reference date of the form YYYY-MM-DD.
+        """
+        with self._locked('a') as hdf5:
+            group = hdf5.require_group('maps/{0}'.format(hemisphere))
+            if 'dates' not in group:
+                self._create(group, np.shape(orig_data))
+            dates = group['dates']
+            idx = np.flatnonzero(dates[:] == ref_time)
+            if len(idx):
+                idx = idx[0]
+            else:
+                idx = len(dates)
+                for ds in [dates] + [group[k] for k in KINDS]:
+                    ds.resize(idx + 1, axis=0)
+                dates[idx] = ref_time
+            for kind, data in zip(KINDS, [orig_data, eval_data]):
+                group[kind][idx] = np.ma.filled(
+                    np.ma.array(data, dtype='f4'), np.nan)
+
+    def index(self, hemisphere):
+        """
+        :return: dict
+            Mapping of the reference dates of a hemisphere to their position
+            along the time axis.
+        """
+        if not os.path.isfile(self.path):
+            return {}
+        with self._locked('r') as hdf5:
+            if 'maps/{0}'.format(hemisphere) not in hdf5:
+                return {}
+            dates = hdf5['maps/{0}/dates'.format(hemisphere)][:]
+        return dict((d, i) for i, d in enumerate(dates))
+
+    @staticmethod
+    def _read(group, idx):
+        orig_data, eval_data = [np.ma.masked_invalid(group[k][idx])
+                                for k in KINDS]
+        return eval_data, orig_data
+
+    def read(self, hemisphere, ref_time):
+        """
+        :return: tuple
+            The evaluation and original map of a date as masked arrays.
+        """
+        idx = self.index(hemisphere)[ref_time]
+        with self._locked('r') as hdf5:
+            return self._read(hdf5['maps/{0}'.format(hemisphere)], idx)
+
+    def iter_maps(self, hemisphere):
+        """
+        Iterates over the maps of a hemisphere in the order of their dates,
+        one date at a time. Writers wait until the iteration is done.
+
+        :return: generator
+            Tuples of the form (ref_time, eval_data, orig_data).
+        """
+        if not os.path.isfile(self.path):
+            return
+        with self._locked('r') as hdf5:
+            if 'maps/{0}'.format(hemisphere) not in hdf5:
+                return
+            group = hdf5['maps/{0}'.format(hemisphere)]
+            dates = group['dates'][:]
+            for idx in np.argsort(dates):
+                eval_data, orig_data = self._read(group, idx)
+                yield dates[idx], eval_data, orig_data
+
+
+def _read_date(path):
+    return re.search(r'\d{4}-\d{2}-\d{2}', path).group(0)
+
+
+def _read_dump(path):
+    date_str = _read_date(path)
+    with open(path, 'rb') as fp:
+        data = np.ma.masked_outside(pickle.load(fp), 0, 100)
+    return date_str, np.ma.filled(data.astype('f4'), -9999)
+
+
+def _iter_ordered(pool, func, items, window):
+    # like pool.imap, but with at most `window` results in flight, so that
+    # fast readers cannot pile up maps in memory in front of the writer
+    items = iter(items)
+    pending = deque(pool.apply_async(func, (item,))
+                    for item in itertools.islice(items, window))
+    while pending:
+        result = pending.popleft().get()
+        for item in itertools.islice(items, 1):
+            pending.append(pool.apply_async(func, (item,)))
+        yield result
+
+
+def collect_dumps(path, ds_source, processes=None, time_chunk=8):
+    """
+    Collects maps dumped into per date pickle files by `dump_data` into one
+    HDF5 file out of core. Every dataset is preallocated at its final shape
+    (y, x, time) and filled in date order with slabs of `time_chunk` maps,
+    which match the chunks of the dataset. Several reader processes unpickle
+    the maps, this process is the only writer. At most a few slabs of maps
+    are in memory at any time.
+
+    :param path: str
+        Path of the HDF5 file to write.
+    :param ds_source: list
+        Tuples of the form (dataset name, list of pickle files) with the
+        names of the files containing their reference date.
+    :param processes: int
+        Number of reader processes. Defaults to the number of CPUs.
+    :param time_chunk: int
+        Number of maps per chunk and slab.
+    """
+    pool = mp.Pool(processes or mp.cpu_count())
+    hdf5 = h5py.File(path, 'w')
+    try:
+        data_grp = hdf5.create_group('maps')
+        for ds_name, files in ds_source:
+            files = sorted(files, key=_read_date)
+            if not files:
+                continue
+            shape = _read_dump(files[0])[1].shape
+            ds = data_grp.create_dataset(
+                ds_name, shape + (len(files),), dtype='f',
+                chunks=shape + (min(time_chunk, len(files)),),
+                compression='gzip', fillvalue=-9999)
+            slab = np.empty(shape + (time_chunk,), dtype='f4')
+            dates = []
+            maps = _iter_ordered(pool, _read_dump, files,
+                                 window=2 * time_chunk)
+            for idx, (date_str, data) in enumerate(maps):
+                slab[:, :, idx % time_chunk] = data
+                dates.append(date_str)
+                if idx % time_chunk == time_chunk - 1 or \
+                        idx == len(files) - 1:
+                    start = idx - idx % time_chunk
+                    ds[:, :, start:idx + 1] = slab[:, :, :idx + 1 - start]
+            ds.attrs['dates'] = np.array(dates)
+            LOG.info('Collected {0} maps into {1}'.format(len(files),
+                                                          ds_name))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        hdf5.close()
@@ -0,0 +1,459 @@
+"""
+Validation steps as pipelines of named stages.
+
+A stage is a function, whose parameter names are the names of the values it
+needs, and which provides one value, e.g.
+
+    def decode(chart_codes, eval_file, orig_data):
+        ...
+
+    Stage('decode', decode, provides='eval_data')
+
+A `Pipeline` binds the parameters of its stages to the values of the inputs
+and of the other stages and orders the stages by their dependencies once,
+when it is created. `run` then runs the stages for the inputs of a step:
+
+    step = Pipeline(stages, inputs=['ref_time', 'eval_file', 'orig_file'])
+    values = step.run(ref_time=ref_time, eval_file=eval_file,
+                      orig_file=orig_file)
+
+Every stage runs in a profiling span of its name, so the time of a run is
+reported per stage, i.e., fetch, unpack, read, reproject, decode, metrics and
+sink for the validation steps. Several stages may share a name, e.g. the
+downloads of the chart and of the product are both 'fetch'. Stages whose
+inputs are ready at the same time run concurrently in threads if the
+pipeline has more than one thread.
+
+With a cache, e.g. a `StageCache`, the results of cacheable stages are
+reused. Their keys are computed before anything runs: an input is keyed by
+its value and, with `input_keys`, e.g. by the checksum of the file it names,
+the result of a stage by the stage, its version, its code and the sources
+of the modules of this package it calls, the version of the pipeline and
+the keys of its arguments. So the keys of all results of a step are known
+from its inputs, e.g. the URLs of the file pair, and a run only runs the
+stages, whose results are needed by the stages without cached results. If
+only the metrics change, the decoded maps come from the cache and neither
+fetch nor any other stage before the metrics runs. Bump the version of the
+pipeline to invalidate all results, e.g. after updating a library.
+
+A failing stage raises a `StageError`, which names the stage and the step.
+"""
+import hashlib
+import logging
+import os
+import sys
+import traceback
+import types
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from funcsigs import signature, Parameter
+
+from trollvalidation import profiling
+
+LOG = logging.getLogger(__name__)
+
+# the stages of a validation step in the order they run
+STAGES = ['fetch', 'unpack', 'read', 'reproject', 'decode', 'metrics', 'sink']
+
+
+class StageError(Exception):
+    """
+    A stage of a pipeline failed.
+
+    :param stage: str
+        Name of the stage.
+    :param step: str
+        The inputs of the pipeline, which name the step, e.g. the file pair.
+    :param message: str
+        The original exception.
+    :param tb: str
+        The formatted traceback of the original exception, which is kept
+        when the error is sent from a worker to the parent process.
+    """
+    def __init__(self, stage, step, message, tb=''):
+        super(StageError, self).__init__(stage, step, message, tb)
+        self.stage = stage
+        self.step = step
+        self.message = message
+        self.traceback = tb
+
+    def __str__(self):
+        return 'Stage {0} of {1} failed: {2}'.format(self.stage, self.step,
+                                                     self.message)
+
+
+def _hash(*parts):
+    return hashlib.sha1('\0'.join(str(p) for p in parts)).hexdigest()
+
+
+def _code_hash(code):
+    # the same in all processes, unlike the repr of nested code objects
+    consts = [_code_hash(c) if hasattr(c, 'co_code') else repr(c)
+              for c in code.co_consts]
+    return _hash(code.co_code, code.co_names, *consts)
+
+
+# the directory of this package and the hashes of its source files by path
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_SOURCE_HASHES = {}
+
+
+def _source_hash(path):
+    if path not in _SOURCE_HASHES:
+        with open(path, 'rb') as fp:
+            _SOURCE_HASHES[path] = hashlib.sha1(fp.read()).hexdigest()
+    return _SOURCE_HASHES[path]
+
+
+def _names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            names.update(_names(const))
+    return names
+
+
+def _source_file(module):
+    # vars, as lazy modules import their module on attribute access
+    path = vars(module).get('__file__') if module is not None else None
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    if path.endswith(('.pyc', '.pyo')) and os.path.isfile(path[:-1]):
+        path = path[:-1]
+    return path if path.startswith(PACKAGE_DIR + os.sep) else None
+
+
+def package_sources(func):
+    """
+    :return: list
+        The source files of the modules of this package, other than the
+        module of `func`, which `func` uses directly or through other
+        modules of the package, sorted by path.
+    """
+    def module_of(obj):
+        if isinstance(obj, types.ModuleType):
+            return obj
+        if isinstance(obj, (types.FunctionType, types.ClassType, type)):
+            return sys.modules.get(obj.__module__)
+        return sys.modules.get(type(obj).__module__)
+
+    own = _source_file(sys.modules.get(func.__module__))
+    globals_ = getattr(func, '__globals__', {})
+    todo = [module_of(globals_.get(n)) for n in _names(func.__code__)]
+    sources = set()
+    seen = set()
+    while todo:
+        module = todo.pop()
+        path = _source_file(module)
+        if path is None or id(module) in seen:
+            continue
+        seen.add(id(module))
+        if path != own:
+            sources.add(path)
+        # modules of the package, which the module imports, but not the
+        # submodules of a package, which depend on what was imported so far
+        todo.extend(module_of(obj) for name, obj in vars(module).items()
+                    if not isinstance(obj, types.ModuleType) or
+                    not obj.__name__.startswith(module.__name__ + '.'))
+    return sorted(sources)
+
+
+def value_key(value):
+    """
+    :return: str
+        Key of an input value of a pipeline, i.e., of a string, number,
+        tuple or array, or None for other values, e.g. collectors of
+        temporary files.
+    """
+    if value is None or isinstance(value, (basestring, int, long, float,
+                                           tuple)):
+        return _hash(type(value).__name__, repr(value))
+    if isinstance(value, np.ndarray):
+        mask = np.ascontiguousarray(np.ma.getmaskarray(value)) \
+            if isinstance(value, np.ma.MaskedArray) else ''
+        data = np.ascontiguousarray(np.ma.getdata(value))
+        return _hash(data.dtype.str, data.shape,
+                     hashlib.sha1(data).hexdigest(),
+                     hashlib.sha1(mask).hexdigest())
+    return None
+
+
+class Stage(object):
+    """
+    :param name: str
+        Name of the stage, under which it is timed.
+    :param func: callable
+        The work of the stage. Parameters without default values are
+        required values, parameters with default values are only bound to
+        values of the pipeline if they exist.
+    :param provides: str
+        Name of the value returned by `func`. Defaults to the name of the
+        stage.
+    :param cacheable: bool
+        Whether the result only depends on the arguments, so that it can be
+        reused from the cache of a pipeline.
+    :param version: str
+        Version of the stage, which is part of the keys of its results and
+        of the results of all later stages. Bump it when code outside of
+        this package, which the stage calls, changes its results. Changes
+        of `func` itself and of the modules of its package, which it calls,
+        are detected.
+    """
+    def __init__(self, name, func, provides=None, cacheable=False,
+                 version=None):
+        super(Stage, self).__init__()
+        self.name = name
+        self.func = func
+        self.provides = provides or name
+        self.cacheable = cacheable
+        self.version = version
+        self._code_hash = None
+        parameters = signature(func).parameters.values()
+        self.required = [p.name for p in parameters
+                         if p.default is Parameter.empty and
+                         p.kind == Parameter.POSITIONAL_OR_KEYWORD]
+        self.optional = [p.name for p in parameters
+                         if p.default is not Parameter.empty]
+
+    @property
+    def code_hash(self):
+        # computed when the first key is, not when the stages are defined
+        code = getattr(self.func, '__code__', None)
+        if self._code_hash is None and code:
+            self._code_hash = _hash(_code_hash(code), *[
+                _source_hash(p) for p in package_sources(self.func)])
+        return self._code_hash
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return '<Stage {0} -> {1}>'.format(self.name, self.provides)
+
+
+def stage(name, provides=None, cacheable=False, version=None):
+    """
+    Decorator making a function a `Stage`, e.g.:
+
+        @stage('fetch', provides='local_eval_file')
+        def fetch_eval(eval_file):
+            ...
+    """
+    def decorate(func):
+        return Stage(name, func, provides, cacheable, version)
+
+    return decorate
+
+
+class Pipeline(object):
+    """
+    :param stages: list
+        The `Stage`s of the pipeline.
+    :param inputs: list
+        Names of the values passed to `run`.
+    :param threads: int
+        Number of threads running independent stages at the same time.
+    :param cache: object
+        Cache of the results of cacheable stages with the methods
+        `get(key)`, which returns a tuple (hit, value), and
+        `put(key, value)`, e.g. a `StageCache`.
+    :param cleanup: callable
+        Called with the values of a run after the run, also when a stage
+        failed, e.g. to remove temporary files.
+    :param side_inputs: list
+        Names of inputs, which do not change the results of the stages and
+        are left out of the keys, e.g. collectors of temporary files.
+    :param version: str
+        Version of the pipeline, which is part of all keys.
+    :param input_keys: callable
+        Called with the values of a run, it returns a dict of strings by
+        input name, which are part of the keys of these inputs, e.g. the
+        checksums of the files named by the inputs, so that results of
+        changed files are not reused. It is called again after stages,
+        which are not cacheable, ran, e.g. the downloads.
+
+    :raises: ValueError
+        If a value is provided twice or a required value is not provided.
+    """
+    def __init__(self, stages, inputs=(), threads=1, cache=None,
+                 cleanup=None, side_inputs=(), version=None,
+                 input_keys=None):
+        super(Pipeline, self).__init__()
+        self.inputs = list(inputs)
+        self.threads = threads
+        self.cache = cache
+        self.cleanup = cleanup
+        self.side_inputs = set(side_inputs)
+        self.version = version
+        self.input_keys = input_keys
+        self._pool = None
+        self._pool_pid = None
+
+        provided = self.inputs + [s.provides for s in stages]
+        duplicates = set(n for n in provided if provided.count(n) > 1)
+        if duplicates:
+            raise ValueError('Values provided more than once: {0}'.format(
+                ', '.join(sorted(duplicates))))
+
+        # the stages in levels, the stages of a level only need values of
+        # earlier levels, each with the names of its arguments
+        self.levels = []
+        available = set(self.inputs)
+        pending = list(stages)
+        while pending:
+            level = [s for s in pending if set(s.required) <= available]
+            if not level:
+                raise ValueError('No stage provides {0}, needed by {1}'.format(
+                    ', '.join(sorted(set(n for s in pending
+                                         for n in s.required) -
+                                     set(provided))) or 'a cycle',
+                    ', '.join(repr(s) for s in pending)))
+            self.levels.append([
+                (s, s.required + [n for n in s.optional if n in available])
+                for s in level])
+            available.update(s.provides for s in level)
+            pending = [s for s in pending if s not in level]
+
+        self.producers = dict((s.provides, (s, names))
+                              for level in self.levels for s, names in level)
+        # the stages, whose results no other stage needs, are always run
+        needed = set(n for _, names in self.producers.itervalues()
+                     for n in names)
+        self.terminals = [p for p in self.producers if p not in needed]
+
+    @property
+    def stages(self):
+        return [s for level in self.levels for s, _ in level]
+
+    def _describe(self, values):
+        # the inputs of a step, which are strings, e.g. the file pair
+        return ', '.join('{0}={1}'.format(name, values[name])
+                         for name in self.inputs
+                         if isinstance(values.get(name), basestring))
+
+    def _get_pool(self):
+        # a pool of the parent does not work in forked workers
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPool(self.threads)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def keys(self, values):
+        """
+        :param values: dict
+            The inputs of a run.
+
+        :return: dict
+            The keys of the inputs and of the results of all stages, which
+            only depend on keyed values.
+        """
+        keys = {}
+        extra = self.input_keys(values) if self.input_keys else {}
+        for name in self.inputs:
+            if name not in self.side_inputs:
+                key = value_key(values[name])
+                if key and extra.get(name):
+                    key = _hash(key, extra[name])
+                if key:
+                    keys[name] = key
+        for level in self.levels:
+            for s, names in level:
+                arg_keys = [keys.get(n) for n in names
+                            if n not in self.side_inputs]
+                if None not in arg_keys:
+                    keys[s.provides] = _hash(s.name, s.provides, s.version,
+                                             s.code_hash, self.version,
+                                             *arg_keys)
+        return keys
+
+    def _plan(self, values, keys):
+        # loads the cached results, which are needed, into the values and
+        # returns the names of the results, which have to be computed
+        todo = set()
+
+        def need(name):
+            if name in values or name in todo:
+                return
+            s, names = self.producers[name]
+            if s.cacheable and name in keys:
+                with profiling.span('cache'):
+                    hit, value = self.cache.get(keys[name])
+                profiling.count('cache_hits' if hit else 'cache_misses')
+                if hit:
+                    values[name] = value
+                    return
+            todo.add(name)
+            for n in names:
+                need(n)
+
+        for name in self.terminals:
+            need(name)
+        return todo
+
+    def _run_stage(self, values, keys, stage, names):
+        with profiling.span(stage.name):
+            try:
+                value = stage.func(**dict((n, values[n]) for n in names))
+            except Exception, e:
+                raise StageError(stage.name, self._describe(values), repr(e),
+                                 traceback.format_exc()), \
+                    None, sys.exc_info()[2]
+        if stage.cacheable and stage.provides in keys:
+            with profiling.span('cache'):
+                self.cache.put(keys[stage.provides], value)
+        return value
+
+    def _run_attached(self, step_stages, values, keys, stage_and_names):
+        # in a thread of the pool, record the spans into the running step
+        profiling.attach(step_stages)
+        try:
+            return self._run_stage(values, keys, *stage_and_names)
+        finally:
+            profiling.attach(None)
+
+    def run(self, **inputs):
+        """
+        Runs all stages for the given inputs.
+
+        :return: dict
+            The inputs and the values provided by the stages by name. With
+            a cache, results which are not needed are left out.
+
+        :raises: StageError
+            If a stage fails, the stages after it are not run.
+        """
+        missing = set(self.inputs) - set(inputs)
+        if missing:
+            raise TypeError('Missing inputs: {0}'.format(
+                ', '.join(sorted(missing))))
+        values = dict(inputs)
+        try:
+            if self.cache is not None:
+                keys = self.keys(values)
+                todo = self._plan(values, keys)
+            else:
+                keys, todo = {}, set(self.producers)
+            for level in self.levels:
+                level = [(s, names) for s, names in level
+                         if s.provides in todo]
+                if self.threads > 1 and len(level) > 1:
+                    results = self._get_pool().map(
+                        partial(self._run_attached, profiling.current_step(),
+                                values, keys), level)
+                else:
+                    results = [self._run_stage(values, keys, s, names)
+                               for s, names in level]
+                for (s, _), result in zip(level, results):
+                    values[s.provides] = result
+                if self.cache is not None and self.input_keys and \
+                        not all(s.cacheable for s, _ in level):
+                    # e.g. checksums recorded when the files were fetched,
+                    # the results are stored under the keys of later runs
+                    keys = self.keys(values)
+        finally:
+            if self.cleanup:
+                self.cleanup(values)
+        return values
@@ -0,0 +1,319 @@
+"""
+Lightweight profiling of the stages of the validation steps.
+
+Stages are marked with spans, e.g.:
+
+    with profiling.span('download'):
+        local_file = downloader.get(url, cfg.INPUT_DIR)
+
+A span records the wall time, the CPU time (including child processes like
+ogr2ogr) and the bytes read by the process. Spans are only recorded while a
+step runs, i.e., between `start_step` and `end_step`, which `timethis` calls
+around every validation step. Spans nest: a span inside of another one, e.g.
+the reading of a chart inside of the 'decode' stage of a pipeline, is
+recorded as 'decode/read', so that the outermost spans add up to the step.
+Every step also records the peak RSS of the process during the step and
+how much the RSS grew, unless it runs in a thread next to other steps, e.g.
+with the thread backend, as the RSS is the one of the whole process. The
+task runner hands the profile of each step back
+to the parent process, where `RunProfile` writes a report of the whole run.
+"""
+import csv
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+LOG = logging.getLogger(__name__)
+
+_local = threading.local()
+# spans of one step may be recorded by several threads, see `attach`
+_lock = threading.Lock()
+
+
+def _cpu_time():
+    user, system, children_user, children_system, _ = os.times()
+    return user + system + children_user + children_system
+
+
+def _bytes_read():
+    # characters read by this process, including reads served from the
+    # page cache, not available on all platforms
+    try:
+        with open('/proc/self/io') as fp:
+            for line in fp:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+
+def _status_mb(field):
+    # a field of /proc/self/status in MB, e.g. VmRSS, or None
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    # resets VmHWM to the current RSS, available since Linux 4.0
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def _sample_rss():
+    rss = _status_mb('VmRSS')
+    if rss is not None:
+        _local.peak_rss = max(getattr(_local, 'peak_rss', 0.), rss)
+    return rss
+
+
+def _peak_rss():
+    """
+    :return: float
+        The peak RSS in MB since the running step started, the maximum of the
+        RSS sampled at the ends of its spans where the peak cannot be reset,
+        or the peak of the process without /proc.
+    """
+    if getattr(_local, 'peak_reset', False):
+        peak = _status_mb('VmHWM')
+        if peak is not None:
+            return peak
+    if getattr(_local, 'peak_rss', None):
+        return _local.peak_rss
+    # ru_maxrss is given in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _step_profiles():
+    # profiles of the validation steps run in this thread by reference time,
+    # the task runner reports them back to the parent like the step timings
+    if not hasattr(_local, 'profiles'):
+        _local.profiles = {}
+    return _local.profiles
+
+
+def pop_step_profile(ref_time):
+    """
+    :return: dict
+        The profile of the last validation step of a reference time, which
+        ran in this thread, or None.
+    """
+    return _step_profiles().pop(ref_time, None)
+
+
+def _own_process():
+    # steps of the process backends run in the main thread of a worker,
+    # those of the thread backend share their process with other steps
+    return threading.current_thread().name == 'MainThread'
+
+
+def start_step():
+    _local.stages = {}
+    _local.counters = {}
+    _local.spans = []
+    _local.peak_rss = 0.
+    _local.own_process = _own_process()
+    if _local.own_process:
+        # the peak is reset for the whole process
+        _local.peak_reset = _reset_peak_rss()
+        _local.start_rss = _sample_rss()
+
+
+def count(name, n=1):
+    """
+    Counts events of the running step, e.g. cache hits. Outside of a step
+    nothing is counted.
+    """
+    counters = getattr(_local, 'counters', None)
+    if counters is not None:
+        counters[name] = counters.get(name, 0) + n
+
+
+def current_step():
+    """
+    :return: dict
+        The stages of the step running in this thread or None, which
+        `attach` hands over to other threads working on the same step.
+    """
+    return getattr(_local, 'stages', None)
+
+
+def attach(stages):
+    """
+    Records the spans of this thread into the stages of a step running in
+    another thread, as returned by `current_step`.
+    """
+    _local.stages = stages
+    _local.spans = []
+
+
+def end_step(ref_time):
+    """
+    Stores the profile of the step, which ran in this thread, see
+    `pop_step_profile`.
+    """
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        return
+    peak_rss = rss_growth = None
+    if _local.own_process:
+        rss, start_rss = _sample_rss(), _local.start_rss
+        peak_rss = _peak_rss()
+        if None not in (rss, start_rss):
+            rss_growth = rss - start_rss
+    _step_profiles()[ref_time] = {
+        'stages': stages, 'peak_rss_mb': peak_rss,
+        'rss_growth_mb': rss_growth,
+        'counters': getattr(_local, 'counters', {})}
+    _local.stages = None
+    _local.counters = None
+
+
+@contextmanager
+def span(name):
+    """
+    Records wall and CPU time and bytes read of a stage of the running
+    step. Spans of the same name in one step are summed up. Outside of a
+    step a span does nothing. A span inside of another span is recorded
+    under the names of both joined by '/', e.g. 'decode/read'.
+    """
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        yield
+        return
+    spans = getattr(_local, 'spans', None)
+    if spans is None:
+        # a thread attached to the step
+        spans = _local.spans = []
+    spans.append(name)
+    name = '/'.join(spans)
+    start = time.time(), _cpu_time(), _bytes_read()
+    try:
+        yield
+    finally:
+        spans.pop()
+        # CPU time and bytes read are counted per process, so they include
+        # the work of other threads running at the same time
+        wall, cpu = time.time() - start[0], _cpu_time() - start[1]
+        bytes_read = _bytes_read() - start[2]
+        _sample_rss()
+        with _lock:
+            stage = stages.setdefault(name, {'wall': 0., 'cpu': 0.,
+                                             'bytes_read': 0})
+            stage['wall'] += wall
+            stage['cpu'] += cpu
+            stage['bytes_read'] += bytes_read
+
+
+class RunProfile(object):
+    """
+    Collects the step profiles of a run and writes them as a JSON and a CSV
+    report.
+
+    :param directory: str
+        Directory of the reports. Without a directory nothing is written.
+    """
+    def __init__(self, directory=None):
+        super(RunProfile, self).__init__()
+        self.directory = directory
+        self.run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+        self.steps = []
+
+    def add(self, file_pair, worker, seconds, profile, error=None):
+        step = {'ref_time': file_pair[0], 'eval_file': file_pair[1],
+                'orig_file': file_pair[2], 'worker': str(worker),
+                'seconds': seconds, 'error': error}
+        step.update(profile or {'stages': {}, 'peak_rss_mb': None,
+                                'rss_growth_mb': None})
+        self.steps.append(step)
+
+    def totals(self):
+        """
+        :return: dict
+            Mapping of stage names to their summed wall and CPU times and
+            bytes read over all steps.
+        """
+        totals = {}
+        for step in self.steps:
+            for name, stage in step['stages'].iteritems():
+                total = totals.setdefault(name, {'wall': 0., 'cpu': 0.,
+                                                 'bytes_read': 0})
+                for key in total:
+                    total[key] += stage[key]
+        return totals
+
+    def counters(self):
+        """
+        :return: dict
+            Mapping of the names of the counters, see `count`, to their sum
+            over all steps.
+        """
+        counters = {}
+        for step in self.steps:
+            for name, n in step.get('counters', {}).iteritems():
+                counters[name] = counters.get(name, 0) + n
+        return counters
+
+    def report(self):
+        totals = self.totals()
+
+        def order(name):
+            # nested spans below their outer span, each level by wall time
+            parts = name.split('/')
+            return [(-totals.get('/'.join(parts[:i + 1]), {}).get('wall', 0.),
+                     parts[i]) for i in range(len(parts))]
+
+        lines = ['{0:<20} wall {1:10.1f}s  cpu {2:10.1f}s  read '
+                 '{3:10.1f}MB'.format(
+                     '  ' * name.count('/') + name.rsplit('/', 1)[-1],
+                     t['wall'], t['cpu'], t['bytes_read'] / 2. ** 20)
+                 for name, t in sorted(totals.iteritems(),
+                                       key=lambda t: order(t[0]))]
+        lines += ['{0:<20} {1}'.format(name, n)
+                  for name, n in sorted(self.counters().iteritems())]
+        return '\n'.join(lines)
+
+    def save(self):
+        """
+        :return: tuple
+            The paths of the JSON and the CSV report or None.
+        """
+        if not self.directory or not self.steps:
+            return None
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        base = os.path.join(self.directory, '{0}_profile'.format(self.run_id))
+
+        with open(base + '.json', 'w') as fp:
+            json.dump({'run_id': self.run_id, 'totals': self.totals(),
+                       'counters': self.counters(), 'steps': self.steps},
+                      fp, indent=1)
+
+        with open(base + '.csv', 'wb') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['ref_time', 'eval_file', 'worker', 'stage',
+                             'wall', 'cpu', 'bytes_read', 'peak_rss_mb',
+                             'rss_growth_mb'])
+            for step in self.steps:
+                for name, stage in sorted(step['stages'].iteritems()):
+                    writer.writerow([step['ref_time'], step['eval_file'],
+                                     step['worker'], name, stage['wall'],
+                                     stage['cpu'], stage['bytes_read'],
+                                     step['peak_rss_mb'],
+                                     step.get('rss_growth_mb')])
+        return base + '.json', base + '.csv'
@@ -0,0 +1,190 @@
+"""
+Typed, columnar store of validation results.
+
+The result rows of a run are kept as a table with datetime columns for the
+reference and run time and float columns for all metrics, in which metrics
+over empty sets are NaN instead of '--'. The tables are partitioned by
+hemisphere, product and year of the reference time:
+
+    RESULTS_DIR/hemisphere=NH/product=OSI450/year=1990/<run_id>.parquet
+
+Every run adds its own files, so runs never overwrite each other and are
+merged when loading, where the latest run of a reference time wins. The
+tables are written as Parquet files if pyarrow is installed and as pickled
+DataFrames otherwise, both load without parsing any text.
+"""
+import logging
+import os
+import pkgutil
+from datetime import datetime
+from glob import glob
+
+import numpy as np
+
+from trollvalidation.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+# looked up without importing pyarrow, pandas imports it when needed
+if pkgutil.find_loader('pyarrow'):
+    FORMAT, EXTENSION = 'parquet', '.parquet'
+else:
+    FORMAT, EXTENSION = 'pickle', '.pkl'
+
+LOG = logging.getLogger(__name__)
+
+TIME_COLUMNS = ['reference_time', 'run_time']
+
+
+def to_frame(rows, header):
+    """
+    Converts result rows as returned by the validation steps to a typed
+    DataFrame.
+
+    :param rows: list
+        Result rows, i.e. lists of the form [reference_time, run_time,
+        metric, ...]. Masked values become NaN.
+    :param header: list
+        Column names of the rows, e.g. `CSV_HEADER` of the configuration.
+
+    :return: pd.DataFrame
+    """
+    rows = [[np.nan if v is np.ma.masked or v == '--' else v for v in row]
+            for row in rows if row]
+    df = pd.DataFrame(rows, columns=header)
+    for column in header:
+        if column in TIME_COLUMNS:
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+        else:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df
+
+
+def read_csv_report(report, index_col=0):
+    """
+    Reads a CSV report as written by `write_to_csv` into a typed DataFrame,
+    e.g., to convert reports of earlier runs.
+
+    :param index_col: int
+        Column of the index, which is dropped, or None for CSV files without
+        an index, e.g. checkpoints.
+    """
+    df = pd.read_csv(report, na_values='--', keep_default_na=False)
+    if index_col is not None:
+        df = df.drop(df.columns[index_col], axis=1)
+    for column in df.columns:
+        if column in TIME_COLUMNS:
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+        else:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df
+
+
+class ResultsStore(object):
+    """
+    :param root: str
+        Directory of the partitioned tables.
+    """
+    def __init__(self, root):
+        super(ResultsStore, self).__init__()
+        self.root = root
+
+    def _partition(self, hemisphere, product, year):
+        return os.path.join(self.root, 'hemisphere={0}'.format(hemisphere),
+                            'product={0}'.format(product),
+                            'year={0}'.format(year))
+
+    def write(self, df, hemisphere, product, run_id=None):
+        """
+        Writes the results of a run, one file per year.
+
+        :param df: pd.DataFrame
+            Typed results as returned by `to_frame`.
+        :param run_id: str
+            Name of the run, which has to sort after the names of earlier
+            runs. Defaults to the current time.
+
+        :return: list
+            The paths of the written files.
+        """
+        run_id = run_id or datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        df = df.dropna(subset=['reference_time'])
+        paths = []
+        for year, part in df.groupby(df['reference_time'].dt.year):
+            directory = self._partition(hemisphere, product, year)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            path = os.path.join(directory, run_id + EXTENSION)
+            part = part.sort_values('reference_time').reset_index(drop=True)
+            if FORMAT == 'parquet':
+                part.to_parquet(path, index=False)
+            else:
+                part.to_pickle(path)
+            paths.append(path)
+        return paths
+
+    def load(self, hemisphere='*', product='*', years=None):
+        """
+        Loads and merges the results of all runs. If a reference time was
+        validated by several runs, the row of the latest run is kept.
+
+        :param hemisphere: str
+            'NH', 'SH' or '*' for both.
+        :param product: str
+            Product name or '*' for all products.
+        :param years: list
+            Years of the reference times to load. Defaults to all years.
+
+        :return: pd.DataFrame
+            The typed results with the columns hemisphere, product and
+            run_id added, sorted by hemisphere, product and reference time.
+            The columns hemisphere, product and run_id are categorical.
+        """
+        years = ['*'] if years is None else years
+        partitions = {}
+        for year in years:
+            pattern = os.path.join(self._partition(hemisphere, product, year),
+                                   '*' + EXTENSION)
+            for path in glob(pattern):
+                keys = tuple(k.split('=', 1)[1]
+                             for k in path.split(os.sep)[-4:-1])
+                partitions.setdefault(keys, []).append(path)
+        if not partitions:
+            return pd.DataFrame(columns=['hemisphere', 'product', 'run_id'])
+
+        # partitions and the rows within them are sorted by reference time,
+        # so that only runs of the same partition have to be merged
+        run_ids = sorted(set(os.path.splitext(os.path.basename(p))[0]
+                             for paths in partitions.values() for p in paths))
+        frames, keys, runs = [], [], []
+        for key in sorted(partitions, key=lambda k: (k[0], k[1], int(k[2]))):
+            parts = []
+            for path in sorted(partitions[key]):
+                part = self._read(path)
+                run_id = os.path.splitext(os.path.basename(path))[0]
+                part['run_id'] = run_ids.index(run_id)
+                parts.append(part)
+            if len(parts) > 1:
+                part = pd.concat(parts, ignore_index=True).drop_duplicates(
+                    'reference_time', keep='last').sort_values(
+                    'reference_time')
+            runs.append(part.pop('run_id').values)
+            frames.append(part)
+            keys.append(key)
+
+        df = pd.concat(frames, ignore_index=True)
+        lengths = [len(f) for f in frames]
+        for pos, column in enumerate(['hemisphere', 'product']):
+            categories = sorted(set(k[pos] for k in keys))
+            codes = [categories.index(k[pos]) for k in keys]
+            df[column] = pd.Categorical.from_codes(np.repeat(codes, lengths),
+                                                   categories)
+        df['run_id'] = pd.Categorical.from_codes(np.concatenate(runs),
+                                                 run_ids)
+        return df
+
+    @staticmethod
+    def _read(path):
+        if FORMAT == 'parquet':
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
@@ -0,0 +1,202 @@
+"""
+On-disk cache of the results of pipeline stages.
+
+The results of cacheable stages, e.g. the decoded maps of a step, are kept
+in files named by the key, which the pipeline computes from the stage, its
+code and the keys of its arguments, see `trollvalidation.pipeline`. Arrays
+and masked arrays are stored as `.npz` files, other values are pickled.
+
+The cache is shared by all workers. Files are written under a temporary
+name and renamed, so readers never see partial results. The least recently
+used results are evicted when the cache grows beyond its size limit, a hit
+marks a result as used by touching its file.
+"""
+import cPickle as pickle
+import logging
+import os
+import uuid
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+
+def _write_value(fp, value):
+    if isinstance(value, np.ma.MaskedArray):
+        arrays = {'data': np.ma.getdata(value)}
+        if value.mask is not np.ma.nomask:
+            arrays['mask'] = np.ma.getmaskarray(value)
+        np.savez(fp, masked=True, **arrays)
+    elif isinstance(value, np.ndarray):
+        np.savez(fp, masked=False, data=value)
+    else:
+        pickle.dump(value, fp, pickle.HIGHEST_PROTOCOL)
+
+
+def _read_value(path):
+    if path.endswith('.pkl'):
+        with open(path, 'rb') as fp:
+            return pickle.load(fp)
+    with np.load(path) as npz:
+        if not npz['masked']:
+            return npz['data']
+        mask = npz['mask'] if 'mask' in npz.files else np.ma.nomask
+        return np.ma.array(npz['data'], mask=mask)
+
+
+class StageCache(object):
+    """
+    :param directory: str
+        Directory of the cache. It is created on the first write.
+    :param max_bytes: int
+        Size limit of the cache. Without a limit nothing is evicted.
+    """
+    def __init__(self, directory, max_bytes=None):
+        super(StageCache, self).__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # bytes of the cache as last seen by this process, it is counted
+        # again before anything is evicted
+        self._size = None
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def _find(self, key):
+        for extension in ['.npz', '.pkl']:
+            path = self._path(key, extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def get(self, key):
+        """
+        :return: tuple
+            (True, value) if the result of the key is in the cache, (False,
+            None) otherwise.
+        """
+        path = self._find(key)
+        if path:
+            try:
+                value = _read_value(path)
+                os.utime(path, None)
+                self.hits += 1
+                return True, value
+            except (IOError, OSError, EOFError, ValueError,
+                    pickle.UnpicklingError), e:
+                # evicted by another worker meanwhile or broken
+                LOG.warning('Cannot read {0} from the cache: {1}'.format(
+                    key, e))
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        is_array = isinstance(value, np.ndarray)
+        path = self._path(key, '.npz' if is_array else '.pkl')
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # created by another worker in the meantime
+                pass
+        tmp_path = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as fp:
+                _write_value(fp, value)
+            os.rename(tmp_path, path)
+        except (IOError, OSError, pickle.PicklingError), e:
+            LOG.warning('Cannot cache {0}: {1}'.format(key, e))
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.stores += 1
+        if self.max_bytes:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for sub_dir in os.listdir(self.directory):
+            sub_dir = os.path.join(self.directory, sub_dir)
+            if not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(sub_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        """
+        :return: int
+            Bytes of all results in the cache.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes=None):
+        """
+        Removes the least recently used results, until the cache is below
+        90% of its size limit, to leave room for a few more results.
+        """
+        max_bytes = max_bytes or self.max_bytes
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        target = 0.9 * max_bytes
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # evicted by another worker in the meantime
+                pass
+            size -= entry_size
+            self.evictions += 1
+        self._size = size
+        LOG.info('Evicted results from the stage cache, {0:.1f}MB left'.format(
+            size / 2. ** 20))
+
+    def clear(self):
+        for _, _, path in self._entries():
+            os.remove(path)
+        self._size = 0
+
+    def stats(self):
+        """
+        :return: dict
+            The hits, misses, stores and evictions of this process and the
+            hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'stores': self.stores, 'evictions': self.evictions,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.}
+
+
+def open_cache(cfg):
+    """
+    Opens the stage cache configured by `STAGE_CACHE_DIR` and
+    `STAGE_CACHE_SIZE` in a validation configuration.
+
+    :return: StageCache | None
+        None if the configuration does not use a stage cache.
+    """
+    directory = getattr(cfg, 'STAGE_CACHE_DIR', None)
+    if not directory:
+        return None
+    return StageCache(directory, getattr(cfg, 'STAGE_CACHE_SIZE', None))
@@ -0,0 +1,326 @@
+"""
+Execution of the validation steps of a validation task.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from trollvalidation.executors import LocalPoolExecutor
+from trollvalidation.profiling import RunProfile, pop_step_profile
+from trollvalidation.validation_decorators import pop_step_timing
+from trollvalidation.validations import configuration as cfg
+
+LOG = logging.getLogger(__name__)
+
+# Rough wall times in seconds of a step per kind of evaluation file, used
+# until there are timings of earlier runs. Shapefiles are reprojected and
+# rasterized with ogr2ogr and gdal_rasterize, SIGRID files go through the
+# slow text parser and the binary charts are cheap to read.
+DEFAULT_STEP_COSTS = {
+    '.zip': 60.,
+    '.sig': 30.,
+    '.bin': 5.,
+}
+
+
+class ProgressMeter(object):
+    """
+    Logs the progress, throughput and expected remaining time of a task.
+
+    :param total: int
+        Number of steps of the task.
+    :param every: float
+        Minimum number of seconds between two progress messages.
+    """
+    def __init__(self, total, every=10.):
+        super(ProgressMeter, self).__init__()
+        self.total = total
+        self.every = every
+        self.done = 0
+        self.failed = 0
+        self.start = self.last = time.time()
+
+    def update(self, success=True):
+        self.done += 1
+        if not success:
+            self.failed += 1
+        now = time.time()
+        if now - self.last >= self.every or self.done == self.total:
+            self.last = now
+            LOG.info(self.report())
+
+    def rate(self):
+        elapsed = time.time() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.
+
+    def report(self):
+        rate = self.rate()
+        eta = (self.total - self.done) / rate if rate else 0
+        return '{0}/{1} steps done ({2} failed), {3:.2f} steps/s, ' \
+               'ETA {4}'.format(self.done, self.total, self.failed, rate,
+                                timedelta(seconds=int(eta)))
+
+
+class CostModel(object):
+    """
+    Estimates the cost of a validation step from the kind of its evaluation
+    file and the mean step timings (as measured by `timethis`) of earlier
+    runs, which are kept in a JSON file.
+
+    :param path: str
+        Path to the JSON file with the timing history. Without a path the
+        history is only kept in memory.
+    """
+    def __init__(self, path=None):
+        super(CostModel, self).__init__()
+        self.path = path
+        self.history = {}
+        if path and os.path.isfile(path):
+            with open(path) as fp:
+                self.history = json.load(fp)
+
+    @staticmethod
+    def kind(file_pair):
+        return os.path.splitext(file_pair[1])[1]
+
+    def estimate(self, file_pair):
+        kind = self.kind(file_pair)
+        if kind in self.history:
+            return self.history[kind][1]
+        return DEFAULT_STEP_COSTS.get(kind, 10.)
+
+    def update(self, file_pair, seconds):
+        kind = self.kind(file_pair)
+        count, mean = self.history.get(kind, (0, 0.))
+        self.history[kind] = (count + 1, mean + (seconds - mean) / (count + 1))
+
+    def save(self):
+        if self.path:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(self.path, 'w') as fp:
+                json.dump(self.history, fp)
+
+    def schedule(self, file_pairs):
+        """
+        :return: list
+            The file pairs ordered by decreasing expected cost, so that the
+            expensive steps do not pile up at the end of a task.
+        """
+        return sorted(file_pairs, key=self.estimate, reverse=True)
+
+
+class Utilization(object):
+    """
+    Accumulates the busy time of each worker process of a task.
+    """
+    def __init__(self):
+        super(Utilization, self).__init__()
+        self.start = time.time()
+        self.busy = {}
+
+    def add(self, worker, seconds):
+        self.busy[worker] = self.busy.get(worker, 0.) + seconds
+
+    def report(self):
+        wall_time = time.time() - self.start
+        lines = ['Worker {0}: busy {1:.1f}s of {2:.1f}s ({3:.0f}%)'.format(
+            w, b, wall_time, 100. * b / wall_time if wall_time else 0.)
+            for w, b in sorted(self.busy.items())]
+        return '\n'.join(lines)
+
+
+def _timed_step(step_and_pair):
+    # runs in the worker, reports who ran the step, how long it took, where
+    # the time went and why it failed
+    step_func, file_pair = step_and_pair
+    start_time = time.time()
+    result, error = None, None
+    try:
+        result = step_func(file_pair)
+    except Exception, e:
+        # a failed step must not stop the other steps of the worker, the
+        # error is reported by the parent
+        error = '{0}\n{1}'.format(e, getattr(e, 'traceback', None) or
+                                  traceback.format_exc())
+    seconds = pop_step_timing(file_pair[0], time.time() - start_time)
+    profile = pop_step_profile(file_pair[0])
+    worker = os.getpid()
+    if threading.current_thread().name != 'MainThread':
+        worker = '{0}/{1}'.format(worker, threading.current_thread().name)
+    return result, tuple(file_pair), worker, seconds, profile, error
+
+
+def _skip_checkpointed(file_pairs, checkpoint):
+    done = checkpoint.ref_times() if checkpoint else set()
+    todo = [p for p in file_pairs if p[0] not in done]
+    if done:
+        LOG.info('Resuming from {0}, {1} of {2} steps left'.format(
+            checkpoint.path, len(todo), len(file_pairs)))
+    return todo
+
+
+def _imap_results(step_func, file_pairs, processes=None, executor=None):
+    cost_model = CostModel(getattr(cfg, 'TIMINGS_FILE', None))
+    utilization = Utilization()
+    run_profile = RunProfile(getattr(cfg, 'PROFILE_DIR', None))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = LocalPoolExecutor(processes)
+    try:
+        # dispatch the most expensive steps first, results arrive in the
+        # order in which the steps finish
+        tasks = [(step_func, p) for p in cost_model.schedule(file_pairs)]
+        for result, file_pair, worker, seconds, profile, error in \
+                executor.imap_unordered(_timed_step, tasks):
+            if result:
+                cost_model.update(file_pair, seconds)
+            if error:
+                LOG.error('Validation for {0} failed on worker {1}: '
+                          '{2}'.format(file_pair[0], worker, error))
+            utilization.add(worker, seconds)
+            run_profile.add(file_pair, worker, seconds, profile, error)
+            yield file_pair, result
+        if own_executor:
+            executor.close()
+    except BaseException:
+        if own_executor:
+            executor.terminate()
+        raise
+    finally:
+        cost_model.save()
+        LOG.info('Worker utilization:\n{0}'.format(utilization.report()))
+        LOG.info('Time per stage:\n{0}'.format(run_profile.report()))
+        paths = run_profile.save()
+        if paths:
+            LOG.info('Profile of the run in {0}'.format(', '.join(paths)))
+
+
+def _queue_tasks(tasks, checkpoints):
+    # the steps of all tasks in one queue and which task each step is from
+    todo, owner = [], {}
+    for name, file_pairs in tasks.iteritems():
+        for file_pair in _skip_checkpointed(file_pairs, checkpoints.get(name)):
+            owner[tuple(file_pair)] = name
+            todo.append(file_pair)
+    return todo, owner
+
+
+def run_tasks(step_func, tasks, processes=None, checkpoints=None,
+              executor=None):
+    """
+    Runs the validation steps of several tasks, e.g. of both hemispheres,
+    interleaved in one queue of a pool of processes.
+
+    :param step_func: callable
+        A module level function taking a tuple of the form
+        (ref_time, eval_file, orig_file), e.g. `val_step_star`.
+    :param tasks: OrderedDict
+        Mapping of task names to time series as returned by a time series
+        generator.
+    :param processes: int
+        Number of worker processes, if no executor is given. Defaults to
+        the number of CPUs.
+    :param checkpoints: dict
+        Mapping of task names to `ResultsCheckpoint`s. Every result row is
+        committed to the checkpoint of its task as soon as its step finished
+        and steps whose reference time is already in the checkpoint are
+        skipped.
+    :param executor: Executor
+        An executor shared with other tasks, see `executors`. Otherwise a
+        local pool is created and closed again for these tasks.
+
+    :return: dict
+        Mapping of task names to the result row of each file pair in the
+        order of the time series. Rows of skipped steps are the ones read
+        from the checkpoints.
+    """
+    checkpoints = checkpoints or {}
+    done = {}
+    for name, checkpoint in checkpoints.iteritems():
+        if checkpoint:
+            for row in checkpoint.iter_rows():
+                done[(name, row[0])] = row
+    todo, owner = _queue_tasks(tasks, checkpoints)
+
+    progress = ProgressMeter(len(todo))
+    for file_pair, result in _imap_results(step_func, todo, processes,
+                                           executor):
+        progress.update(bool(result))
+        if result:
+            name = owner[file_pair]
+            done[(name, file_pair[0])] = result
+            if checkpoints.get(name):
+                checkpoints[name].append(result)
+
+    return dict((name, [done.get((name, p[0])) for p in file_pairs])
+                for name, file_pairs in tasks.iteritems())
+
+
+def run_steps(step_func, file_pairs, processes=None, checkpoint=None,
+              executor=None):
+    """
+    Runs a validation step for every file pair, see `run_tasks`.
+
+    :return: list
+        The result row of each file pair in the order of `file_pairs`.
+    """
+    return run_tasks(step_func, {None: file_pairs}, processes,
+                     {None: checkpoint}, executor)[None]
+
+
+def stream_tasks(step_func, tasks, sinks, processes=None, checkpoints=None,
+                 executor=None):
+    """
+    Runs the validation steps of several tasks interleaved in one queue and
+    hands each result row to the sinks of its task as soon as it arrives.
+    In contrast to `run_tasks` no results are kept, so the memory of the
+    parent process stays flat regardless of the length of the time series.
+
+    :param sinks: dict
+        Mapping of task names to lists of objects with an `append(row)`
+        method, e.g. `CSVResultSink`.
+    :param checkpoints: dict
+        Mapping of task names to `ResultsCheckpoint`s. Steps already in a
+        checkpoint are skipped and their rows are copied to the sinks first.
+
+    :return: ProgressMeter
+        Counts of done and failed steps and the throughput of the tasks.
+    """
+    checkpoints = checkpoints or {}
+    for name, checkpoint in checkpoints.iteritems():
+        if checkpoint:
+            ref_times = set(p[0] for p in tasks[name])
+            for row in checkpoint.iter_rows():
+                if row[0] in ref_times:
+                    for sink in sinks[name]:
+                        sink.append(row)
+    todo, owner = _queue_tasks(tasks, checkpoints)
+
+    progress = ProgressMeter(len(todo))
+    for file_pair, result in _imap_results(step_func, todo, processes,
+                                           executor):
+        progress.update(bool(result))
+        if result:
+            name = owner[file_pair]
+            if checkpoints.get(name):
+                checkpoints[name].append(result)
+            for sink in sinks[name]:
+                sink.append(result)
+
+    return progress
+
+
+def stream_steps(step_func, file_pairs, sinks, processes=None,
+                 checkpoint=None, executor=None):
+    """
+    Streams the results of a validation step for every file pair to the
+    given list of sinks, see `stream_tasks`.
+    """
+    return stream_tasks(step_func, {None: file_pairs}, {None: sinks},
+                        processes, {None: checkpoint}, executor)
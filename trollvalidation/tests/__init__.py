@@ -0,0 +1,24 @@
+"""
+Tests of trollvalidation, run with
+
+    python -m unittest discover -s trollvalidation/tests -t .
+
+from the root of the repository.
+"""
+import os
+import sys
+
+# the validation modules import some modules relative to the package
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PACKAGE_DIR not in sys.path:
+    sys.path.append(PACKAGE_DIR)
+
+
+def override_settings(test_case, **settings):
+    """
+    Replaces settings of the configuration until the end of a test.
+    """
+    from trollvalidation.validations import configuration as cfg
+    for name, value in settings.iteritems():
+        setattr(cfg, name, value)
+        test_case.addCleanup(delattr, cfg, name)
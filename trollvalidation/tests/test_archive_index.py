@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from trollvalidation.data_collectors import archive_index
+from trollvalidation.data_collectors.archive_index import ArchiveIndex
+
+
+class TestArchiveIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index = ArchiveIndex(os.path.join(self.tmp_dir, 'index.db'),
+                                  code_version='1')
+        self.pairs = {'nh': [('2015-01-01', 'chart_1', 'product_1'),
+                             ('2015-01-02', 'chart_2', 'product_2')]}
+        self.index.register_pairs(self.pairs)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _local_file(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
+
+    def _validate_all(self, complete=True):
+        rows = [[d, 1.0] for d, _, _ in self.pairs['nh']]
+        self.index.record_results('nh', self.pairs['nh'], rows, complete)
+
+    def test_registered_pairs_are_pending(self):
+        self.assertEqual(self.index.pending('nh'),
+                         set(['2015-01-01', '2015-01-02']))
+        self.assertEqual(self.index.pending('sh'), set())
+
+    def test_validated_pairs_are_not_pending(self):
+        self._validate_all()
+        self.assertEqual(self.index.pending('nh'), set())
+
+    def test_changed_pair_is_pending_again(self):
+        self._validate_all()
+        self.index.register_pairs(
+            {'nh': [('2015-01-01', 'chart_1', 'product_1b'),
+                    ('2015-01-02', 'chart_2', 'product_2')]})
+        self.assertEqual(self.index.pending('nh'), set(['2015-01-01']))
+
+    def test_other_code_version_is_pending(self):
+        self._validate_all()
+        index = ArchiveIndex(self.index.path, code_version='2')
+        try:
+            self.assertEqual(index.pending('nh'),
+                             set(['2015-01-01', '2015-01-02']))
+        finally:
+            index.close()
+
+    def test_failed_steps_stay_pending(self):
+        self.index.record_results('nh', self.pairs['nh'],
+                                  [['2015-01-01', 1.0], None])
+        self.assertEqual(self.index.pending('nh'), set(['2015-01-02']))
+
+    def test_changed_file_is_pending_again(self):
+        self.index.register_timeseries('chart', {'nh': {
+            '2015-01-01': 'chart_1', '2015-01-02': 'chart_2'}})
+        self.index.record_file('chart_1', self._local_file('a', 'old'))
+        self._validate_all()
+
+        # the same content again keeps the pairs validated
+        self.index.record_file('chart_1', self._local_file('b', 'old'))
+        self.assertEqual(self.index.pending('nh'), set())
+
+        self.index.record_file('chart_1', self._local_file('c', 'new'))
+        self.assertEqual(self.index.pending('nh'), set(['2015-01-01']))
+        self.assertEqual(self.index.checksums(['chart_1', 'chart_2']),
+                         {'chart_1': archive_index.file_checksum(
+                             os.path.join(self.tmp_dir, 'c'))})
+
+    def test_partial_results_stay_pending(self):
+        self._validate_all(complete=False)
+        self.assertEqual(self.index.pending('nh'),
+                         set(['2015-01-01', '2015-01-02']))
+        self.assertEqual(len(self.index.results('nh')), 2)
+
+    def test_results_of_dates(self):
+        self._validate_all()
+        self.assertEqual(self.index.results('nh', ['2015-01-02']),
+                         [['2015-01-02', 1.0]])
+        self.assertEqual(self.index.results('nh', []), [])
+        self.assertEqual(self.index.results('sh'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+from trollvalidation import area_masks
+
+
+class TestAreaMasks(unittest.TestCase):
+
+    def setUp(self):
+        area_masks._VALID_CELLS.clear()
+        # land (1) in the first row, a lake (2) in the last
+        self.status_flag = np.zeros((3, 4), dtype=np.int8)
+        self.status_flag[0] = 1
+        self.status_flag[2, 3] = 2 | 8
+
+    def tearDown(self):
+        area_masks._VALID_CELLS.clear()
+
+    def product(self, status_flag):
+        return np.ma.array(np.ones(status_flag.shape),
+                           mask=status_flag & (area_masks.STATIC_FLAGS | 8))
+
+    def test_valid_cells(self):
+        mask = area_masks.static_mask(self.status_flag)
+        self.assertEqual(area_masks.valid_cells('grid', mask), None)
+        area_masks.update('grid', mask)
+        np.testing.assert_array_equal(
+            area_masks.valid_cells('grid', self.product(self.status_flag)),
+            [4, 5, 6, 7, 8, 9, 10])
+        self.assertEqual(area_masks.valid_cells('other', mask), None)
+
+    def test_product_with_other_flags(self):
+        area_masks.update('grid', area_masks.static_mask(self.status_flag))
+        status_flag = self.status_flag.copy()
+        status_flag[0, 0] = 0
+        # the known cells miss a valid cell of the product
+        product = self.product(status_flag)
+        self.assertEqual(area_masks.valid_cells('grid', product), None)
+
+        # until they are derived from its flags
+        area_masks.update('grid', area_masks.static_mask(status_flag))
+        np.testing.assert_array_equal(
+            area_masks.valid_cells('grid', product)[:2], [0, 4])
+
+    def test_compress(self):
+        eval_data = np.ma.array(np.arange(12.).reshape(3, 4),
+                                mask=np.arange(12).reshape(3, 4) == 5)
+        orig_data = self.product(self.status_flag)
+        area_masks.update('grid', area_masks.static_mask(self.status_flag))
+        cells = area_masks.valid_cells('grid', orig_data)
+        for cells in [None, cells]:
+            eval_values, orig_values = area_masks.compress(eval_data,
+                                                           orig_data, cells)
+            np.testing.assert_array_equal(eval_values, [4, 6, 7, 8, 9, 10])
+            self.assertEqual(len(orig_values), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
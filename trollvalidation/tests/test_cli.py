@@ -0,0 +1,48 @@
+import unittest
+from collections import OrderedDict
+
+from trollvalidation import cli
+from trollvalidation.task_runner import CostModel
+
+
+def _pairs(*rows):
+    return [(ref_time, 'ftp://host/chart' + ext, 'ftp://host/product.nc')
+            for ref_time, ext in rows]
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tasks = OrderedDict([
+            ('nh', _pairs(('2015-01-01', '.bin'), ('2015-01-02', '.sig'),
+                          ('2015-01-03', '.zip'))),
+            ('sh', _pairs(('2015-01-02', '.bin'))),
+        ])
+
+    def _dates(self, tasks):
+        return OrderedDict((hemis, [p[0] for p in file_pairs])
+                           for hemis, file_pairs in tasks.iteritems())
+
+    def test_select_pairs(self):
+        self.assertEqual(self.tasks, cli.select_pairs(self.tasks))
+        selected = cli.select_pairs(self.tasks, start='2015-01-02',
+                                    end='2015-01-02')
+        self.assertEqual(self._dates(selected),
+                         {'nh': ['2015-01-02'], 'sh': ['2015-01-02']})
+        selected = cli.select_pairs(self.tasks, charts=['.bin', '.zip'])
+        self.assertEqual(self._dates(selected),
+                         {'nh': ['2015-01-01', '2015-01-03'],
+                          'sh': ['2015-01-02']})
+
+    def test_expected_time(self):
+        model = CostModel()
+        file_pairs = [p for pairs in self.tasks.itervalues() for p in pairs]
+        costs = sorted(model.estimate(p) for p in file_pairs)
+        self.assertEqual(cli.expected_time(file_pairs, 1, model),
+                         sum(costs))
+        self.assertEqual(cli.expected_time(file_pairs, 4, model), costs[-1])
+
+    def test_human_size(self):
+        self.assertEqual(cli._human_size(999), '999.0 B')
+        self.assertEqual(cli._human_size(1.5e6), '1.5 MB')
+        self.assertEqual(cli._human_size(2e12), '2.0 TB')
@@ -0,0 +1,65 @@
+import unittest
+from collections import OrderedDict
+
+import numpy as np
+
+from trollvalidation.data_collectors import colocation
+
+
+def _dates(*days):
+    return colocation.to_datetime64(['2015-01-{0:02d}'.format(d)
+                                     for d in days])
+
+
+class TestColocate(unittest.TestCase):
+
+    def test_equal_dates(self):
+        chart_idx, product_idx, offset, weight = colocation.colocate(
+            _dates(1, 2, 5), _dates(5, 1, 3))
+        np.testing.assert_array_equal(chart_idx, [0, 2])
+        np.testing.assert_array_equal(product_idx, [1, 0])
+        np.testing.assert_array_equal(offset, [0, 0])
+        np.testing.assert_array_equal(weight, [1, 1])
+
+    def test_nearest(self):
+        # the earlier of two equally near products wins
+        chart_idx, product_idx, offset, _ = colocation.colocate(
+            _dates(2, 4, 10), _dates(1, 3, 6), window=1)
+        np.testing.assert_array_equal(chart_idx, [0, 1])
+        np.testing.assert_array_equal(product_idx, [0, 1])
+        np.testing.assert_array_equal(offset, [-1, -1])
+
+    def test_all(self):
+        chart_idx, product_idx, offset, weight = colocation.colocate(
+            _dates(2), _dates(3, 1, 2, 5), window=1, mode='all')
+        np.testing.assert_array_equal(chart_idx, [0, 0, 0])
+        np.testing.assert_array_equal(product_idx, [1, 2, 0])
+        np.testing.assert_array_equal(offset, [-1, 0, 1])
+        np.testing.assert_allclose(weight, [0.25, 0.5, 0.25])
+
+    def test_empty(self):
+        chart_idx, product_idx, _, _ = colocation.colocate(_dates(1),
+                                                           _dates())
+        self.assertEqual(len(chart_idx), 0)
+        self.assertEqual(len(product_idx), 0)
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, colocation.colocate, _dates(1),
+                          _dates(1), mode='first')
+
+    def test_pair_timeseries(self):
+        charts = {'nh': OrderedDict([('2015-01-01', 'c1'),
+                                     ('2015-01-04', 'c4')])}
+        products = {'nh': OrderedDict([('2015-01-02', 'p2'),
+                                       ('2015-01-03', 'p3')])}
+        self.assertEqual(
+            colocation.pair_timeseries(charts, products, window=1),
+            {'nh': [('2015-01-01', 'c1', 'p2'), ('2015-01-04', 'c4', 'p3')]})
+        self.assertEqual(
+            colocation.pair_timeseries(charts, products, window=2,
+                                       mode='all'),
+            {'nh': [('2015-01-02', 'c1', 'p2'), ('2015-01-03', 'c4', 'p3')]})
+
+
+if __name__ == '__main__':
+    unittest.main()
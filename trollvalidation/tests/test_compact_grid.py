@@ -0,0 +1,123 @@
+import unittest
+
+import numpy as np
+
+from trollvalidation import area_masks
+from trollvalidation import data_preparation as prep
+from trollvalidation.compact_grid import CompactGrid, nbytes, shrink
+from trollvalidation.validations import ice_conc_450_validation as val
+
+
+class TestCompactGrid(unittest.TestCase):
+
+    def assert_masked_equal(self, actual, expected):
+        np.testing.assert_array_equal(np.ma.getmaskarray(actual),
+                                      np.ma.getmaskarray(expected))
+        np.testing.assert_array_equal(actual.compressed(),
+                                      expected.compressed())
+        self.assertEqual(actual.dtype, expected.dtype)
+
+    def test_few_cells(self):
+        data = np.ma.masked_all((100, 100), dtype=np.float32)
+        data[3, 4] = 12.5
+        data[50, 60] = 100
+        grid = CompactGrid.from_masked(data)
+        self.assertTrue(grid._index is not None)
+        np.testing.assert_array_equal(grid.index, [304, 5060])
+        self.assert_masked_equal(grid.to_masked(), data)
+
+    def test_many_cells(self):
+        data = np.ma.array(np.arange(10000, dtype=np.float64) % 201 / 2.,
+                           mask=np.arange(10000) % 3 == 0).reshape(100, 100)
+        grid = CompactGrid.from_masked(data)
+        self.assertTrue(grid._bits is not None)
+        self.assertEqual(grid.values.dtype, np.uint8)
+        self.assert_masked_equal(grid.to_masked(), data)
+        self.assertTrue(nbytes(grid) < nbytes(data))
+
+    def test_values_out_of_range(self):
+        data = np.ma.array([[0., 99.5], [255., -1.]])
+        self.assert_masked_equal(CompactGrid.from_masked(data).to_masked(),
+                                 data)
+
+    def test_values_off_steps(self):
+        for dtype in [np.float32, np.float64]:
+            # few values off the half-percent steps are kept apart
+            data = np.ma.array(np.arange(100) / 2., dtype=dtype)
+            data[[3, 50]] = [10.1, np.nan]
+            grid = CompactGrid.from_masked(data)
+            self.assertEqual(grid.values.dtype, np.uint8)
+            np.testing.assert_array_equal(grid.data(), data)
+            self.assertEqual(grid.data().dtype, dtype)
+
+            # and all values if most are off the steps
+            data = np.ma.array(np.arange(100) / 3., dtype=dtype)
+            grid = CompactGrid.from_masked(data)
+            self.assertEqual(grid.values.dtype, dtype)
+            np.testing.assert_array_equal(grid.data(), data)
+
+    def test_integers(self):
+        for values in [[0, 255], [-1, 1000]]:
+            data = np.ma.array(values, mask=[False, False], dtype=np.int32)
+            self.assert_masked_equal(CompactGrid.from_masked(data).to_masked(),
+                                     data)
+
+    def test_cells(self):
+        data = np.ma.array([1., 2., 3., 4.], mask=[False, False, True, False])
+        grid = CompactGrid.from_masked(data, cells=np.array([1, 2, 3]))
+        np.testing.assert_array_equal(grid.index, [1, 3])
+
+    def test_take(self):
+        data = np.ma.array([1., 2., 3., 4.], mask=[False, True, False, False])
+        product = np.ma.array([5., 6., 7., 8.], mask=[False, False, True,
+                                                      False])
+        chart, orig = CompactGrid.from_masked(data).take(product)
+        np.testing.assert_array_equal(chart, [1., 4.])
+        np.testing.assert_array_equal(orig, [5., 8.])
+
+    def test_not_larger_than_map(self):
+        for value in [50., 50.1, 1000.]:
+            data = np.ma.array(np.full((10, 10), value), mask=False)
+            grid = shrink(CompactGrid.from_masked(data))
+            self.assertTrue(isinstance(grid, CompactGrid))
+            self.assertTrue(nbytes(grid) < nbytes(data))
+
+
+class TestCompactMetrics(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        shape = (60, 80)
+        # product concentrations off the half-percent steps, so that the
+        # interval cells of the charts take values, which are not on them
+        self.orig_data = np.ma.array(rng.uniform(0, 100, shape),
+                                     mask=rng.uniform(size=shape) < .1)
+        # SIGRID codes with intervals, e.g. 13 for 10-30%, and concentrations
+        # in 5% steps, of which 5 and 95 are intervals
+        self.codes = {}
+        for kind, codes in [('.sig', [1, 10, 13, 24, 35, 57, 79, 81, 91, 92]),
+                            ('.bin', [0, 5, 20, 50, 95, 100])]:
+            codes = rng.choice(codes, shape)
+            # masked as land in the charts
+            land = rng.uniform(size=shape) < .2
+            codes[land] = 254
+            self.codes[kind] = np.ma.array(codes, mask=land)
+
+    def metrics(self, eval_data):
+        if isinstance(eval_data, CompactGrid):
+            vectors = eval_data.take(self.orig_data)
+        else:
+            vectors = area_masks.compress(eval_data, self.orig_data)
+        return [func(*vectors) for func in val.METRICS.values()]
+
+    def test_metrics_equal_dense(self):
+        for kind, codes in self.codes.items():
+            dense = prep.decode_chart(codes.copy(), self.orig_data, kind)
+            compact = prep.decode_compact_chart(codes.copy(), self.orig_data,
+                                                kind)
+            self.assertTrue(isinstance(compact, CompactGrid))
+            self.assertEqual(self.metrics(compact), self.metrics(dense))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from trollvalidation.validations import configuration as cfg
+
+SETTINGS = """
+OUTPUT_DIR = {0!r}
+MAX_POINTS = 500
+lower_case = 1
+"""
+
+
+class TestConfiguration(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmp_dir, 'output')
+        settings_file = os.path.join(self.tmp_dir, 'test_settings.py')
+        with open(settings_file, 'w') as fp:
+            fp.write(SETTINGS.format(self.output_dir))
+        self._set_env('CONFIG', settings_file)
+        module = types.ModuleType('test_configuration')
+        module.__file__ = cfg.__file__
+        self.cfg = type(cfg)(module)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _set_env(self, name, value):
+        name = 'TROLLVALIDATION_' + name
+        if name in os.environ:
+            self.addCleanup(os.environ.__setitem__, name, os.environ[name])
+        else:
+            self.addCleanup(os.environ.pop, name, None)
+        os.environ[name] = value
+
+    def test_lazy(self):
+        self.assertIsNone(self.cfg._settings)
+        self.assertEqual(self.cfg.MAX_POINTS, 500)
+        self.assertIsNotNone(self.cfg._settings)
+        self.assertRaises(AttributeError, getattr, self.cfg, 'lower_case')
+        self.assertRaises(AttributeError, getattr, self.cfg, 'MISSING')
+
+    def test_directories(self):
+        self.assertFalse(os.path.exists(self.output_dir))
+        self.assertEqual(self.cfg.OUTPUT_DIR, self.output_dir)
+        self.assertTrue(os.path.isdir(self.output_dir))
+
+    def test_env(self):
+        self._set_env('MAX_POINTS', '1000')
+        self._set_env('EXECUTOR', '{"backend": "thread"}')
+        self._set_env('NAME', 'not json')
+        self.assertEqual(self.cfg.MAX_POINTS, 1000)
+        self.assertEqual(self.cfg.EXECUTOR, {'backend': 'thread'})
+        self.assertEqual(self.cfg.NAME, 'not json')
+        self.assertIn('NAME', dir(self.cfg))
+        self.assertIn('OUTPUT_DIR', dir(self.cfg))
+
+    def test_override(self):
+        self.cfg.MAX_POINTS = 10
+        self.assertEqual(self.cfg.MAX_POINTS, 10)
+        del self.cfg.MAX_POINTS
+        self.assertEqual(self.cfg.MAX_POINTS, 500)
+
+    def test_check_tools(self):
+        self.cfg.check_tools('python')
+        self.assertRaises(Exception, self.cfg.check_tools,
+                          'no-such-tool-installed')
@@ -0,0 +1,111 @@
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from trollvalidation import executors
+
+
+def square(x):
+    if x < 0:
+        raise ValueError('negative')
+    return x * x
+
+
+def _die_once(item):
+    # the first worker running a step of the flag file gets lost
+    flag_file, x = item
+    if not os.path.exists(flag_file):
+        open(flag_file, 'w').close()
+        os._exit(1)
+    return x
+
+
+def _no_warm_up():
+    pass
+
+
+def _lose_step(address, authkey):
+    # a worker which takes a step and dies before it reports its start
+    manager = executors._QueueManager(address=address, authkey=authkey)
+    manager.connect()
+    manager.get_tasks().get()
+    os._exit(1)
+
+
+class TestExecutors(unittest.TestCase):
+
+    def test_pools(self):
+        for cls in [executors.LocalPoolExecutor, executors.ThreadPoolExecutor]:
+            with cls(2, initializer=_no_warm_up) as executor:
+                self.assertEqual(
+                    sorted(executor.imap_unordered(square, range(5))),
+                    [0, 1, 4, 9, 16])
+
+    def test_authkey_required_for_other_hosts(self):
+        self.assertRaises(ValueError, executors.DistributedExecutor,
+                          address=('', 0))
+
+
+class TestDistributedExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = executors.DistributedExecutor(task_timeout=1.)
+        self.workers = []
+
+    def tearDown(self):
+        self.executor.workers = self.workers
+        self.executor.terminate()
+
+    def worker(self, target=executors.run_worker, start=True):
+        args = (self.executor.address, self.executor.authkey)
+        if target is executors.run_worker:
+            args += (_no_warm_up,)
+        worker = mp.Process(target=target, args=args)
+        self.workers.append(worker)
+        if start:
+            worker.start()
+        return worker
+
+    def test_results(self):
+        self.worker()
+        self.worker()
+        self.assertEqual(
+            sorted(self.executor.imap_unordered(square, range(10))),
+            [x * x for x in range(10)])
+
+    def test_error(self):
+        self.worker()
+        results = self.executor.imap_unordered(square, [-1])
+        self.assertRaises(ValueError, list, results)
+
+    def test_step_lost_after_start(self):
+        self.worker()
+        self.worker()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            flag_file = os.path.join(tmp_dir, 'flag')
+            self.assertEqual(
+                sorted(self.executor.imap_unordered(
+                    _die_once, [(flag_file, x) for x in range(3)])),
+                [0, 1, 2])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_step_lost_before_start(self):
+        lossy = self.worker(_lose_step)
+        # the other worker connects when the first step is lost
+        worker = self.worker(start=False)
+        thread = threading.Thread(target=lambda: (lossy.join(),
+                                                  worker.start()))
+        thread.start()
+        self.assertEqual(
+            sorted(self.executor.imap_unordered(square, range(3))),
+            [0, 1, 4])
+        thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from trollvalidation import generate_plots
+from trollvalidation.generate_plots import PlotManifest
+
+
+def _days(n):
+    start = datetime.datetime(2015, 1, 1)
+    return [start + datetime.timedelta(days=i) for i in range(n)]
+
+
+class TestDecimation(unittest.TestCase):
+
+    def test_choose_frequency(self):
+        self.assertIsNone(generate_plots.choose_frequency(_days(10), 10))
+        self.assertEqual(generate_plots.choose_frequency(_days(100), 20),
+                         'W')
+        self.assertEqual(generate_plots.choose_frequency(_days(400), 20),
+                         'M')
+        self.assertEqual(generate_plots.choose_frequency(_days(4000), 2),
+                         'A')
+
+    def test_aggregate(self):
+        dates = _days(14)
+        values = [np.arange(14.), np.ones(14)]
+        values[0][1] = np.nan
+        bin_dates, means, minima, maxima = generate_plots.aggregate(
+            dates, values, 'W')
+        # 2015-01-01 is a Thursday, the bins start on Sundays
+        self.assertEqual([d.day for d in bin_dates], [28, 4, 11])
+        np.testing.assert_allclose(means[0], [1, 6, 11.5])
+        np.testing.assert_allclose(minima[0], [0, 3, 10])
+        np.testing.assert_allclose(maxima[0], [2, 9, 13])
+        np.testing.assert_allclose(means[1], [1, 1, 1])
+
+    def test_lttb(self):
+        x = np.arange(100.)
+        y = np.zeros(100)
+        y[37], y[80] = 5., -5.
+        keep = generate_plots.lttb(x, y, 10)
+        self.assertEqual(len(keep), 10)
+        self.assertEqual((keep[0], keep[-1]), (0, 99))
+        self.assertTrue((np.diff(keep) > 0).all())
+        self.assertIn(37, keep)
+        self.assertIn(80, keep)
+
+    def test_lttb_missing_values(self):
+        y = np.array([1., np.nan, 2., np.nan])
+        self.assertEqual(generate_plots.lttb(np.arange(4.), y, 3).tolist(),
+                         [0, 2])
+        y = np.arange(50.)
+        y[0] = y[10] = np.nan
+        keep = generate_plots.lttb(np.arange(50.), y, 5)
+        self.assertEqual(len(keep), 5)
+        self.assertEqual((keep[0], keep[-1]), (1, 49))
+        self.assertNotIn(10, keep)
+
+
+class TestPlotManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, generate_plots.MANIFEST)
+        self.plot = os.path.join(self.tmp_dir, 'report_bias.png')
+        open(self.plot, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_is_current(self):
+        manifest = PlotManifest(self.path)
+        self.assertFalse(manifest.is_current('report:all', 'a', [self.plot]))
+        manifest.update('report:all', 'a')
+        self.assertTrue(manifest.is_current('report:all', 'a', [self.plot]))
+        self.assertFalse(manifest.is_current('report:all', 'b', [self.plot]))
+        self.assertFalse(manifest.is_current('report:2015', 'a',
+                                             [self.plot]))
+
+    def test_missing_plot(self):
+        manifest = PlotManifest(self.path)
+        manifest.update('report:all', 'a')
+        missing = os.path.join(self.tmp_dir, 'report_match.png')
+        self.assertFalse(manifest.is_current('report:all', 'a',
+                                             [self.plot, missing]))
+
+    def test_save(self):
+        manifest = PlotManifest(self.path)
+        manifest.update('report:all', 'a')
+        self.assertFalse(os.path.exists(self.path))
+        manifest.save()
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        manifest = PlotManifest(self.path)
+        self.assertTrue(manifest.is_current('report:all', 'a', [self.plot]))
@@ -0,0 +1,39 @@
+import sys
+import unittest
+
+from trollvalidation.lazy import LazyModule, lazy_import
+
+
+class TestLazyImport(unittest.TestCase):
+
+    def setUp(self):
+        # a small module of the standard library, which may be imported
+        # already, e.g. by matplotlib
+        colorsys = sys.modules.pop('colorsys', None)
+        if colorsys is not None:
+            self.addCleanup(sys.modules.__setitem__, 'colorsys', colorsys)
+        else:
+            self.addCleanup(sys.modules.pop, 'colorsys', None)
+
+    def test_imported_on_first_use(self):
+        colorsys = lazy_import('colorsys')
+        self.assertIsInstance(colorsys, LazyModule)
+        self.assertNotIn('colorsys', sys.modules)
+        self.assertIn('not imported', repr(colorsys))
+        self.assertEqual(colorsys.rgb_to_hsv(1., 0., 0.), (0., 1., 1.))
+        self.assertIn('colorsys', sys.modules)
+        self.assertIn('rgb_to_hsv', dir(colorsys))
+
+    def test_imported_module(self):
+        self.assertIs(lazy_import('sys'), sys)
+
+    def test_on_import(self):
+        imported = []
+        json = lazy_import('json', submodules=['json.tool'],
+                           on_import=imported.append)
+        self.assertEqual(imported, [])
+        self.assertEqual(json.dumps(1), '1')
+        self.assertEqual([m.__name__ for m in imported], ['json'])
+        self.assertIn('json.tool', sys.modules)
+        json.loads('1')
+        self.assertEqual(len(imported), 1)
@@ -0,0 +1,68 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from trollvalidation.map_arena import MapArena
+
+
+class TestMapArena(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.arena = MapArena(self.tmp_dir, (2, 2), '2015-01-01', 10)
+        self.eval_data = np.ma.array([[10., 20.], [30., 40.]],
+                                     mask=[[False, False], [False, True]])
+        self.orig_data = np.ma.array([[12., 20.], [26., 40.]])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read(self):
+        self.arena.write('2015-01-03', self.eval_data, self.orig_data)
+        self.assertEqual(self.arena.dates(), ['2015-01-03'])
+        eval_data, orig_data = self.arena.read('2015-01-03')
+        np.testing.assert_array_equal(eval_data.mask, self.eval_data.mask)
+        np.testing.assert_array_equal(orig_data, self.orig_data)
+        self.assertRaises(IndexError, self.arena.read, '2015-01-11')
+
+    def test_statistics(self):
+        self.arena.write('2015-01-01', self.eval_data, self.orig_data)
+        self.arena.write('2015-01-02', self.eval_data, self.orig_data + 2)
+        bias, stddev, count = self.arena.statistics()
+        np.testing.assert_array_equal(count, [[2, 2], [2, 0]])
+        np.testing.assert_allclose(bias.filled(np.nan),
+                                   [[3., 1.], [-3., np.nan]])
+        np.testing.assert_allclose(stddev.filled(np.nan),
+                                   [[1., 1.], [1., np.nan]])
+
+    def test_write_date_twice(self):
+        self.arena.write('2015-01-01', self.eval_data, self.orig_data)
+        expected = [a.copy() for a in self.arena.statistics()]
+        self.arena.write('2015-01-01', self.eval_data, self.orig_data)
+        for actual, wanted in zip(self.arena.statistics(), expected):
+            np.testing.assert_array_equal(np.ma.getmaskarray(actual),
+                                          np.ma.getmaskarray(wanted))
+            np.testing.assert_allclose(np.ma.filled(actual, 0),
+                                       np.ma.filled(wanted, 0))
+
+    def test_rewrite_replaces_contribution(self):
+        self.arena.write('2015-01-01', self.eval_data, self.orig_data)
+        self.arena.write('2015-01-01', self.eval_data, self.orig_data + 1)
+        bias, _, count = self.arena.statistics()
+        np.testing.assert_array_equal(count, [[1, 1], [1, 0]])
+        np.testing.assert_allclose(bias.compressed(), [3., 1., -3.])
+
+    def test_reopen(self):
+        self.arena.write('2015-01-01', self.eval_data, self.orig_data)
+        arena = MapArena.open(self.tmp_dir)
+        arena.write('2015-01-01', self.eval_data, self.orig_data)
+        np.testing.assert_array_equal(arena.statistics()[2],
+                                      [[1, 1], [1, 0]])
+        self.assertRaises(ValueError, MapArena, self.tmp_dir, (3, 3),
+                          '2015-01-01', 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
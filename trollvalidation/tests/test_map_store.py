@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from trollvalidation.map_store import MapStore, collect_dumps
+
+
+class TestMapStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = MapStore(os.path.join(self.tmp_dir, 'maps', 'maps.h5'))
+        self.orig_data = np.ma.array([[10., 20.], [30., 40.]],
+                                     mask=[[False, True], [False, False]])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_append(self):
+        self.assertEqual(self.store.index('NH'), {})
+        self.store.append('NH', '2015-01-02', self.orig_data + 1,
+                          self.orig_data)
+        self.store.append('NH', '2015-01-01', self.orig_data + 2,
+                          self.orig_data)
+        self.assertEqual(self.store.index('NH'),
+                         {'2015-01-02': 0, '2015-01-01': 1})
+        self.assertEqual(self.store.index('SH'), {})
+
+        eval_data, orig_data = self.store.read('NH', '2015-01-01')
+        np.testing.assert_array_equal(eval_data.mask, self.orig_data.mask)
+        np.testing.assert_array_equal(eval_data.compressed(), [12, 32, 42])
+        np.testing.assert_array_equal(orig_data.compressed(), [10, 30, 40])
+
+    def test_overwrite(self):
+        # a step, which ran again, replaces its maps
+        self.store.append('NH', '2015-01-01', self.orig_data, self.orig_data)
+        self.store.append('NH', '2015-01-02', self.orig_data, self.orig_data)
+        self.store.append('NH', '2015-01-01', self.orig_data + 5,
+                          self.orig_data)
+        self.assertEqual(len(self.store.index('NH')), 2)
+        eval_data, _ = self.store.read('NH', '2015-01-01')
+        np.testing.assert_array_equal(eval_data.compressed(), [15, 35, 45])
+
+    def test_iter_maps(self):
+        for day in [3, 1, 2]:
+            self.store.append('SH', '2015-01-0{0}'.format(day),
+                              self.orig_data + day, self.orig_data)
+        maps = list(self.store.iter_maps('SH'))
+        self.assertEqual([m[0] for m in maps],
+                         ['2015-01-01', '2015-01-02', '2015-01-03'])
+        np.testing.assert_array_equal(maps[2][1].compressed(), [13, 33, 43])
+        self.assertEqual(list(self.store.iter_maps('NH')), [])
+
+
+class TestCollectDumps(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def dump(self, date_str, data):
+        directory = os.path.join(self.tmp_dir, date_str)
+        os.makedirs(directory)
+        path = os.path.join(directory, '{0}_NH_orig_data.pkl'.format(
+            date_str))
+        data.dump(path)
+        return path
+
+    def test_collect(self):
+        # more maps than fit into a slab, dumped in another order
+        mask = np.zeros((2, 3), dtype=bool)
+        mask[1, 0] = True
+        files = [self.dump('2015-01-0{0}'.format(day),
+                           np.ma.array(np.full((2, 3), 10. * day), mask=mask))
+                 for day in [3, 1, 2]]
+        files.append(self.dump('2015-01-04',
+                               np.ma.array(np.full((2, 3), 255.))))
+        path = os.path.join(self.tmp_dir, 'maps.h5')
+        collect_dumps(path, [('data/NH/satellite', files),
+                             ('data/SH/satellite', [])],
+                      processes=2, time_chunk=3)
+
+        with h5py.File(path, 'r') as hdf5:
+            self.assertNotIn('data/SH/satellite', hdf5['maps'])
+            ds = hdf5['maps/data/NH/satellite']
+            self.assertEqual(ds.shape, (2, 3, 4))
+            self.assertEqual(list(ds.attrs['dates']),
+                             ['2015-01-01', '2015-01-02', '2015-01-03',
+                              '2015-01-04'])
+            np.testing.assert_array_equal(ds[0, 0, :3], [10, 20, 30])
+            # masked cells and values out of [0, 100] are filled
+            np.testing.assert_array_equal(ds[1, 0, :3], [-9999] * 3)
+            np.testing.assert_array_equal(ds[:, :, 3], np.full((2, 3), -9999))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urllib
+import urllib2
+
+from trollvalidation.data_collectors import mirror
+from trollvalidation.tests import override_settings
+from trollvalidation.validations import configuration as cfg
+
+HOST = 'example.org'
+
+
+def _touch(path):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'w').close()
+
+
+class TestMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'mirror')
+        _touch(os.path.join(self.root, HOST, 'data', '2015', 'a.nc'))
+        _touch(os.path.join(self.root, HOST, 'data', '2016', 'b.nc'))
+        # out of the mirror
+        _touch(os.path.join(self.tmp_dir, 'secret.nc'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resolve(self):
+        remote_file = 'ftp://{0}/data/2015/a b.nc'.format(HOST)
+        override_settings(self, MIRROR_DIR=None, MIRROR_URL=None)
+        self.assertEqual(mirror.resolve(remote_file), remote_file)
+        cfg.MIRROR_DIR = self.root
+        self.assertEqual(mirror.resolve(remote_file), os.path.join(
+            self.root, HOST, 'data', '2015', 'a b.nc'))
+        # the server takes precedence over the directory
+        cfg.MIRROR_URL = 'http://localhost:8000/'
+        self.assertEqual(mirror.resolve(remote_file),
+                         'http://localhost:8000/{0}/data/2015/a%20b.nc'.format(
+                             HOST))
+
+    def test_local_glob(self):
+        self.assertEqual(mirror.local_glob(self.root, HOST, 'data/*/*.nc'),
+                         ['data/2015/a.nc', 'data/2016/b.nc'])
+        self.assertEqual(mirror.local_glob(self.root, HOST, 'data/*'), [])
+
+
+class TestMirrorServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'mirror')
+        _touch(os.path.join(self.root, HOST, 'data', 'a.nc'))
+        with open(os.path.join(self.tmp_dir, 'secret.nc'), 'w') as fp:
+            fp.write('secret')
+        self.server = mirror.serve(self.root)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _glob(self, host, pattern):
+        query = urllib.urlencode({'host': host, 'pattern': pattern})
+        return urllib2.urlopen('{0}{1}?{2}'.format(
+            self.server.url, mirror.GLOB_PATH, query))
+
+    def assertRejected(self, host, pattern):
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self._glob(host, pattern)
+        self.assertEqual(context.exception.code, 400)
+
+    def test_listens_on_localhost(self):
+        self.assertEqual(self.server.server_address[0], '127.0.0.1')
+
+    def test_glob(self):
+        self.assertEqual(json.load(self._glob(HOST, 'data/*.nc')),
+                         ['data/a.nc'])
+
+    def test_glob_outside_root(self):
+        self.assertRejected('..', '*.nc')
+        self.assertRejected(HOST, '../../*.nc')
+        self.assertRejected(HOST, os.path.join(self.tmp_dir, '*.nc'))
+        self.assertRejected(self.tmp_dir, '*.nc')
+        self.assertRejected('', '*.nc')
+        self.assertRejected(HOST, '')
+
+    def test_get_outside_root(self):
+        url = '{0}/{1}/data/a.nc'.format(self.server.url, HOST)
+        self.assertEqual(urllib2.urlopen(url).read(), '')
+        with self.assertRaises(urllib2.HTTPError) as context:
+            urllib2.urlopen(self.server.url + '/../secret.nc')
+        self.assertEqual(context.exception.code, 404)
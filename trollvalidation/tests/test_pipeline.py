@@ -0,0 +1,92 @@
+import shutil
+import tempfile
+import unittest
+
+from trollvalidation.pipeline import Pipeline, Stage, StageError
+from trollvalidation.stage_cache import StageCache
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _stages(self):
+        calls = self.calls
+
+        def read(path):
+            calls.append('read')
+            return len(path)
+
+        def double(size):
+            calls.append('double')
+            return 2 * size
+
+        def total(size, doubled, offset=0):
+            calls.append('total')
+            return size + doubled + offset
+
+        # given in reverse order of their dependencies
+        return [Stage('total', total, cacheable=True),
+                Stage('double', double, provides='doubled', cacheable=True),
+                Stage('read', read, provides='size', cacheable=True)]
+
+    def test_topological_order(self):
+        pipeline = Pipeline(self._stages(), inputs=['path'])
+        self.assertEqual([s.name for s in pipeline.stages],
+                         ['read', 'double', 'total'])
+        values = pipeline.run(path='abc')
+        self.assertEqual(self.calls, ['read', 'double', 'total'])
+        self.assertEqual(values['total'], 9)
+
+    def test_optional_arguments(self):
+        pipeline = Pipeline(self._stages(), inputs=['path', 'offset'])
+        self.assertEqual(pipeline.run(path='abc', offset=1)['total'], 10)
+
+    def test_missing_value(self):
+        self.assertRaises(ValueError, Pipeline, self._stages()[:2],
+                          inputs=['path'])
+
+    def test_stage_error(self):
+        def fail(path):
+            raise IOError('no such file')
+
+        pipeline = Pipeline([Stage('read', fail)], inputs=['path'])
+        self.assertRaises(StageError, pipeline.run, path='abc')
+
+    def test_cached_results(self):
+        cache = StageCache(self.tmp_dir)
+        pipeline = Pipeline(self._stages(), inputs=['path'], cache=cache)
+        self.assertEqual(pipeline.run(path='abc')['total'], 9)
+        self.assertEqual(len(self.calls), 3)
+
+        # the final result is reused, the others are not needed
+        self.assertEqual(pipeline.run(path='abc')['total'], 9)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(cache.hits, 1)
+
+        self.assertEqual(pipeline.run(path='abcd')['total'], 12)
+        self.assertEqual(len(self.calls), 6)
+
+    def test_input_keys(self):
+        checksums = {'abc': '1'}
+        cache = StageCache(self.tmp_dir)
+        pipeline = Pipeline(
+            self._stages(), inputs=['path'], cache=cache,
+            input_keys=lambda v: {'path': checksums[v['path']]})
+        pipeline.run(path='abc')
+        pipeline.run(path='abc')
+        self.assertEqual(len(self.calls), 3)
+
+        # a changed file is not taken from the cache
+        checksums['abc'] = '2'
+        pipeline.run(path='abc')
+        self.assertEqual(len(self.calls), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import threading
+import unittest
+
+from trollvalidation import profiling
+
+
+def _run_step(ref_time):
+    profiling.start_step()
+    with profiling.span('decode'):
+        with profiling.span('read'):
+            pass
+    profiling.count('cache_hits')
+    profiling.end_step(ref_time)
+    return profiling.pop_step_profile(ref_time)
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_nested_spans(self):
+        profile = _run_step('2015-01-01')
+        self.assertEqual(sorted(profile['stages']), ['decode', 'decode/read'])
+        self.assertEqual(profile['counters'], {'cache_hits': 1})
+        self.assertEqual(profiling.pop_step_profile('2015-01-01'), None)
+
+    def test_no_span_outside_of_step(self):
+        with profiling.span('decode'):
+            pass
+        self.assertEqual(profiling.current_step(), None)
+
+    @unittest.skipUnless(os.path.exists('/proc/self/status'), 'needs /proc')
+    def test_rss_of_step(self):
+        profile = _run_step('2015-01-01')
+        self.assertTrue(profile['peak_rss_mb'] > 0)
+        self.assertTrue(profile['rss_growth_mb'] is not None)
+
+    def test_no_rss_of_steps_in_threads(self):
+        # the RSS is the one of the process, which other steps share
+        profiles = []
+        thread = threading.Thread(
+            target=lambda: profiles.append(_run_step('2015-01-01')))
+        thread.start()
+        thread.join()
+        self.assertEqual(profiles[0]['peak_rss_mb'], None)
+        self.assertEqual(profiles[0]['rss_growth_mb'], None)
+        self.assertEqual(sorted(profiles[0]['stages']),
+                         ['decode', 'decode/read'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from trollvalidation import results_store
+from trollvalidation.results_store import ResultsStore
+
+HEADER = ['reference_time', 'run_time', 'ice_bias']
+
+
+def _frame(*rows):
+    return results_store.to_frame(
+        [[ref_time, '2016-01-01 00:00:00', bias] for ref_time, bias in rows],
+        HEADER)
+
+
+class TestResultsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = ResultsStore(self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_to_frame(self):
+        df = _frame(('2015-01-01', 1.5), ('2015-01-02', np.ma.masked),
+                    ('2015-01-03', '--'))
+        self.assertEqual(str(df['reference_time'].dtype), 'datetime64[ns]')
+        self.assertEqual(df['ice_bias'].isnull().tolist(),
+                         [False, True, True])
+
+    def test_partitions(self):
+        df = _frame(('2014-12-31', 1.), ('2015-01-01', 2.))
+        paths = self.store.write(df, 'NH', 'OSI450', run_id='run1')
+        self.assertEqual(len(paths), 2)
+        self.assertIn('year=2014', paths[0])
+
+        df = self.store.load(years=[2015])
+        self.assertEqual(df['ice_bias'].tolist(), [2.])
+        self.assertEqual(len(self.store.load('SH')), 0)
+
+    def test_latest_run_wins(self):
+        self.store.write(_frame(('2015-01-01', 1.), ('2015-01-02', 2.)),
+                         'NH', 'OSI450', run_id='run1')
+        self.store.write(_frame(('2015-01-02', 20.), ('2015-01-03', 30.)),
+                         'NH', 'OSI450', run_id='run2')
+        self.store.write(_frame(('2015-01-01', 5.)), 'SH', 'OSI450',
+                         run_id='run1')
+
+        df = self.store.load()
+        self.assertEqual(df['hemisphere'].tolist(), ['NH'] * 3 + ['SH'])
+        self.assertEqual(df['ice_bias'].tolist(), [1., 20., 30., 5.])
+        self.assertEqual(df['run_id'].tolist(),
+                         ['run1', 'run2', 'run2', 'run1'])
+        self.assertEqual(
+            df['reference_time'].dt.strftime('%Y-%m-%d').tolist(),
+            ['2015-01-01', '2015-01-02', '2015-01-03', '2015-01-01'])
+
+
+if __name__ == '__main__':
+    unittest.main()
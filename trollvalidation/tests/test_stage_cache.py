@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from trollvalidation.stage_cache import StageCache
+
+
+class TestStageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        cache = StageCache(self.tmp_dir)
+        data = np.ma.array([1., 2., 3.], mask=[False, True, False])
+        cache.put('aa01', data)
+        cache.put('aa02', {'a': 1})
+        hit, value = cache.get('aa01')
+        self.assertTrue(hit)
+        np.testing.assert_array_equal(value.mask, data.mask)
+        np.testing.assert_array_equal(value.compressed(), data.compressed())
+        self.assertEqual(cache.get('aa02'), (True, {'a': 1}))
+        self.assertEqual(cache.get('aa03'), (False, None))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = StageCache(self.tmp_dir)
+        for n, key in enumerate(['aa01', 'aa02', 'aa03']):
+            cache.put(key, 'x' * 1000)
+            # the resolution of the modification times is coarse
+            os.utime(cache._find(key), (n, n))
+        cache.get('aa01')
+
+        cache.evict(max_bytes=cache.size() - 1)
+        self.assertEqual(cache.evictions, 1)
+        self.assertTrue(cache.get('aa01')[0])
+        self.assertFalse(cache.get('aa02')[0])
+        self.assertTrue(cache.get('aa03')[0])
+
+    def test_size_limit(self):
+        cache = StageCache(self.tmp_dir, max_bytes=2500)
+        for key in ['aa01', 'aa02', 'aa03']:
+            cache.put(key, 'x' * 1000)
+        self.assertTrue(cache.size() <= 0.9 * 2500)
+        self.assertTrue(cache.get('aa03')[0])
+
+    def test_clear(self):
+        cache = StageCache(self.tmp_dir)
+        cache.put('aa01', 1)
+        cache.clear()
+        self.assertEqual(cache.size(), 0)
+        self.assertFalse(cache.get('aa01')[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from trollvalidation import task_runner
+from trollvalidation.executors import ThreadPoolExecutor
+from trollvalidation.tests import override_settings
+from trollvalidation.validation_utils import ResultsCheckpoint
+
+# reference times of the steps, which ran, and of those, which fail
+_CALLS = []
+_FAILING = set()
+_LOCK = threading.Lock()
+
+
+def _step(file_pair):
+    with _LOCK:
+        _CALLS.append(file_pair[0])
+    if file_pair[0] in _FAILING:
+        raise IOError('cannot read {0}'.format(file_pair[2]))
+    return [file_pair[0], 1.5]
+
+
+def _no_warm_up():
+    pass
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        override_settings(self, OUTPUT_DIR=self.tmp_dir,
+                          CSV_HEADER=['reference_time', 'bias'],
+                          TIMINGS_FILE=None, PROFILE_DIR=None)
+        self.executor = ThreadPoolExecutor(2, initializer=_no_warm_up)
+        self.file_pairs = [('2015-01-0{0}'.format(d), 'chart.bin',
+                            'product.nc') for d in range(1, 5)]
+        del _CALLS[:]
+        _FAILING.clear()
+
+    def tearDown(self):
+        self.executor.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_steps(self, resume=True):
+        return task_runner.run_steps(_step, self.file_pairs,
+                                     checkpoint=ResultsCheckpoint('nh',
+                                                                  resume),
+                                     executor=self.executor)
+
+    def test_resume(self):
+        _FAILING.add('2015-01-03')
+        results = self.run_steps()
+        self.assertEqual(results[2], None)
+        self.assertEqual(sorted(_CALLS), [p[0] for p in self.file_pairs])
+
+        # only the failed step runs again, the other rows are read back
+        del _CALLS[:]
+        _FAILING.clear()
+        results = self.run_steps()
+        self.assertEqual(_CALLS, ['2015-01-03'])
+        self.assertEqual(results, [['2015-01-01', '1.5'],
+                                   ['2015-01-02', '1.5'],
+                                   ['2015-01-03', 1.5],
+                                   ['2015-01-04', '1.5']])
+
+    def test_no_resume(self):
+        self.run_steps()
+        del _CALLS[:]
+        self.run_steps(resume=False)
+        self.assertEqual(len(_CALLS), 4)
+        self.assertEqual(len(ResultsCheckpoint('nh').rows()), 4)
+
+    def test_row_cut_off(self):
+        checkpoint = ResultsCheckpoint('nh')
+        checkpoint.append(['2015-01-01', 1.5])
+        # a crash while writing the second row
+        with open(checkpoint.path, 'ab') as fp:
+            fp.write('2015-01-02\r\n')
+        self.assertEqual(checkpoint.ref_times(), set(['2015-01-01']))
+        self.run_steps()
+        self.assertEqual(sorted(_CALLS), ['2015-01-02', '2015-01-03',
+                                          '2015-01-04'])
+
+    def test_stream_skips_checkpointed(self):
+        ResultsCheckpoint('nh').append(['2015-01-02', 2.5])
+        rows = []
+        progress = task_runner.stream_steps(
+            _step, self.file_pairs, [rows], checkpoint=ResultsCheckpoint('nh'),
+            executor=self.executor)
+        self.assertEqual(progress.done, 3)
+        # the checkpointed rows first, then the others as they arrive
+        self.assertEqual(rows[0], ['2015-01-02', '2.5'])
+        self.assertEqual(sorted(r[0] for r in rows),
+                         [p[0] for p in self.file_pairs])
+        self.assertTrue(os.path.isfile(ResultsCheckpoint('nh').path))
+
+
+class TestCostModel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_pairs = [('2015-01-01', 'a.bin', 'p.nc'),
+                           ('2015-01-02', 'b.zip', 'p.nc'),
+                           ('2015-01-03', 'c.sig', 'p.nc')]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_default_costs(self):
+        self.assertEqual(
+            [p[0] for p in task_runner.CostModel().schedule(self.file_pairs)],
+            ['2015-01-02', '2015-01-03', '2015-01-01'])
+
+    def test_timings_of_earlier_runs(self):
+        path = os.path.join(self.tmp_dir, 'timings', 'costs.json')
+        cost_model = task_runner.CostModel(path)
+        cost_model.update(self.file_pairs[0], 100.)
+        cost_model.update(self.file_pairs[0], 200.)
+        self.assertEqual(cost_model.estimate(self.file_pairs[0]), 150.)
+        cost_model.save()
+
+        cost_model = task_runner.CostModel(path)
+        self.assertEqual(
+            [p[0] for p in cost_model.schedule(self.file_pairs)],
+            ['2015-01-01', '2015-01-02', '2015-01-03'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import datetime as dt
+import unittest
+
+import numpy as np
+
+from trollvalidation.data_collectors import tseries_generator
+
+
+class TestParseDates(unittest.TestCase):
+
+    def assert_as_strptime(self, time_strs, date_pattern):
+        expected = []
+        for time_str in time_strs:
+            if '%W' in date_pattern:
+                # the Mondays of the weeks
+                date = dt.datetime.strptime(time_str + '-1',
+                                            date_pattern + '-%w')
+            else:
+                date = dt.datetime.strptime(time_str, date_pattern)
+            expected.append(date.strftime('%Y-%m-%d'))
+        np.testing.assert_array_equal(
+            tseries_generator.parse_dates(time_strs, date_pattern),
+            np.array(expected, dtype='datetime64[D]'))
+
+    def test_days(self):
+        self.assert_as_strptime(['20150101', '20160229', '20151231'],
+                                '%Y%m%d')
+
+    def test_separators_and_times(self):
+        self.assert_as_strptime(['2015-03-01_1200', '1999-12-31_0000'],
+                                '%Y-%m-%d_%H%M')
+
+    def test_short_years(self):
+        self.assert_as_strptime(['680101', '690101', '991231'], '%y%m%d')
+
+    def test_weeks(self):
+        self.assert_as_strptime(['201500', '201501', '201552', '201653'],
+                                '%Y%W')
+
+    def test_variable_width(self):
+        self.assert_as_strptime(['2015-1-1', '2015-12-31'], '%Y-%m-%d')
+
+    def test_empty(self):
+        self.assertEqual(len(tseries_generator.parse_dates([], '%Y%m%d')), 0)
+
+    def test_mismatch(self):
+        self.assertRaises(ValueError, tseries_generator.parse_dates,
+                          ['2015010a'], '%Y%m%d')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,16 @@
 """
 Validation decorators
 """
+import threading
 import time
 import logging
 from functools import wraps
 from funcsigs import signature
 from collections import namedtuple
 
+from trollvalidation import profiling
+from trollvalidation.pipeline import Pipeline, Stage
+
 
 LOG = logging.getLogger(__name__)
 # logging.basicConfig(level=logging.DEBUG,
@@ -16,15 +20,41 @@ LOG = logging.getLogger(__name__)
 
 PreReturn = namedtuple('PreReturn', 'tmpfiles data_eval data_orig')
 
+# wall times of the validation steps run in this thread by reference time,
+# the task runner reports them back to the parent to estimate step costs,
+# per thread as a thread pool runs steps of the same date of both
+# hemispheres at the same time
+_local = threading.local()
+
+
+def _step_timings():
+    if not hasattr(_local, 'timings'):
+        _local.timings = {}
+    return _local.timings
+
+
+def pop_step_timing(ref_time, default=None):
+    """
+    :return: float
+        The wall time of the last validation step of a reference time, which
+        ran in this thread, or `default`.
+    """
+    return _step_timings().pop(ref_time, default)
+
 
 def timethis(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
+        ref_time = args[0]
+        profiling.start_step()
         start_time = time.time()
-        result = func(*args, **kwargs)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profiling.end_step(ref_time)
         end_time = time.time()
         d_time = end_time - start_time
-        ref_time = args[0]
+        _step_timings()[ref_time] = d_time
         LOG.info("Validation for {0} took {1}s.".format(ref_time, d_time))
         return result
 
@@ -32,79 +62,85 @@ def timethis(func):
 
 
 def around_step(pre_func=None, post_func=None):
-
-    def pre_actions(*args, **kwargs):
-        if not pre_func:
-            raise NotImplementedError('You have to provide an implementation'  
-                                      'for the pre-validation step!')
-        return pre_func(*args, **kwargs)
-
-    def post_actions(*args, **kwargs):
-        if post_func:
-            return post_func(*args, **kwargs)
-        else:
-            raise NotImplementedError('You have to provide an implementation'  
-                                      'for the post-validation step!')
+    """
+    Makes a function of the reference time and the evaluation and original
+    data a validation step of a file pair, which runs as a pipeline of a
+    'read' stage calling `pre_func` with the file pair, the 'metrics' stage
+    calling the function and a 'sink' stage calling `post_func` with the
+    result and the temporary files of `pre_func`, see
+    `trollvalidation.pipeline`. The temporary files are also handed to
+    `post_func`, with a result of None, when the step failed.
+
+    New validations should build their pipeline from finer stages instead,
+    like `ice_conc_validation.py`.
+
+    :raises: StageError
+        When calling the step and a stage failed.
+    """
+    if not pre_func:
+        raise NotImplementedError('You have to provide an implementation '
+                                  'for the pre-validation step!')
+    if not post_func:
+        raise NotImplementedError('You have to provide an implementation '
+                                  'for the post-validation step!')
 
     def decorate(func):
 
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            try:
-                ref_time, ice_chart_file, product_file = args[0], args[1], args[2]
-                results = pre_actions(ref_time, ice_chart_file, product_file)
-
-                temp_files = results.tmpfiles
-                data_eval, data_orig = results.data_eval, results.data_orig
+        def cleanup(values):
+            if 'prepared' in values and 'sunk' not in values:
+                post_func(None, values['prepared'].tmpfiles.tmpfiles)
 
-                results = func(ref_time, data_eval, data_orig)
-                post_actions(results, temp_files.tmpfiles)
+        step = Pipeline([
+            Stage('read', lambda ref_time, eval_file, orig_file: pre_func(
+                ref_time, eval_file, orig_file), provides='prepared'),
+            Stage('metrics', lambda ref_time, prepared: func(
+                ref_time, prepared.data_eval, prepared.data_orig),
+                provides='results'),
+            Stage('sink', lambda results, prepared: post_func(
+                results, prepared.tmpfiles.tmpfiles), provides='sunk'),
+        ], inputs=['ref_time', 'eval_file', 'orig_file'], cleanup=cleanup)
 
-                return results
-            except Exception, e:
-                LOG.exception(e)
+        @wraps(func)
+        def wrapper(ref_time, eval_file, orig_file):
+            return step.run(ref_time=ref_time, eval_file=eval_file,
+                            orig_file=orig_file)['results']
 
+        wrapper.pipeline = step
         return wrapper
 
     return decorate
 
 
-def around_task(pre_func=None, post_func=None):
+def _keywords(func, skip=0):
+    # the names of the keyword arguments, which a function takes
+    return set(list(signature(func).parameters)[skip:])
 
-    def pre_actions(*args, **kwargs):
-        if not pre_func:
-            raise NotImplementedError('You have to provide an implementation'
-                                      'for the pre-validation step!')
-        new_kwargs = {}
-        sig = signature(pre_func).parameters
-        for idx, (k, v) in enumerate(sig.iteritems()):
-            if k in kwargs.keys():
-                new_kwargs[k] = kwargs[k]
-
-        return pre_func(*args, **new_kwargs)
-
-    def post_actions(results, **kwargs):
-        if not post_func:
-            raise NotImplementedError('You have to provide an implementation'
-                                      'for the post-validation step!')
-
-        new_kwargs = {}
-        sig = signature(post_func).parameters
-        for idx, (k, v) in enumerate(sig.iteritems()):
-            if idx > 0:
-                if k in kwargs.keys():
-                    new_kwargs[k] = kwargs[k]
-                # else:
-                #     new_args.append(v)
-        return post_func(results, **new_kwargs)
+
+def around_task(pre_func=None, post_func=None):
+    """
+    Runs `pre_func` before and `post_func` after a validation task. Both
+    get the keyword arguments of the task, which they take, and `post_func`
+    gets the results of the task as first argument. The keywords are looked
+    up once, when the task is decorated.
+    """
+    if not pre_func:
+        raise NotImplementedError('You have to provide an implementation '
+                                  'for the pre-validation step!')
+    if not post_func:
+        raise NotImplementedError('You have to provide an implementation '
+                                  'for the post-validation step!')
+    pre_keywords = _keywords(pre_func)
+    post_keywords = _keywords(post_func, skip=1)
 
     def decorate(func):
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            results = pre_actions(*args, **kwargs)
+            results = pre_func(*args, **dict(
+                (k, v) for k, v in kwargs.iteritems() if k in pre_keywords))
             results = func(results, **kwargs)
-            post_actions(results, **kwargs)
+            post_func(results, **dict(
+                (k, v) for k, v in kwargs.iteritems() if k in post_keywords))
 
             return results
 
@@ -1,28 +1,46 @@
+import csv
 import gzip
 import logging
 import os
 import shutil
 import uuid
-from PIL import Image
+from datetime import date
 from zipfile import ZipFile
 
-import pandas as pd
 import numpy as np
-import pyresample as pr
 
+from trollvalidation import map_arena
+from trollvalidation import profiling
+from trollvalidation import results_store
+from trollvalidation.compact_grid import CompactGrid
+from trollvalidation.lazy import lazy_import
+from trollvalidation.map_store import MapStore
 from trollvalidation.validations import configuration as cfg
 
+Image = lazy_import('PIL.Image')
+pd = lazy_import('pandas')
+pr = lazy_import('pyresample')
+
 LOG = logging.getLogger(__name__)
 # logging.basicConfig(level=logging.DEBUG,
 #                     format='[%(levelname)s: %(asctime)s: %(name)s] %(message)s',
 #                     datefmt='%Y-%m-%d %H:%M:%S')
 
+# parsed area definitions and neighbour info for nearest neighbour
+# resampling, kept for the lifetime of a (worker) process
+_AREA_DEFS = {}
+_RESAMPLE_INFO = {}
+
 
 class TmpFiles(object):
     """docstring for TmpFiles"""
-    def __init__(self, files=[]):
+    def __init__(self, files=None):
         super(TmpFiles, self).__init__()
-        if isinstance(files, list):
+        if files is None:
+            # a new list per instance, the steps of a worker must not share
+            # their temporary files
+            self.tmpfiles = []
+        elif isinstance(files, list):
             self.tmpfiles = files
         else:
             self.tmpfiles = [files]
@@ -38,15 +56,96 @@ class TmpFiles(object):
 
 
 def cleanup(_, tmp_files):
-    # Delete files first and the remove directories
-    for tmp_file in tmp_files:
-        if os.path.isfile(tmp_file):
-            LOG.info("Cleaning up... {0}".format(tmp_file))
-            os.remove(tmp_file)
-    for tmp_folder in tmp_files:
-        if os.path.exists(tmp_folder):
-            LOG.info("Cleaning up... {0}".format(tmp_folder))
-            shutil.rmtree(tmp_folder)
+    with profiling.span('cleanup'):
+        # Delete files first and the remove directories
+        for tmp_file in tmp_files:
+            if os.path.isfile(tmp_file):
+                LOG.info("Cleaning up... {0}".format(tmp_file))
+                os.remove(tmp_file)
+        for tmp_folder in tmp_files:
+            if os.path.exists(tmp_folder):
+                LOG.info("Cleaning up... {0}".format(tmp_folder))
+                shutil.rmtree(tmp_folder)
+
+
+class CSVResultSink(object):
+    """
+    Append-only CSV file into which result rows are written one by one as
+    they arrive, so that nothing has to be collected in memory.
+
+    :param path: str
+        Path of the CSV file.
+    :param header: list
+        Column names, written when the file is created.
+    :param index: bool
+        Prepend the reference time as an index column, as pandas does in
+        `write_to_csv`.
+    """
+    def __init__(self, path, header=None, index=False):
+        super(CSVResultSink, self).__init__()
+        self.path = path
+        self.header = header
+        self.index = index
+
+    def iter_rows(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'rb') as fp:
+            reader = csv.reader(fp)
+            if self.header:
+                next(reader, None)
+            for row in reader:
+                if self.index:
+                    row = row[1:]
+                # skip a row cut off by a crash while writing
+                if self.header and len(row) != len(self.header):
+                    continue
+                yield row
+
+    def rows(self):
+        return list(self.iter_rows())
+
+    def ref_times(self):
+        return set(row[0] for row in self.iter_rows() if row)
+
+    def append(self, row):
+        is_new = not os.path.isfile(self.path)
+        with open(self.path, 'ab') as fp:
+            writer = csv.writer(fp)
+            if is_new and self.header:
+                writer.writerow([''] * self.index + list(self.header))
+            row = [_format_value(v) for v in row]
+            writer.writerow(row[:1] * self.index + row)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+
+class ResultsCheckpoint(CSVResultSink):
+    """
+    Append-only CSV file into which the result row of every validation step
+    is committed as soon as the step finished. A killed or crashed task can
+    be resumed from it without redoing the already validated steps.
+
+    :param name: str
+        Name of the checkpoint. It has to be stable across runs, i.e., it
+        should not contain the date of the run.
+    :param resume: bool
+        Keep the rows of earlier runs. Otherwise the checkpoint is reset.
+    """
+    def __init__(self, name, resume=True):
+        path = os.path.join(cfg.OUTPUT_DIR, '{0}_checkpoint.csv'.format(name))
+        super(ResultsCheckpoint, self).__init__(
+            path, header=getattr(cfg, 'CSV_HEADER', None))
+        if not resume and os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def _format_value(value):
+    if value is np.ma.masked:
+        return '--'
+    if isinstance(value, float):
+        return repr(float(value))
+    return value
 
 
 def write_to_csv(results, description_str=''):
@@ -62,6 +161,31 @@ def write_to_csv(results, description_str=''):
         df.to_csv(os.path.join(cfg.OUTPUT_DIR, '{0}_results.csv'.format(
             description_str)))
 
+
+def write_results(results, description_str=''):
+    """
+    Adds the results of a task to the columnar results store in
+    `RESULTS_DIR`, partitioned by hemisphere, product and year. Without
+    result rows, e.g. when they were streamed, the CSV file written by the
+    task is converted instead.
+    """
+    if not getattr(cfg, 'RESULTS_DIR', None):
+        return
+    hemisphere = 'SH' if '_SH_' in description_str else 'NH'
+    results = filter(lambda l: l, results)
+    if results:
+        df = results_store.to_frame(results, cfg.CSV_HEADER)
+    else:
+        csv_file = os.path.join(cfg.OUTPUT_DIR, '{0}_results.csv'.format(
+            description_str))
+        if not os.path.isfile(csv_file):
+            return
+        df = results_store.read_csv_report(csv_file)
+    store = results_store.ResultsStore(cfg.RESULTS_DIR)
+    for path in store.write(df, hemisphere, cfg.VALIDATION_ID):
+        LOG.info('Stored results in {0}'.format(path))
+
+
 def get_area_def(file_handle):
     """
     This function is a utility function to read the area definition
@@ -74,6 +198,20 @@ def get_area_def(file_handle):
         The parsed area definition corresponding to the projection
         and area extent of the product.
     """
+    return get_area_def_by_id(get_area_id(file_handle))
+
+
+def get_area_id(file_handle):
+    """
+    :param file_handle: str
+        Path to an ice concentration product or an ice chart.
+
+    :return: str
+        The id of the area definition of the file's grid in `AREAS`.
+
+    :raises: ValueError
+        If the grid of the file is unknown.
+    """
     file_name = os.path.basename(file_handle)
     if 'NH25kmEASE2' in file_name:
         cfg_id = 'EASE2_NH'
@@ -100,10 +238,52 @@ def get_area_def(file_handle):
         raise ValueError('No matching region for file {0}'.format(
             file_handle))
 
-    return pr.utils.parse_area_file('etc/areas.cfg', cfg_id)[0]
+    return cfg_id
 
 
-def uncompress(compressed_file, target=cfg.TMP_DIR):
+def load_area_defs():
+    """
+    Parses all area definitions in `AREAS` once. A relative path is relative
+    to the package, so that validations run from any directory.
+    """
+    if not _AREA_DEFS:
+        areas = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             getattr(cfg, 'AREAS', None) or 'etc/areas.cfg')
+        for area_def in pr.utils.parse_area_file(areas):
+            _AREA_DEFS[area_def.area_id] = area_def
+    return _AREA_DEFS
+
+
+def get_area_def_by_id(area_id):
+    return load_area_defs()[area_id]
+
+
+def resample_nearest(data, source_def, target_def, radius_of_influence):
+    """
+    Nearest neighbour resampling as done by pyresample's
+    `ImageContainerNearest`. The neighbour info only depends on the two
+    area definitions, so it is computed once per process and reused for
+    all images on the same grid.
+
+    :param data: np.array | np.ma.array
+        An image on the grid of `source_def`.
+
+    :return: np.array | np.ma.array
+        The image resampled to the grid of `target_def`.
+    """
+    key = (source_def.area_id, target_def.area_id, radius_of_influence)
+    if key not in _RESAMPLE_INFO:
+        _RESAMPLE_INFO[key] = pr.kd_tree.get_neighbour_info(
+            source_def, target_def, radius_of_influence, neighbours=1)
+    valid_input_index, valid_output_index, index_array, distance_array = \
+        _RESAMPLE_INFO[key]
+    return pr.kd_tree.get_sample_from_neighbour_info(
+        'nn', target_def.shape, data.ravel(), valid_input_index,
+        valid_output_index, index_array, distance_array=distance_array,
+        fill_value=0)
+
+
+def uncompress(compressed_file, target=None):
     """
     This function is a utility function to uncompress NetCDF files in
     case they are given that way.
@@ -128,6 +308,7 @@ def uncompress(compressed_file, target=cfg.TMP_DIR):
         return unpacked_filename, []
     elif extension == '.zip':
         LOG.info('Unpacking {0}'.format(compressed_file))
+        target = target or cfg.TMP_DIR
 
         tmp_id = str(uuid.uuid4())
         temporary_files_folder = os.path.join(target, tmp_id)
@@ -149,12 +330,48 @@ def uncompress(compressed_file, target=cfg.TMP_DIR):
         return compressed_file, []
 
 
+def get_map_arena(hemisphere, shape=None):
+    """
+    Opens the map arena of a hemisphere in `MAP_ARENA_DIR`. It spans a daily
+    slot for every day from `START_YEAR` to the end of `END_YEAR`.
+
+    :param shape: tuple
+        Shape of the maps, needed to create the arena. Without a shape only
+        an existing arena is opened.
+
+    :return: MapArena | None
+        None if the arena does not exist and cannot be created.
+    """
+    path = os.path.join(cfg.MAP_ARENA_DIR, '{0}_{1}'.format(
+        cfg.VALIDATION_ID, hemisphere))
+    if shape is None:
+        if not os.path.isfile(os.path.join(path, 'meta.json')):
+            return None
+        return map_arena.MapArena.open(path)
+    start = date(cfg.START_YEAR, 1, 1)
+    days = (date(cfg.END_YEAR + 1, 1, 1) - start).days
+    return map_arena.get_arena(path, shape, start.isoformat(), days)
+
+
 def dump_data(ref_time, eval_data, orig_data, orig_file):
+    if isinstance(eval_data, CompactGrid):
+        eval_data = eval_data.to_masked()
     hemisphere = 'NH'
     if '_sh_' in os.path.basename(orig_file) or \
         '_SH_' in os.path.basename(orig_file):
         hemisphere = 'SH'
 
+    if getattr(cfg, 'MAP_ARENA_DIR', None):
+        # hand the maps over through shared memory instead of files
+        arena = get_map_arena(hemisphere, np.shape(orig_data))
+        arena.write(ref_time, eval_data, orig_data)
+    if getattr(cfg, 'MAP_STORE', None):
+        # append the maps to the chunked store, no files to collect later
+        MapStore(cfg.MAP_STORE).append(hemisphere, ref_time, eval_data,
+                                       orig_data)
+    if getattr(cfg, 'MAP_ARENA_DIR', None) or getattr(cfg, 'MAP_STORE', None):
+        return
+
     out_path = os.path.join(cfg.OUTPUT_DIR, ref_time)
 
     if not os.path.exists(out_path):
@@ -1 +1,120 @@
-from ice_conc_450_configuration import *
+"""
+The configuration of a validation, which is read lazily on first use.
+
+The settings are the names in capitals of a settings module. By default it
+is `ice_conc_450_configuration` in this package. Set the environment
+variable `TROLLVALIDATION_CONFIG` to the name of another settings module in
+this package, e.g. 'ice_conc_configuration', or to the path of a Python
+file with the settings. Single settings are overridden by environment
+variables of the form `TROLLVALIDATION_<NAME>`, e.g.
+`TROLLVALIDATION_OUTPUT_DIR=/data/output`, whose values are read as JSON
+if possible and as strings otherwise.
+
+Importing this module is cheap. The settings module is loaded when the
+first setting is read, the directories in `DIRECTORIES` are created when
+they are read the first time and external tools are checked by
+`check_tools` when they are about to be used.
+
+Settings can be replaced at runtime, e.g. `cfg.OUTPUT_DIR = '/tmp'`.
+"""
+import imp
+import importlib
+import json
+import os
+import sys
+import types
+from distutils.spawn import find_executable
+
+DEFAULT_SETTINGS = 'ice_conc_450_configuration'
+ENV_PREFIX = 'TROLLVALIDATION_'
+# directories, which are created when they are read the first time
+DIRECTORIES = ['INPUT_DIR', 'OUTPUT_DIR', 'TMP_DIR']
+# packages providing the external tools
+TOOL_PACKAGES = {
+    'ogr2ogr': 'gdal-bin',
+    'gdal_rasterize': 'gdal-bin',
+    'lftp': 'lftp',
+}
+
+
+def _load_settings(name):
+    if name.endswith('.py') or os.sep in name:
+        module_name = os.path.splitext(os.path.basename(name))[0]
+        return imp.load_source('trollvalidation_settings_' + module_name,
+                               name)
+    return importlib.import_module('trollvalidation.validations.' + name)
+
+
+def _from_env(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class Configuration(types.ModuleType):
+    """
+    Module object of the configuration, which reads the settings on first
+    access.
+    """
+    def __init__(self, module):
+        super(Configuration, self).__init__(module.__name__, module.__doc__)
+        # keep the original module alive, Python 2 clears the globals of
+        # collected modules
+        self._module = module
+        self._settings = None
+        self._checked_tools = set()
+        self.__file__ = module.__file__
+
+    def _load(self):
+        if self._settings is None:
+            name = os.environ.get(ENV_PREFIX + 'CONFIG', DEFAULT_SETTINGS)
+            self._settings = _load_settings(name)
+        return self._settings
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not name.isupper():
+            raise AttributeError(name)
+        settings = self._load()
+        if ENV_PREFIX + name in os.environ:
+            value = _from_env(os.environ[ENV_PREFIX + name])
+        elif hasattr(settings, name):
+            value = getattr(settings, name)
+        else:
+            raise AttributeError(name)
+        if name in DIRECTORIES and value and not os.path.isdir(value):
+            try:
+                os.makedirs(value)
+            except OSError:
+                # created by another process in the meantime
+                pass
+        # later reads do not go through here anymore
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        names = set(self.__dict__)
+        names.update(n for n in dir(self._load()) if n.isupper())
+        names.update(n[len(ENV_PREFIX):] for n in os.environ
+                     if n.startswith(ENV_PREFIX))
+        return sorted(names)
+
+    def check_tools(self, *tools):
+        """
+        Checks once per process that external tools are installed, before
+        they are used.
+
+        :raises: Exception
+            If a tool is not found on the PATH.
+        """
+        for tool in tools:
+            if tool in self._checked_tools:
+                continue
+            if not find_executable(tool):
+                package = TOOL_PACKAGES.get(tool, tool)
+                raise Exception('You have to have "{0}" installed. Do '
+                                '"apt-get install {1}"!'.format(tool, package))
+            self._checked_tools.add(tool)
+
+
+sys.modules[__name__] = Configuration(sys.modules[__name__])
@@ -1,16 +1,27 @@
 import logging
-import multiprocessing as mp
+import os
+import sys
+from collections import OrderedDict
 from datetime import datetime, date
+from functools import partial
 import numpy.ma as ma
 
+import trollvalidation.area_masks as area_masks
 import trollvalidation.data_preparation as prep
+import trollvalidation.executors as executors
+import trollvalidation.map_store as map_store
+import trollvalidation.stage_cache as stage_cache
+import trollvalidation.task_runner as runner
 import trollvalidation.validation_functions as val_func
 import trollvalidation.validation_utils as util
 import trollvalidation.validations.configuration as cfg
+from trollvalidation.compact_grid import CompactGrid
+from trollvalidation.data_collectors import archive_index
 from trollvalidation.data_collectors import downloader
+from trollvalidation.data_collectors import mirror
 from trollvalidation.data_collectors import tseries_generator as ts
-from trollvalidation.validation_decorators import timethis, around_step, \
-    around_task, PreReturn
+from trollvalidation.pipeline import Pipeline, stage
+from trollvalidation.validation_decorators import timethis, around_task
 from trollvalidation.validation_utils import TmpFiles
 from trollvalidation.validation_utils import dump_data
 import configuration as config
@@ -23,85 +34,106 @@ logging.basicConfig(level=logging.DEBUG,
                     datefmt='%Y-%m-%d %H:%M:%S')
 
 
-def osi_ice_conc_pre_func(ref_time, eval_file, orig_file):
-    """
-    Functions like this are expected to return an instance of PreReturn.
-    """
-    temp_files = TmpFiles()
-
-    def prepare_orig_data():
-        """
-        This function describes how to come from a URL identifying an input
-        file to a NumPy array with the original data.
-
-        :return: np.array | np.ma.array
-        """
-        if not 'thredds' in orig_file:
-            # if the file is not on a thredds server download it...
-            local_orig_file = downloader.get(orig_file, cfg.INPUT_DIR)
-            # uncompress file if necessary
-            local_orig_file_uncompressed, _ = util.uncompress(local_orig_file)
-            orig_data = prep.handle_osi_ice_conc_nc_file(
-                local_orig_file_uncompressed)
-            temp_files.append([local_orig_file_uncompressed, local_orig_file])
-        else:
-            # otherwise give it directly to the Dataset reader
-            orig_data = prep.handle_osi_ice_conc_nc_file(orig_file)
-
-        return orig_data
-
-    def prepare_eval_data(orig_data):
-        local_eval_file = downloader.get(eval_file, cfg.INPUT_DIR)
-
-        # uncompress will return the unpacked shapefile in the staging directory
-        local_eval_file_uncompressed, _temp_files = util.uncompress(
-            local_eval_file)
-
-        temp_files.append(local_eval_file_uncompressed)
-        if temp_files:
-            temp_files.append(_temp_files)
-
-        if eval_file.endswith('.bin'):
-            # run the validation step with a driver for handling binary files
-            eval_data = prep.handle_binfile(local_eval_file_uncompressed,
-                                            orig_file, orig_data)
-        elif eval_file.endswith('.sig'):
-            # run the validation step with a driver for handling sigrid files
-            eval_data = prep.handle_sigfile(local_eval_file_uncompressed,
-                                            orig_file, orig_data)
-        elif eval_file.endswith('.zip'):
-            # run the validation step with a driver for handling shapefiles
-            eval_data = prep.handle_shapefile(local_eval_file_uncompressed,
-                                              orig_file, orig_data, temp_files)
-        else:
-            msg = 'I do not know how to open {0}'.format(eval_file)
-            raise NotImplementedError(msg)
-
-        return eval_data
-
-    orig_data = prepare_orig_data()
-    eval_data = prepare_eval_data(orig_data)
-
+# The stages of a validation step, see trollvalidation.pipeline. Their
+# parameters name the values they need: the inputs ref_time, eval_file (the
+# URL of the ice chart), orig_file (the URL of the product) and temp_files,
+# and the values provided by the other stages. The maps are cached, so that
+# reruns with other metrics skip the stages before the metrics.
+@stage('fetch', provides='local_orig_file')
+def fetch_product(orig_file):
+    if 'thredds' in orig_file and not mirror.enabled():
+        # products on a thredds server are given directly to the Dataset
+        # reader
+        return orig_file
+    local_orig_file = downloader.get(orig_file, cfg.INPUT_DIR)
+    index = archive_index.open_index(cfg)
+    if index:
+        index.record_file(orig_file, local_orig_file)
+        index.close()
+    return local_orig_file
+
+
+@stage('fetch', provides='local_eval_file')
+def fetch_chart(eval_file):
+    local_eval_file = downloader.get(eval_file, cfg.INPUT_DIR)
+    index = archive_index.open_index(cfg)
+    if index:
+        index.record_file(eval_file, local_eval_file)
+        index.mark(eval_file, archive_index.DOWNLOADED)
+        index.close()
+    return local_eval_file
+
+
+@stage('unpack', provides='product_path')
+def unpack_product(local_orig_file, orig_file, temp_files):
+    if local_orig_file == orig_file:
+        return orig_file
+    # uncompress file if necessary
+    product_path, _ = util.uncompress(local_orig_file)
+    temp_files.append([product_path, local_orig_file])
+    return product_path
+
+
+@stage('unpack', provides='chart_path')
+def unpack_chart(local_eval_file, temp_files):
+    # uncompress will return the unpacked shapefile in the staging directory
+    chart_path, _temp_files = util.uncompress(local_eval_file)
+    temp_files.append(chart_path)
+    temp_files.append(_temp_files)
+    return chart_path
+
+
+@stage('read', provides='orig_data', cacheable=True)
+def read_product(product_path):
+    return prep.handle_osi_ice_conc_nc_file(product_path)
+
+
+@stage('read', provides='chart')
+def read_chart(chart_path, eval_file):
+    return prep.read_chart(chart_path, os.path.splitext(eval_file)[1])
+
+
+@stage('reproject', provides='chart_codes', cacheable=True)
+def reproject_chart(chart, chart_path, orig_file, temp_files):
+    return prep.reproject_chart(chart, chart_path, orig_file, temp_files)
+
+
+@stage('decode', provides='eval_data', cacheable=True)
+def decode_chart(chart_codes, orig_data, eval_file, orig_file):
+    kind = os.path.splitext(eval_file)[1]
+    if getattr(cfg, 'COMPACT_GRIDS', False):
+        cells = area_masks.valid_cells(util.get_area_id(orig_file), orig_data)
+        return prep.decode_compact_chart(chart_codes, orig_data, kind, cells)
+    return prep.decode_chart(chart_codes, orig_data, kind)
+
+
+@stage('sink', provides='dumped')
+def dump_maps(ref_time, eval_file, orig_file, eval_data, orig_data):
+    index = archive_index.open_index(cfg)
+    if index:
+        index.mark(eval_file, archive_index.DECODED)
+        index.close()
     # Dump data to files for later visualization
     dump_data(ref_time, eval_data, orig_data, orig_file)
-
-    return PreReturn(temp_files, eval_data, orig_data)
-
-
-# def example_pre_func(ref_time, eval_file, orig_file):
-#     import numpy as np
-#     temp_files = TmpFiles()
-#     return PreReturn(temp_files, np.array([1, 2, 3, 4]),
-#                      np.array([1, 2, 3, 4]))
+    return True
 
 
 def collect_pickled_data():
     import os
-    import re
     import h5py
-    import numpy as np
     from glob import glob
-    from pandas import read_pickle
+
+    path_to_output = os.path.join(cfg.OUTPUT_DIR, cfg.PICKLED_DATA)
+    if getattr(cfg, 'MAP_ARENA_DIR', None):
+        # the maps are in the shared memory arenas, no files to collect
+        hdf5 = h5py.File(path_to_output, 'w')
+        data_grp = hdf5.create_group('maps')
+        for hemisphere in ['NH', 'SH']:
+            arena = util.get_map_arena(hemisphere)
+            if arena:
+                arena.to_hdf5(data_grp, hemisphere)
+        hdf5.close()
+        return
 
     dir_ptn = '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
     dir_ptn = os.path.join(cfg.OUTPUT_DIR, dir_ptn)
@@ -115,73 +147,224 @@ def collect_pickled_data():
                  ('data/SH/satellite', sh_orig_files),
                  ('data/SH/reference', sh_eval_files)]
 
-    def read_pkl(path):
-        date_str = re.search('\d{4}-\d{2}-\d{2}', path).group(0)
-        return date_str, read_pickle(path)
+    # stream the maps out of core instead of stacking them in memory
+    map_store.collect_dumps(path_to_output, ds_source)
 
-    def stack_data(file_list):
-        dates_n_data = map(read_pkl, file_list)
-        dates, datas = zip(*dates_n_data)
-        masks = np.dstack((d.mask for d in datas))
-        datas = np.dstack(datas)
-        datas = ma.array(datas, mask=masks, fill_value=np.nan)
-        return dates, datas
 
-    path_to_output = os.path.join(cfg.OUTPUT_DIR, cfg.PICKLED_DATA)
-    hdf5 = h5py.File(path_to_output, 'w')
-    data_grp = hdf5.create_group('maps')
-    for ds_name, files in ds_source:
-        if files:
-            dates, data = stack_data(files)
-            ds = data_grp.create_dataset(ds_name, data.shape, data=data.filled(),
-                                         dtype='f', compression="gzip")
-            ds.attrs['dates'] = np.array(dates)
-    hdf5.close()
+def val_step_star(input_tuple):
+    return ice_conc_val_step(*input_tuple)
 
 
+# the metrics of a step in the order of their columns in CSV_HEADER, METRICS
+# of the configuration selects a subset, the other columns are left empty
+METRICS = OrderedDict([
+    ('intermediate_bias', val_func.intermediate_bias),
+    ('ice_bias', val_func.ice_bias),
+    ('water_bias', val_func.water_bias),
+    ('intermediate_stddev', val_func.intermediate_std_dev),
+    ('ice_stddev', val_func.ice_std_dev),
+    ('water_stddev', val_func.water_std_dev),
+    ('within_10pct', partial(val_func.match_pct, threshold=10.)),
+    ('within_20pct', partial(val_func.match_pct, threshold=20.)),
+])
 
-def val_step_star(input_tuple):
-    return ice_conc_val_step(*input_tuple)
+
+@stage('metrics', provides='results')
+def compute_metrics(ref_time, eval_data, orig_data, orig_file):
+    run_time = datetime.now().strftime('%Y-%m-%d %H:%m:%S')
+    selected = getattr(cfg, 'METRICS', None) or METRICS.keys()
+    # the metrics only need the cells, which are valid in both maps
+    if isinstance(eval_data, CompactGrid):
+        eval_data, orig_data = eval_data.take(orig_data)
+    else:
+        cells = area_masks.valid_cells(util.get_area_id(orig_file), orig_data)
+        eval_data, orig_data = area_masks.compress(eval_data, orig_data,
+                                                   cells)
+    metrics = [func(eval_data, orig_data) if name in selected
+               else None for name, func in METRICS.iteritems()]
+
+    return [ref_time, run_time] + metrics
+
+
+def all_metrics():
+    """
+    :return: bool
+        True unless METRICS of the configuration selects a subset.
+    """
+    return set(getattr(cfg, 'METRICS', None) or METRICS) >= set(METRICS)
+
+
+def _file_checksums(values):
+    # results of files, whose content changed since an earlier run, are not
+    # taken from the stage cache
+    index = archive_index.open_index(cfg)
+    if not index:
+        return {}
+    checksums = index.checksums([values['eval_file'], values['orig_file']])
+    index.close()
+    return {'eval_file': checksums.get(values['eval_file']),
+            'orig_file': checksums.get(values['orig_file'])}
+
+
+def _cleanup(values):
+    util.cleanup(values.get('results'), values['temp_files'].tmpfiles)
+
+
+_pipeline = None
+
+
+def step_pipeline():
+    """
+    :return: Pipeline
+        The pipeline of the validation steps, which is built once per
+        process.
+    """
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = Pipeline(
+            [fetch_product, fetch_chart, unpack_product, unpack_chart,
+             read_product, read_chart, reproject_chart, decode_chart,
+             compute_metrics, dump_maps],
+            inputs=['ref_time', 'eval_file', 'orig_file', 'temp_files'],
+            threads=getattr(cfg, 'PIPELINE_THREADS', None) or 1,
+            cache=stage_cache.open_cache(cfg), cleanup=_cleanup,
+            side_inputs=['temp_files'],
+            version=getattr(cfg, 'CODE_VERSION', None),
+            input_keys=_file_checksums)
+    return _pipeline
 
 
 @timethis
-@around_step(pre_func=osi_ice_conc_pre_func, post_func=util.cleanup)
-def ice_conc_val_step(ref_time, data_eval, data_orig):
-    run_time = datetime.now().strftime('%Y-%m-%d %H:%m:%S')
-    bias_t = val_func.intermediate_bias(data_eval, data_orig)
-    bias_i = val_func.ice_bias(data_eval, data_orig)
-    bias_w = val_func.water_bias(data_eval, data_orig)
-    stddev_t = val_func.intermediate_std_dev(data_eval, data_orig)
-    stddev_i = val_func.ice_std_dev(data_eval, data_orig)
-    stddev_w = val_func.water_std_dev(data_eval, data_orig)
-    within_10pct = val_func.match_pct(data_eval, data_orig, 10.)
-    within_20pct = val_func.match_pct(data_eval, data_orig, 20.)
+def ice_conc_val_step(ref_time, eval_file, orig_file):
+    values = step_pipeline().run(ref_time=ref_time, eval_file=eval_file,
+                                 orig_file=orig_file, temp_files=TmpFiles())
+    return values['results']
 
-    return [ref_time, run_time, bias_t, bias_i, bias_w, stddev_t, stddev_i,
-            stddev_w, within_10pct, within_20pct]
+
+def validate_hemispheres(tasks, descriptions, checkpoints=None, resume=False,
+                         streaming=False, executor=None, report=None):
+    """
+    Runs the validation steps of one or both hemispheres interleaved in one
+    queue and keeps the archive index up to date.
+
+    :param tasks: OrderedDict
+        Mapping of 'nh'/'sh' to the file pairs of the hemisphere.
+    :param descriptions: dict
+        Mapping of 'nh'/'sh' to the short description of the task, which
+        names the CSV file.
+    :param checkpoints: dict
+        Mapping of 'nh'/'sh' to the names of the checkpoints.
+    :param report: dict
+        Mapping of 'nh'/'sh' to the reference dates, whose rows stored in
+        the archive index are returned, e.g. those of a date range of which
+        only some pairs are pending. All stored rows without.
+
+    :return: dict
+        Mapping of 'nh'/'sh' to the result rows, which are empty when
+        streaming as the CSV files are written already.
+    """
+    checkpoints = dict((hemis, util.ResultsCheckpoint(name, resume=resume))
+                       for hemis, name in (checkpoints or {}).iteritems()
+                       if name)
+    index = archive_index.open_index(cfg)
+    # rows of a subset of the metrics leave the pairs pending for a full run
+    complete = all_metrics()
+    report = report or {}
+
+    if streaming:
+        # write each row while the steps finish instead of collecting them,
+        # the CSV files are then complete and write_to_csv has nothing to do
+        sinks = {}
+        for hemis in tasks:
+            csv_file = os.path.join(cfg.OUTPUT_DIR, '{0}_results.csv'.format(
+                descriptions[hemis]))
+            if os.path.isfile(csv_file):
+                os.remove(csv_file)
+            sinks[hemis] = [util.CSVResultSink(csv_file, cfg.CSV_HEADER,
+                                               index=True)]
+            if index:
+                sinks[hemis].append(archive_index.IndexSink(index, hemis,
+                                                                complete))
+        runner.stream_tasks(val_step_star, tasks, sinks,
+                            checkpoints=checkpoints, executor=executor)
+        results = dict((hemis, []) for hemis in tasks)
+    else:
+        results = runner.run_tasks(val_step_star, tasks,
+                                   checkpoints=checkpoints, executor=executor)
+        if index:
+            # keep track of the processed pairs and report the validated ones
+            for hemis, file_pairs in tasks.iteritems():
+                index.record_results(hemis, file_pairs, results[hemis],
+                                     complete)
+                results[hemis] = index.results(hemis, report.get(hemis))
+
+    if index:
+        index.close()
+    return results
 
 
 @around_task(pre_func=ts.generate_time_series, post_func=util.write_to_csv)
-def ice_conc_val_task(file_pairs, description='', description_str=''):
+def ice_conc_val_task(file_pairs, description='', description_str='',
+                      checkpoint=None, resume=False, streaming=False,
+                      executor=None):
     LOG.info(description)
     LOG.info(description_str)
 
-    pool = mp.Pool(processes=mp.cpu_count())
-    # pool = mp.Pool(processes=1)
-    results = pool.map(val_step_star, file_pairs)
-    pool.close()
+    hemis = 'sh' if '_SH_' in description_str else 'nh'
+    return validate_hemispheres({hemis: file_pairs}, {hemis: description_str},
+                                {hemis: checkpoint}, resume, streaming,
+                                executor)[hemis]
 
+
+def run_validation(tasks, resume=False, streaming=False, processes=None,
+                   report=None):
+    """
+    Runs a validation with the executor of the configuration, writes the
+    results of every hemisphere and collects the maps.
+
+    :param tasks: OrderedDict
+        Mapping of 'nh'/'sh' to the file pairs of the hemisphere.
+    :param processes: int
+        Number of worker processes, which overrides the configured number of
+        (local) workers of the executor.
+    :param report: dict
+        See `validate_hemispheres`.
+    """
+    descriptions = dict((hemis, config.SHORT_DESCRIPTION.format(
+        hemis.upper(), date.today())) for hemis in tasks)
+    checkpoints = dict((hemis, config.SHORT_DESCRIPTION.format(
+        hemis.upper(), 'run')) for hemis in tasks)
+    executor_cfg = dict(getattr(cfg, 'EXECUTOR', {}))
+    if processes:
+        if executor_cfg.get('backend', 'local') == 'distributed':
+            executor_cfg['local_workers'] = processes
+        else:
+            executor_cfg['processes'] = processes
+
+    # one executor for the whole run, the steps of both hemispheres share a
+    # queue
+    with executors.get_executor(**executor_cfg) as executor:
+        results = validate_hemispheres(tasks, descriptions, checkpoints,
+                                       resume, streaming, executor, report)
+    for hemis in tasks:
+        util.write_to_csv(results[hemis], descriptions[hemis])
+        util.write_results(results[hemis], descriptions[hemis])
+
+    if getattr(cfg, 'PICKLED_DATA', None) and \
+            not getattr(cfg, 'MAP_STORE', None):
+        collect_pickled_data()
     return results
 
 
 if __name__ == '__main__':
-    desc = config.DESCRIPTION.format('northern')
-    desc_str = config.SHORT_DESCRIPTION.format('NH', date.today())
-    ice_conc_val_task(description=desc, description_str=desc_str)
-
-    desc = config.DESCRIPTION.format('southern')
-    desc_str = config.SHORT_DESCRIPTION.format('SH', date.today())
-    ice_conc_val_task(description=desc, description_str=desc_str)
-
-    if 'PICKLED_DATA' in cfg.__dict__.keys():
-        collect_pickled_data()
+    # stream results to the CSV files with --stream and continue an
+    # interrupted run with: python ice_conc_450_validation.py --resume
+    # the trollvalidation command runs parts of the validation
+    resume = '--resume' in sys.argv
+    streaming = '--stream' in sys.argv
+
+    LOG.info(config.DESCRIPTION.format('northern'))
+    LOG.info(config.DESCRIPTION.format('southern'))
+    nh_pairs, sh_pairs = ts.generate_time_series()
+    run_validation(OrderedDict([('nh', nh_pairs), ('sh', sh_pairs)]),
+                   resume, streaming)
@@ -1,6 +1,5 @@
 import os
 import datetime
-import pandas as pd
 
 # for OSI-450 validation
 YEARS_OF_INTEREST = range(1972, 2016)
@@ -10,6 +9,15 @@ VALIDATION_ID = 'OSI450'
 CSV_HEADER = ['reference_time', 'run_time', 'total_bias', 'ice_bias',
               'water_bias', 'total_stddev', 'ice_stddev', 'water_stddev',
               'within_10pct', 'within_20pct']
+# names of the metrics, which are computed, e.g. ['ice_bias', 'water_bias'],
+# the columns of the other metrics are left empty. None computes all of them.
+METRICS = None
+# charts are paired with the products up to COLOCATION_WINDOW days before or
+# after them, with the 'nearest' product or with 'all' of them, which are then
+# validated at the dates of the products, see
+# trollvalidation.data_collectors.colocation
+COLOCATION_WINDOW = 3
+COLOCATION_MODE = 'nearest'
 
 START_YEAR = min(YEARS_OF_INTEREST)
 END_YEAR = max(YEARS_OF_INTEREST)
@@ -25,10 +33,56 @@ OUTPUT_DIR = os.path.join(BASE_PATH, 'output')
 TMP_DIR = os.path.join(BASE_PATH, 'input', 'tmp')
 
 AREAS = 'etc/areas.cfg'
+# decode the charts on the cells, which are valid in the chart and in the
+# product, only and keep just these cells and their values, see
+# trollvalidation.compact_grid
+COMPACT_GRIDS = False
 DESCRIPTION = 'Comparison of NIC ice charts and OSI-450 products for {0}' \
 ' hemisphere'
 SHORT_DESCRIPTION = 'OSI450_validation_{0}_{1}'  # hemisphere, date
 PICKLED_DATA = 'OSI450_val_data.hdf5'
+# catalogue of remote files and processing state of the validation pairs,
+# bump CODE_VERSION to revalidate all pairs after changing the validation
+ARCHIVE_INDEX = os.path.join(BASE_PATH, 'archive_index.sqlite')
+CODE_VERSION = '1.0'
+# mean step timings of earlier runs to schedule expensive steps first
+TIMINGS_FILE = os.path.join(BASE_PATH, 'step_timings.json')
+# resamplings (source area, target area) prepared once by every worker
+WARM_RESAMPLING = [('NIC_EASE_NH', 'EASE2_NH')]
+# how to run the validation steps, see trollvalidation.executors, e.g.
+# {'backend': 'distributed', 'address': ('', 50000), 'authkey': 'secret'}
+EXECUTOR = {'backend': 'local'}
+# threads of a worker running the independent stages of a step at the same
+# time, e.g. 2 to download the chart and the product concurrently
+PIPELINE_THREADS = 1
+# cache of the decoded maps of the steps, keyed by the file pair and the code
+# of the stages, so that reruns, e.g. with other metrics, neither download nor
+# decode the charts again, see trollvalidation.stage_cache. The least recently
+# used maps are evicted beyond STAGE_CACHE_SIZE bytes. Bump CODE_VERSION or
+# set STAGE_CACHE_DIR to None to decode all charts again.
+STAGE_CACHE_DIR = os.path.join(BASE_PATH, 'stage_cache')
+STAGE_CACHE_SIZE = 20 * 2 ** 30
+# directory of the shared memory arenas of the decoded maps, e.g. on /dev/shm,
+# which replace the per date .bmp and .pkl dumps, see trollvalidation.map_arena
+MAP_ARENA_DIR = None
+# MAP_ARENA_DIR = os.path.join('/dev/shm', VALIDATION_ID)
+# chunked HDF5 file of all maps of shape (time, y, x), which the workers append
+# to directly, see trollvalidation.map_store. Set it to None to dump the maps
+# into per date files and collect them into PICKLED_DATA after the run.
+MAP_STORE = os.path.join(OUTPUT_DIR, '{0}_maps.h5'.format(VALIDATION_ID))
+# typed results partitioned by hemisphere, product and year, which analysis and
+# plotting load without parsing the CSV files, see trollvalidation.results_store
+RESULTS_DIR = os.path.join(OUTPUT_DIR, 'results')
+# per run reports of the time, CPU, I/O and memory of every stage of the steps
+PROFILE_DIR = os.path.join(OUTPUT_DIR, 'profiles')
+# local mirror of all remote archives laid out as MIRROR_DIR/<host>/<remote path>,
+# e.g. as created by `wget --mirror`, from which all *_DOWNL files are listed and
+# read instead of the remote servers, see trollvalidation.data_collectors.mirror
+MIRROR_DIR = None
+# URL of a server of a mirror, e.g. 'http://localhost:8000' as started with
+# `python -m trollvalidation.data_collectors.mirror MIRROR_DIR 8000`, for workers
+# without access to MIRROR_DIR. It takes precedence over MIRROR_DIR.
+MIRROR_URL = None
 
 # for OSI-409 validation
 METNO_DOWNL = {
@@ -96,9 +150,9 @@ NIC_SHP_DOWNL = {
 
 # http://thredds.met.no/thredds/dodsC/osisaf/met.no/ice/conc/2016/09/ice_conc_sh_polstere-100_multi_201609211200.nc
 METNO_THREDDS_DOWNL = {
-    'generate':
-        pd.date_range('1/1/{0} 12:00'.format(START_YEAR),
-                      '1/1/{0} 12:00'.format(END_YEAR), freq='D'),
+    # daily from the first to the last date, the dates are generated on use
+    'generate': ('1/1/{0} 12:00'.format(START_YEAR),
+                 '1/1/{0} 12:00'.format(END_YEAR)),
     'protocol': 'http://',
     'host': 'thredds.met.no',
     'remote_dir_f_pattern':
@@ -107,24 +161,3 @@ METNO_THREDDS_DOWNL = {
     'remote_date_pattern': (r'\d{12}', '%Y%m%d%H%M'),
     'glob_file': os.path.join(TMP_DIR, 'metno_thredds_files.json')
 }
-
-
-if not os.path.exists(INPUT_DIR):
-    os.system('mkdir -p {0}'.format(INPUT_DIR))
-if not os.path.exists(OUTPUT_DIR):
-    os.system('mkdir -p {0}'.format(OUTPUT_DIR))
-if not os.path.exists(TMP_DIR):
-    os.system('mkdir -p {0}'.format(TMP_DIR))
-
-try:
-    import apt
-except Exception as e:
-    print("No python-apt installed, I wont check for gdal-bin and lftp...")
-else:
-    cache = apt.Cache()
-    if not cache['gdal-bin'].is_installed:
-        raise Exception('You have to have "gdal-bin" installed. Do "apt-get '
-                        'install gdal-bin"!')
-    if not cache['lftp'].is_installed:
-        raise Exception('You have to have "lftp" installed. Do "apt-get '
-                        'install lftp"!')
@@ -2,7 +2,7 @@ import logging
 import random
 import string
 import numpy as np
-import multiprocessing as mp
+import trollvalidation.task_runner as runner
 import trollvalidation.validation_utils as util
 import trollvalidation.validation_functions as val_func
 
@@ -71,11 +71,7 @@ def val_task(file_pairs, description='', description_str=''):
     LOG.info(description)
     LOG.info(description_str)
 
-    pool = mp.Pool(processes=mp.cpu_count())
-    results = pool.map(val_step_star, file_pairs)
-    pool.close()
-
-    return results
+    return runner.run_steps(val_step_star, file_pairs)
 
 
 if __name__ == '__main__':